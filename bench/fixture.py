@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# fixture.py: Automatic management tool for an arch repo.
+# This file is part of Buildbot by JerryXiao
+
+# synthetic repo for the benchmarks
+# workspace/repo      -- like buildbot/repo, see repo.py
+# workspace/pkgbuilds -- like buildbot/pkgbuilds, with autobuild.yaml
+
+import io
+import os
+import random
+import tarfile
+from pathlib import Path
+
+BENCH_DIR = Path(os.path.dirname(os.path.abspath(__file__)))
+STUBS_DIR = BENCH_DIR / 'stubs'
+REPO_ARCHS = ['aarch64', 'any', 'armv7h', 'x86_64']
+BUILD_ARCHS = ['aarch64', 'x86_64']
+
+def use_stubs():
+    '''
+        put the makepkg, gpg, rsync, repo-add, repo-remove and vercmp stubs first in PATH
+    '''
+    path = os.environ.get('PATH', '')
+    if not path.startswith(f'{STUBS_DIR}:'):
+        os.environ['PATH'] = f'{STUBS_DIR}:{path}'
+
+def pkgfname(pkgname, ver, arch, rel=1):
+    return f'{pkgname}-{ver}-{rel}-{arch}.pkg.tar.xz'
+
+def write_pkg(basedir, fname, size=4096, sig=True):
+    '''
+        random content, so that nothing is sparse or deduplicated
+    '''
+    fpath = basedir / fname
+    with open(fpath, 'wb') as f:
+        f.write(os.urandom(size))
+    if sig:
+        with open(f'{fpath}.sig', 'wb') as f:
+            f.write(os.urandom(566))
+    return fpath
+
+def write_real_pkg(basedir, pkgname, ver, arch, files=20, depends=(), provides=(), sig=True):
+    '''
+        a tar.xz with a .PKGINFO and empty files, for pkgindex.py
+    '''
+    fname = pkgfname(pkgname, ver, arch)
+    pkginfo = [f'pkgname = {pkgname}', f'pkgbase = {pkgname}', f'pkgver = {ver}-1',
+               f'pkgdesc = synthetic package {pkgname} for benchmarks', f'url = https://example.org/{pkgname}',
+               'builddate = 1700000000', 'packager = bench <bench@example.org>', f'size = {files * 1024}',
+               f'arch = {arch}', 'license = MIT']
+    pkginfo += [f'depend = {d}' for d in depends] + [f'provides = {p}' for p in provides]
+    def add(tar, name, data):
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        tar.addfile(info, io.BytesIO(data))
+    with tarfile.open(basedir / fname, 'w:xz') as tar:
+        add(tar, '.PKGINFO', ('\n'.join(pkginfo) + '\n').encode('utf-8'))
+        add(tar, f'usr/bin/{pkgname}', b'')
+        for i in range(files - 1):
+            add(tar, f'usr/share/{pkgname}/file{i:03d}', b'')
+    if sig:
+        with open(basedir / f'{fname}.sig', 'wb') as f:
+            f.write(os.urandom(566))
+    return basedir / fname
+
+def pkg_arch(index):
+    '''
+        most packages are built for both arches, some are arch=any
+    '''
+    if index % 10 == 0:
+        return ['any']
+    return BUILD_ARCHS
+
+def make_repo(workspace, packages=500, versions=2, archived=3, updates=50, size=4096):
+    '''
+        www/<arch>: versions of every package (older ones get recycled)
+        archive/: archived versions of every package
+        updates/: new versions of the first packages
+    '''
+    root = Path(workspace) / 'repo'
+    dirs = [root / 'updates', root / 'archive', root / 'recycled'] + \
+           [root / 'www' / arch for arch in REPO_ARCHS]
+    for mydir in dirs:
+        mydir.mkdir(mode=0o755, exist_ok=True, parents=True)
+    (root / 'www' / 'archive').symlink_to('../archive')
+    for i in range(packages):
+        pkgname = f'bench-pkg{i:05d}'
+        for arch in pkg_arch(i):
+            for v in range(1, versions + 1):
+                write_pkg(root / 'www' / arch, pkgfname(pkgname, f'1.{v}', arch), size=size)
+            for v in range(1, archived + 1):
+                write_pkg(root / 'archive', pkgfname(pkgname, f'0.{v}', arch), size=size)
+            if i < updates:
+                write_pkg(root / 'updates', pkgfname(pkgname, f'2.{i % 7}', arch), size=size)
+    return root
+
+def make_pkgbuilds(workspace, packages=500, git_ratio=0.2, seed=0):
+    '''
+        one dir per package with a PKGBUILD and an autobuild.yaml
+    '''
+    rnd = random.Random(seed)
+    root = Path(workspace) / 'pkgbuilds'
+    root.mkdir(mode=0o755, exist_ok=True, parents=True)
+    for i in range(packages):
+        git = rnd.random() < git_ratio
+        dirname = f'bench-pkg{i:05d}{"-git" if git else ""}'
+        mydir = root / dirname
+        mydir.mkdir(mode=0o755, exist_ok=True)
+        archs = ' '.join([f"'{arch}'" for arch in pkg_arch(i)])
+        with open(mydir / 'PKGBUILD', 'w') as f:
+            f.write(f"pkgname=('{dirname}')\npkgver=1.{i % 9}\npkgrel=1\n"
+                    f"arch=({archs})\nsource=()\n")
+        with open(mydir / 'autobuild.yaml', 'w') as f:
+            f.write(f"type: {'git' if git else 'manual'}\ncleanbuild: {'true' if i % 2 else 'false'}\n"
+                    f"timeout: {30 + i % 60}\npriority: {i % 3}\n")
+            if i % 4 == 0:
+                f.write("extra:\n    - prebuild:\n        - echo prebuild\n"
+                        "    - postbuild:\n        - ls > list\n")
+    return root
@@ -0,0 +1,580 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# run.py: Automatic management tool for an arch repo.
+# This file is part of Buildbot by JerryXiao
+
+# benchmarks on a synthetic repo, results are printed as json
+#   python bench/run.py -o bench.json
+#   python bench/run.py -b regenerate,update -p 2000
+# makepkg, gpg, rsync, repo-add, repo-remove and vercmp are stubbed (bench/stubs),
+# so the numbers are the overhead of buildbot itself
+
+import os
+import sys
+import json
+import logging
+import platform
+import subprocess
+import statistics
+from contextlib import contextmanager
+from multiprocessing.connection import Listener, Client
+from pathlib import Path
+from shutil import rmtree
+from tempfile import mkdtemp
+from threading import Thread
+from time import perf_counter, time, sleep
+
+import fixture
+
+ROOT = fixture.BENCH_DIR.parent
+sys.path.insert(0, str(ROOT))
+
+from shared_vars import PKG_SUFFIX
+
+fixture.use_stubs()
+
+logger = logging.getLogger('buildbot')
+
+@contextmanager
+def cwd(path):
+    oldcwd = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(oldcwd)
+
+class benchRunner:
+    def __init__(self, args):
+        self.args = args
+        self.results = dict()
+    @contextmanager
+    def workspace(self):
+        ws = Path(mkdtemp(prefix='buildbot-bench-', dir=self.args.tmpdir))
+        try:
+            yield ws
+        finally:
+            if not self.args.keep:
+                rmtree(ws, ignore_errors=True)
+    def measure(self, name, setup, func, repeat=None, **params):
+        '''
+            setup(workspace) is not timed, func(workspace, state) is
+        '''
+        runs = list()
+        for _ in range(repeat if repeat else self.args.repeat):
+            with self.workspace() as ws:
+                state = setup(ws)
+                start = perf_counter()
+                func(ws, state)
+                runs.append(perf_counter() - start)
+        self.results[name] = {'runs': runs, 'min': min(runs),
+                              'median': statistics.median(runs), 'params': params}
+        print(f'{name}: min {min(runs):.4f}s median {statistics.median(runs):.4f}s',
+              file=sys.stderr)
+    def repo_fixture(self, ws):
+        a = self.args
+        return fixture.make_repo(ws, packages=a.packages, versions=a.versions,
+                                 archived=a.archived, updates=a.updates, size=a.size)
+    def bench_filter_old_pkg(self):
+        import repo
+        def setup(ws):
+            root = self.repo_fixture(ws)
+            basedir = root / 'www' / 'x86_64'
+            return [f for f in basedir.iterdir() if f.name.endswith(PKG_SUFFIX)]
+        def func(ws, fpaths):
+            repo.filter_old_pkg(fpaths, keep_new=1)
+        self.measure('filter_old_pkg', setup, func, packages=self.args.packages,
+                     versions=self.args.versions)
+    def bench_regenerate(self):
+        import repo
+        jobs = self.args.jobs if self.args.jobs else repo.REGENERATE_JOBS
+        def func(ws, root):
+            with cwd(root):
+                repo._regenerate(jobs=jobs)
+        self.measure('regenerate', self.repo_fixture, func, packages=self.args.packages,
+                     versions=self.args.versions, jobs=jobs)
+    def bench_update(self):
+        import repo
+        def func(ws, root):
+            with cwd(root):
+                repo._update()
+        self.measure('update', self.repo_fixture, func, updates=self.args.updates,
+                     size=self.args.size)
+    def bench_publish(self):
+        '''
+            _update with large packages, once per publish method
+        '''
+        import repo
+        a = self.args
+        def setup(ws):
+            return fixture.make_repo(ws, packages=a.large_updates, versions=1, archived=0,
+                                     updates=a.large_updates, size=a.large_size)
+        def func(ws, root):
+            with cwd(root):
+                repo._update()
+        default = repo.PUBLISH_METHODS
+        try:
+            for method in ('hardlink', 'reflink', 'kernel', 'userspace'):
+                repo.PUBLISH_METHODS = [method, 'userspace']
+                self.measure(f'publish_{method}', setup, func, updates=a.large_updates,
+                             size=a.large_size)
+        finally:
+            repo.PUBLISH_METHODS = default
+    def bench_remove(self):
+        import repo
+        count = max(1, self.args.packages // 10)
+        pkgnames = [f'bench-pkg{i:05d}' for i in range(count)]
+        def func(ws, root):
+            with cwd(root):
+                repo._remove(pkgnames)
+        self.measure('remove', self.repo_fixture, func, removed=count,
+                     packages=self.args.packages)
+    def bench_clean_archive(self):
+        import repo
+        def func(ws, root):
+            with cwd(root):
+                repo._clean_archive(keep_new=1)
+        self.measure('clean_archive', self.repo_fixture, func, packages=self.args.packages,
+                     archived=self.args.archived)
+    def bench_store(self):
+        '''
+            _store_existing on a repo where archive holds copies of www,
+            as _update left it before publishing with hardlinks
+        '''
+        import repo
+        from shutil import copyfile
+        def disk_usage(root):
+            inodes = dict()
+            for fpath in root.rglob('*'):
+                if fpath.is_file() and not fpath.is_symlink():
+                    st = fpath.stat()
+                    inodes[st.st_ino] = st.st_size
+            return sum(inodes.values())
+        def setup(ws):
+            root = self.repo_fixture(ws)
+            for fpath in (root / 'www').glob('*/*'):
+                if fpath.is_file() and not fpath.is_symlink() and fpath.parent.name != 'archive':
+                    copyfile(fpath, root / 'archive' / fpath.name)
+            return root
+        usage = dict()
+        def func(ws, root):
+            usage['before'] = disk_usage(root)
+            with cwd(root):
+                repo._store_existing()
+            usage['after'] = disk_usage(root)
+        self.measure('store', setup, func, packages=self.args.packages,
+                     versions=self.args.versions)
+        self.results['store']['bytes'] = usage
+    def bench_pkgindex(self):
+        '''
+            indexing real packages, then queries against the index
+        '''
+        from pkgindex import pkgIndex
+        packages = self.args.index_packages
+        queries = {'search': 'bench-pkg0001', 'provides': 'libbench5.so', 'owns': '/usr/bin/bench-pkg00042',
+                   'depends': 'bench-pkg00003', 'info': 'bench-pkg00007'}
+        latency = dict()
+        def setup(ws):
+            www = ws / 'www' / 'x86_64'
+            www.mkdir(parents=True)
+            for i in range(packages):
+                fixture.write_real_pkg(www, f'bench-pkg{i:05d}', f'1.{i % 9}', 'x86_64',
+                                       files=self.args.index_files,
+                                       depends=[f'bench-pkg{(i * 7) % packages:05d}'],
+                                       provides=[f'libbench{i % 10}.so'])
+            return {'x86_64': www}
+        def func(ws, dirs):
+            index = pkgIndex(str(ws / 'pkgindex.sqlite'))
+            index.sync(dirs)
+            assert index.count() == packages
+            for (kind, term) in queries.items():
+                start = perf_counter()
+                for _ in range(100):
+                    index.query(kind, term)
+                latency[kind] = (perf_counter() - start) / 100
+        self.measure('pkgindex_sync', setup, func, packages=packages, files=self.args.index_files)
+        self.results['pkgindex_sync']['query_seconds'] = latency
+    def bench_load_all(self):
+        import yamlparse
+        def setup_cold(ws):
+            fixture.make_pkgbuilds(ws, packages=self.args.packages)
+            yamlparse.clear_cache()
+        def setup_warm(ws):
+            setup_cold(ws)
+            with cwd(ws):
+                yamlparse.load_all()
+        def func(ws, state):
+            with cwd(ws):
+                yamlparse.load_all()
+        self.measure('load_all', setup_cold, func, packages=self.args.packages)
+        self.measure('load_all_warm', setup_warm, func, packages=self.args.packages)
+    def bench_pkglist(self):
+        '''
+            the pkg* extras of buildbot.py polled while one package at a time
+            changes, gen_pkglist on every call against pkglistView
+        '''
+        import yamlparse
+        import extra
+        calls = self.args.pkglist_calls
+        def setup(ws):
+            fixture.make_pkgbuilds(ws, packages=self.args.packages)
+            with cwd(ws):
+                pkgconfigs = yamlparse.load_all()
+            pkgvers = {pc.dirname: '1.0-1' for pc in pkgconfigs}
+            return (pkgconfigs, pkgvers, dict())
+        def changes(state):
+            (pkgconfigs, pkgvers, pkgerrs) = state
+            for i in range(calls):
+                if i % 10 == 0:
+                    # an update check finished
+                    pkgvers[pkgconfigs[i % len(pkgconfigs)].dirname] = f'{i}.0-1'
+                yield (i // 10, pkgconfigs[i % len(pkgconfigs)].dirname)
+        def func_gen(ws, state):
+            for (_, dirname) in changes(state):
+                (namelist, pkgall) = extra.gen_pkglist(*state)
+                pkgall.get(dirname, None)
+        def func_view(ws, state):
+            view = extra.pkglistView()
+            for (version, dirname) in changes(state):
+                view.refresh(*state, (1, version))
+                view.get(dirname)
+        self.measure('pkglist_gen', setup, func_gen, packages=self.args.packages, calls=calls)
+        self.measure('pkglist_view', setup, func_view, packages=self.args.packages, calls=calls)
+    def bench_check_update(self):
+        '''
+            runs the stubs through a local executor rooted at the workspace
+        '''
+        import yamlparse
+        import executor
+        import buildbot
+        logger.setLevel(self.args.loglevel)
+        for arch in fixture.BUILD_ARCHS:
+            for e in executor.get_pool(arch).executors:
+                executor.unregister(arch, e.name)
+        packages = self.args.check_packages
+        def setup(ws):
+            fixture.make_pkgbuilds(ws, packages=packages)
+            for arch in fixture.BUILD_ARCHS:
+                executor.register(arch, executor.localExecutor(root=ws, name=f'bench-{arch}'))
+            with cwd(ws):
+                buildbot.jobsmgr.pkgconfigs = yamlparse.load_all()
+            return buildbot.updateManager(filename=str(ws / 'pkgver.json'))
+        def func(ws, updmgr):
+            with cwd(ws):
+                updates = updmgr.check_update()
+            for arch in fixture.BUILD_ARCHS:
+                executor.unregister(arch, f'bench-{arch}')
+            assert len(updates) == packages, f'{len(updates)} updates of {packages} packages'
+        self.measure('check_update', setup, func, packages=packages)
+    def bench_httpd(self):
+        '''
+            concurrent keep-alive clients on localhost, httpd.py against http.server
+            small: signatures and a database, large: packages
+        '''
+        import http.client
+        import httpd
+        from concurrent.futures import ThreadPoolExecutor
+        from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+        a = self.args
+        address = ('127.0.0.1', a.http_port)
+        class stdlibHandler(SimpleHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            def log_message(self, format, *args):
+                pass
+        def start(kind, root):
+            if kind == 'httpd':
+                server = httpd.serve(address, root=root)
+                return lambda: httpd.stop(server)
+            server = ThreadingHTTPServer(address, lambda *args: stdlibHandler(*args, directory=str(root)))
+            server.daemon_threads = True
+            tr = Thread(target=server.serve_forever)
+            tr.daemon = True
+            tr.start()
+            def stop():
+                server.shutdown()
+                server.server_close()
+            return stop
+        def client(paths, requests):
+            conn = http.client.HTTPConnection(*address)
+            received = 0
+            for i in range(requests):
+                conn.request('GET', f'/{paths[i % len(paths)]}')
+                resp = conn.getresponse()
+                received += len(resp.read())
+                assert resp.status == 200, resp.status
+            conn.close()
+            return received
+        for size in ('small', 'large'):
+            for kind in ('httpd', 'stdlib'):
+                requests = a.http_requests if size == 'small' else max(1, a.http_requests // 200)
+                received = list()
+                def setup(ws):
+                    root = ws / 'www'
+                    root.mkdir()
+                    if size == 'small':
+                        paths = [f'{fixture.write_pkg(root, f"small{i}.pkg.tar.xz", size=1).name}.sig'
+                                 for i in range(50)]
+                        with open(root / 'bench.db.tar.gz', 'wb') as f:
+                            f.write(os.urandom(64*1024))
+                        paths.append('bench.db.tar.gz')
+                    else:
+                        paths = [fixture.write_pkg(root, f'large{i}.pkg.tar.xz', size=a.large_size, sig=False).name
+                                 for i in range(4)]
+                    return (paths, start(kind, root))
+                def func(ws, state):
+                    (paths, stop) = state
+                    try:
+                        with ThreadPoolExecutor(max_workers=a.http_clients) as pool:
+                            received.append(sum(pool.map(lambda _: client(paths, requests),
+                                                         range(a.http_clients))))
+                    finally:
+                        stop()
+                name = f'httpd_{size}_{kind}'
+                self.measure(name, setup, func, clients=a.http_clients, requests=requests)
+                median = self.results[name]['median']
+                self.results[name]['requests_per_sec'] = a.http_clients * requests / median
+                self.results[name]['mbytes_per_sec'] = received[-1] / median / 1024 / 1024
+    def bench_rpc(self):
+        '''
+            the accept loop of repod.py and buildbot.py, one connection per call
+        '''
+        from client import run as rrun
+        import wire
+        address = ('localhost', self.args.rpc_port)
+        authkey = b'bench'
+        calls = self.args.rpc_calls
+        def serve():
+            while True:
+                with Listener(address, authkey=authkey) as listener:
+                    with listener.accept() as conn:
+                        myrecv = wire.recv(conn)
+                        if type(myrecv) is list and len(myrecv) in (3, 4):
+                            (funcname, args, kwargs) = myrecv[:3]
+                            wire.send(conn, None if funcname == 'stop' else args)
+                            if funcname == 'stop':
+                                return
+        latencies = list()
+        def setup(ws):
+            tr = Thread(target=serve)
+            tr.daemon = True
+            tr.start()
+            return tr
+        def func(ws, tr):
+            for i in range(calls):
+                start = perf_counter()
+                while rrun('ping', args=[i], server=(address, authkey), max_retries=0) in (False, None):
+                    # the listener is being set up again
+                    start = perf_counter()
+                latencies.append(perf_counter() - start)
+            rrun('stop', server=(address, authkey), max_retries=0)
+            tr.join()
+        self.measure('rpc', setup, func, calls=calls)
+        latencies.sort()
+        self.results['rpc']['latency'] = {
+            'mean': statistics.mean(latencies),
+            'p50': latencies[len(latencies) // 2],
+            'p99': latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+        }
+
+    def bench_workers(self):
+        '''
+            --workers buildWorkers on localhost building --worker-jobs jobs on
+            fakeExecutors, the overhead of the scheduler and the worker rpc
+        '''
+        from types import SimpleNamespace
+        from config import RPC_BACKLOG
+        from builder import Job
+        from executor import fakeExecutor
+        from scheduler import workerScheduler
+        from worker import buildWorker
+        import wire
+        logger.setLevel(self.args.loglevel)
+        authkey = b'bench'
+        (nworkers, njobs) = (self.args.workers, self.args.worker_jobs)
+        def setup(ws):
+            sched = workerScheduler(heartbeat=1)
+            def run(funcname, args=list(), kwargs=dict()):
+                if funcname == 'worker_register':
+                    return sched.register(*args, **kwargs)
+                if funcname == 'worker_heartbeat':
+                    kwargs.pop('lines', None)
+                    return sched.heartbeat(*args, **kwargs)
+                if funcname == 'worker_pull':
+                    jobs = sched.pull(*args, **kwargs)
+                    return None if jobs is None else [job.to_dict() for job in jobs]
+                if funcname == 'worker_done':
+                    return sched.done(*args, **kwargs)
+                return False
+            listener = Listener(('localhost', 0), authkey=authkey, backlog=RPC_BACKLOG)
+            tr = Thread(target=wire.serve, args=(listener, run))
+            tr.daemon = True
+            tr.start()
+            workers = list()
+            for i in range(nworkers):
+                fake = fakeExecutor(name=f'bench-{i}')
+                def build(jobdict, fake=fake):
+                    fake.run(f'makepkg {jobdict["dirname"]}', cwd=jobdict['dirname'])
+                workers.append((buildWorker(f'bench-{i}', arches=['x86_64'],
+                                            master=(listener.address, authkey), build=build,
+                                            pull_interval=0.01), fake))
+            for (bw, _) in workers:
+                bw.register()
+            return (sched, workers)
+        def func(ws, state):
+            (sched, workers) = state
+            for i in range(njobs):
+                sched.submit(Job('x86_64', SimpleNamespace(dirname=f'pkg{i}', priority=0), '1.0-1'))
+            for (bw, _) in workers:
+                tr = Thread(target=bw.run_forever)
+                tr.daemon = True
+                tr.start()
+            while sum(w.done for w in sched.workers) < njobs:
+                sleep(0.01)
+            for (bw, _) in workers:
+                bw.stop()
+            assert sum(len(fake.calls) for (_, fake) in workers) == njobs
+        self.measure('workers', setup, func, workers=nworkers, jobs=njobs)
+
+    def bench_wire(self):
+        '''
+            buildbot.py responses on a repo of --wire-packages packages,
+            pickled as they were against wire.py with the typed, selected
+            and paged calls, one connection per call as in the servers
+        '''
+        import pickle
+        import yamlparse
+        import buildbot
+        import wire
+        logger.setLevel(self.args.loglevel)
+        address = ('localhost', self.args.rpc_port)
+        authkey = b'bench'
+        calls = self.args.rpc_calls
+        packages = self.args.wire_packages
+        with self.workspace() as ws:
+            fixture.make_pkgbuilds(ws, packages=packages)
+            with cwd(ws):
+                buildbot.jobsmgr.pkgconfigs = yamlparse.load_all()
+        for pc in buildbot.jobsmgr.pkgconfigs[::20]:
+            buildbot.jobsmgr._new_buildjob(buildbot.Job('x86_64', pc, '1.0-1'))
+        # (before, after)
+        cases = {
+            'info': (lambda: buildbot.info(), lambda: buildbot.status()),
+            'pkgdetails': (lambda: buildbot.extras('pkgdetails'),
+                           lambda: buildbot.extras('pkgdetails', fields=['version', 'errors'], limit=100)),
+            'pkgdetails_all': (lambda: buildbot.extras('pkgdetails'), lambda: buildbot.extras('pkgdetails')),
+            'pkglist': (lambda: buildbot.extras('pkglist'), lambda: buildbot.extras('pkglist')),
+        }
+        formats = {'pickle': (lambda conn, obj: conn.send(obj), lambda conn: conn.recv()),
+                   'wire': (wire.send, wire.recv)}
+        def serve(make, fmt):
+            (send, recv) = formats[fmt]
+            while True:
+                with Listener(address, authkey=authkey) as listener:
+                    with listener.accept() as conn:
+                        myrecv = recv(conn)
+                        send(conn, None if myrecv[0] == 'stop' else make())
+                        if myrecv[0] == 'stop':
+                            return
+        def call(fmt, funcname):
+            (send, recv) = formats[fmt]
+            while True:
+                try:
+                    with Client(address, authkey=authkey) as conn:
+                        if fmt == 'wire':
+                            wire.nodelay(conn)
+                        send(conn, [funcname, [], {}])
+                        return recv(conn)
+                except (ConnectionError, EOFError):
+                    # the listener is being set up again
+                    continue
+        for (case, makers) in cases.items():
+            for (fmt, make) in zip(formats, makers):
+                name = f'wire_{case}_{fmt}'
+                def setup(ws):
+                    tr = Thread(target=serve, args=(make, fmt))
+                    tr.daemon = True
+                    tr.start()
+                    return tr
+                def func(ws, tr):
+                    for _ in range(calls):
+                        call(fmt, case)
+                    call(fmt, 'stop')
+                    tr.join()
+                self.measure(name, setup, func, packages=packages, calls=calls)
+                (dumps, loads) = (pickle.dumps, pickle.loads) if fmt == 'pickle' else (wire.encode, wire.decode)
+                start = perf_counter()
+                for _ in range(calls):
+                    data = dumps(make())
+                    loads(data)
+                codec = (perf_counter() - start) / calls
+                self.results[name]['bytes'] = len(data)
+                self.results[name]['seconds_per_call'] = self.results[name]['median'] / calls
+                # building the response, encoding and decoding it, without the connection
+                self.results[name]['codec_seconds_per_call'] = codec
+                print(f'{name}: {len(data)} bytes, {codec * 1000:.3f}ms without the connection',
+                      file=sys.stderr)
+
+BENCHMARKS = ('filter_old_pkg', 'regenerate', 'update', 'publish', 'remove', 'clean_archive',
+              'store', 'pkgindex', 'load_all', 'pkglist', 'check_update', 'httpd', 'rpc', 'wire',
+              'workers')
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL, encoding='utf-8').stdout.strip() or None
+    except OSError:
+        return None
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Buildbot benchmarks on a synthetic repo.')
+    parser.add_argument('-b', '--bench', default=','.join(BENCHMARKS),
+                        help=f'comma split benchmarks, defaults to all: {",".join(BENCHMARKS)}')
+    parser.add_argument('-p', '--packages', type=int, default=200, help='packages in the repo')
+    parser.add_argument('--versions', type=int, default=2, help='versions of every package in www')
+    parser.add_argument('--archived', type=int, default=3, help='versions of every package in archive')
+    parser.add_argument('--updates', type=int, default=50, help='packages in updates')
+    parser.add_argument('--size', type=int, default=4096, help='bytes per package file')
+    parser.add_argument('--large-updates', type=int, default=8, help='packages in updates for publish')
+    parser.add_argument('--large-size', type=int, default=64*1024*1024, help='bytes per package file for publish')
+    parser.add_argument('--index-packages', type=int, default=500, help='packages for pkgindex')
+    parser.add_argument('--index-files', type=int, default=50, help='files per package for pkgindex')
+    parser.add_argument('--pkglist-calls', type=int, default=2000, help='pkg* extras calls for pkglist')
+    parser.add_argument('--check-packages', type=int, default=50, help='packages for check_update')
+    parser.add_argument('--http-clients', type=int, default=16, help='concurrent clients for httpd')
+    parser.add_argument('--http-requests', type=int, default=500, help='requests per client for httpd, large files get 1/200')
+    parser.add_argument('--http-port', type=int, default=7097, help='port for httpd')
+    parser.add_argument('--rpc-calls', type=int, default=200, help='round trips for rpc')
+    parser.add_argument('--wire-packages', type=int, default=1000, help='packages for wire')
+    parser.add_argument('--workers', type=int, default=4, help='build workers for workers')
+    parser.add_argument('--worker-jobs', type=int, default=200, help='jobs for workers')
+    parser.add_argument('--rpc-port', type=int, default=7099, help='port for rpc')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='jobs for regenerate, defaults to REGENERATE_JOBS')
+    parser.add_argument('-r', '--repeat', type=int, default=1, help='runs of every benchmark')
+    parser.add_argument('-t', '--tmpdir', default=None, help='where to create workspaces')
+    parser.add_argument('-k', '--keep', action='store_true', help='keep workspaces')
+    parser.add_argument('-o', '--output', default=None, help='write json here instead of stdout')
+    parser.add_argument('-v', '--verbose', action='store_true', help='show buildbot logs')
+    args = parser.parse_args()
+    args.loglevel = logging.INFO if args.verbose else logging.ERROR
+    if not args.verbose:
+        logging.getLogger().addHandler(logging.NullHandler())
+    logger.setLevel(args.loglevel)
+    benches = [b for b in args.bench.split(',') if b]
+    for bench in benches:
+        if bench not in BENCHMARKS:
+            parser.error(f'unknown benchmark {bench}')
+    runner = benchRunner(args)
+    for bench in benches:
+        getattr(runner, f'bench_{bench}')()
+    report = {'revision': git_revision(), 'time': time(), 'python': platform.python_version(),
+              'platform': platform.platform(), 'params': {k: v for (k, v) in vars(args).items()
+                                                          if k not in ('output', 'verbose')},
+              'results': runner.results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=4)
+            f.write('\n')
+    else:
+        json.dump(report, sys.stdout, indent=4)
+        print()
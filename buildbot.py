@@ -6,6 +6,8 @@
 import logging
 from multiprocessing.connection import Listener
 from time import time, sleep
+from threading import Lock, RLock
+from concurrent.futures import ThreadPoolExecutor
 import os
 from pathlib import Path
 from shutil import rmtree
@@ -14,26 +16,32 @@ from subprocess import CalledProcessError
 from shared_vars import PKG_SUFFIX, PKG_SIG_SUFFIX
 
 from config import ARCHS, BUILD_ARCHS, BUILD_ARCH_MAPPING, \
-                   MASTER_BIND_ADDRESS, MASTER_BIND_PASSWD, \
+                   MASTER_BIND_ADDRESS, MASTER_BIND_PASSWD, MASTER_METRICS_ADDRESS, \
                    PKGBUILD_DIR, MAKEPKG_PKGLIST_CMD, MAKEPKG_UPD_CMD, \
-                   MAKEPKG_MAKE_CMD, MAKEPKG_MAKE_CMD_CLEAN, \
-                   GPG_SIGN_CMD, GPG_VERIFY_CMD, UPDATE_INTERVAL, \
-                   MAKEPKG_MAKE_CMD_MARCH, UPLOAD_CMD, \
+                   UPDATE_INTERVAL, UPDATE_CHECK_WORKERS, \
                    GIT_PULL, GIT_RESET_SUBDIR, CONSOLE_LOGFILE, \
-                   MAIN_LOGFILE, PKG_UPDATE_LOGFILE, MAKEPKG_LOGFILE
+                   MAIN_LOGFILE, PKG_UPDATE_LOGFILE, \
+                   TRACE_LOGFILE, RPC_BACKLOG
 
 from utils import print_exc_plus, background, \
                   bash, get_pkg_details_from_name, vercmp, \
                   nspawn_shell, mon_nspawn_shell, get_arch_from_pkgbuild, \
-                  configure_logger, mon_bash
+                  configure_logger, logstream, run_hooks
 
-from client import run as rrun
+import builder
+from builder import Job
+from scheduler import workerScheduler
 
 import json
 
-from yamlparse import load_all as load_all_yaml
+import metrics
+import tracing
+import wire
 
-from extra import gen_pkglist as extra_gen_pkglist, \
+from yamlparse import load_all as load_all_yaml, \
+                      load_one as load_one_yaml
+
+from extra import pkglistView, \
                   readpkglog as extra_readpkglog, \
                   readmainlog as extra_readmainlog
 
@@ -42,7 +50,8 @@ abspath=os.path.dirname(abspath)
 os.chdir(abspath)
 
 logger = logging.getLogger('buildbot')
-configure_logger(logger, logfile=MAIN_LOGFILE, rotate_size=1024*1024*10, enable_notify=True, consolelog=CONSOLE_LOGFILE)
+configure_logger(logger, logfile=MAIN_LOGFILE, rotate_size=1024*1024*10, enable_notify=True, consolelog=CONSOLE_LOGFILE,
+                 streamlog=True, background=True)
 
 # refuse to run in systemd-nspawn
 if 'systemd-nspawn' in bash('systemd-detect-virt || true'):
@@ -51,40 +60,41 @@ if 'systemd-nspawn' in bash('systemd-detect-virt || true'):
 
 REPO_ROOT = Path(PKGBUILD_DIR)
 
-class Job:
-    def __init__(self, buildarch, pkgconfig, version, multiarch=False):
-        assert buildarch in BUILD_ARCHS
-        self.arch = buildarch
-        self.pkgconfig = pkgconfig
-        self.version = version
-        self.multiarch = multiarch
-        self.added = time()
-    def __repr__(self):
-        ret = "Job("
-        for myproperty in (
-            'arch', 'pkgconfig', 'version', 'multiarch', 'added'
-            ):
-            ret += f'{myproperty}={getattr(self, myproperty, None)},'
-        ret += ')'
-        return ret
-    def __lt__(self, job2):
-        return self.pkgconfig.priority < job2.pkgconfig.priority
 class jobsManager:
     def __init__(self):
         self.__buildjobs = list()
         self.__uploadjobs = list()
+        # the rpc thread adds jobs too
+        self.__jobs_lock = Lock()
         self.__curr_job = None
-        self.pkgconfigs = None
+        self.__pkgconfigs = None
+        self.__pkgconfig_index = dict()
+        # bumped whenever pkgconfigs is replaced, see extra.pkglistView
+        self.pkgconfigs_version = 0
         self.last_updatecheck = 0.0
         self.idle = False
     @property
     def jobs(self):
         return \
         {
-            'build_jobs': self.__buildjobs,
-            'upload_jobs': self.__uploadjobs,
-            'current_job': self.__curr_job
+            'build_jobs': self.__copy_jobs(self.__buildjobs),
+            'upload_jobs': self.__copy_jobs(self.__uploadjobs),
+            'current_job': self.__curr_job,
+            'workers': scheduler.status()
         }
+    def __copy_jobs(self, jobs):
+        with self.__jobs_lock:
+            return list(jobs)
+    @property
+    def pkgconfigs(self):
+        return self.__pkgconfigs
+    @pkgconfigs.setter
+    def pkgconfigs(self, pkgconfigs):
+        self.__pkgconfigs = pkgconfigs
+        self.__pkgconfig_index = {pc.dirname: pc for pc in pkgconfigs} if pkgconfigs else dict()
+        self.pkgconfigs_version += 1
+    def get_pkgconfig(self, pkgdirname):
+        return self.__pkgconfig_index.get(pkgdirname, None)
     def __repr__(self):
         ret = "jobsManager("
         for myproperty in (
@@ -122,76 +132,123 @@ class jobsManager:
             else:
                 return False
         return True
+    def _reload_pkgconfig(self, pkgdirname):
+        '''
+            re-read autobuild.yaml for one package only
+        '''
+        self._reload_pkgconfigs([pkgdirname])
+    def _reload_pkgconfigs(self, pkgdirnames):
+        '''
+            re-read autobuild.yaml for these packages only,
+            pkgconfigs is replaced once
+        '''
+        if self.pkgconfigs is None:
+            self.pkgconfigs = load_all_yaml()
+            return
+        reloaded = dict()
+        for pkgdirname in pkgdirnames:
+            try:
+                reloaded[pkgdirname] = load_one_yaml(pkgdirname)
+            except Exception:
+                logger.error(f'Error while parsing autobuild.yaml for {pkgdirname}')
+                print_exc_plus()
+                reloaded[pkgdirname] = None
+        pkgconfigs = [pc for pc in self.pkgconfigs if pc.dirname not in reloaded]
+        pkgconfigs += [pc for pc in reloaded.values() if pc]
+        self.pkgconfigs = pkgconfigs
     def force_upload_package(self, pkgdirname, overwrite=False):
+        return self.force_upload_packages([pkgdirname], overwrite=overwrite)[0]
+    def force_upload_packages(self, pkgdirnames, overwrite=False):
         if not self.idle:
             logger.debug('force_upload requested and not idle.')
-        if not (REPO_ROOT / pkgdirname).exists():
-            ret = f'force_upload failed: no such dir {pkgdirname}'
-            logger.warning(ret)
-        else:
-            self.pkgconfigs = load_all_yaml()
-            updates = updmgr.check_update(rebuild_package=pkgdirname)
-            if updates and len(updates) == 1:
-                (pkgconfig, ver, buildarchs) = updates[0]
+        pkgdirnames = [str(p) for p in pkgdirnames]
+        existing = [p for p in pkgdirnames if (REPO_ROOT / p).exists()]
+        rets = dict()
+        for pkgdirname in pkgdirnames:
+            if pkgdirname not in existing:
+                rets[pkgdirname] = f'force_upload failed: no such dir {pkgdirname}'
+                logger.warning(rets[pkgdirname])
+        self._reload_pkgconfigs(existing)
+        updates = updmgr.check_rebuild(existing)
+        for pkgdirname in existing:
+            update = updates.get(pkgdirname, None)
+            if update:
+                (pkgconfig, ver, buildarchs) = update
                 fakejob = Job(buildarchs[0], pkgconfig, ver)
-                self.__sign(fakejob)
-                if self.__upload(fakejob, overwrite=overwrite):
-                    ret = f'done force_upload {pkgdirname}'
-                    logger.info(ret)
+                fakejob.trace_id = tracing.new_id()
+                with tracing.trace(fakejob.trace_id), \
+                     tracing.span('force_upload', pkg=pkgdirname):
+                    builder.sign(fakejob)
+                    uploaded = builder.upload(fakejob, overwrite=overwrite)
+                if uploaded:
+                    rets[pkgdirname] = f'done force_upload {pkgdirname}'
+                    logger.info(rets[pkgdirname])
                 else:
-                    ret = f'force_upload {pkgdirname} failed: return code.'
-                    logger.warning(ret)
+                    rets[pkgdirname] = f'force_upload {pkgdirname} failed: return code.'
+                    logger.warning(rets[pkgdirname])
             else:
-                ret = f'force_upload {pkgdirname} failed: cannot check update.'
-                logger.warning(ret)
-        return ret
+                rets[pkgdirname] = f'force_upload {pkgdirname} failed: cannot check update.'
+                logger.warning(rets[pkgdirname])
+        return [rets[p] for p in pkgdirnames]
     def rebuild_package(self, pkgdirname, clean=True):
+        return self.rebuild_packages([pkgdirname], clean=clean)[0]
+    def rebuild_packages(self, pkgdirnames, clean=True):
         if not self.idle:
             logger.debug('rebuild requested and not idle.')
-        self.pkgconfigs = load_all_yaml()
-        if (REPO_ROOT / pkgdirname).exists() and clean:
-            self.reset_dir(pkgdirname)
-        updates = updmgr.check_update(rebuild_package=pkgdirname)
-        if not (REPO_ROOT / pkgdirname).exists():
-            ret = f'rebuild failed: no such dir {pkgdirname}'
-            logger.warning(ret)
-        elif updates and len(updates) == 1:
-            (pkgconfig, ver, buildarchs) = updates[0]
-            march = True if len(buildarchs) >= 2 else False
-            for arch in buildarchs:
-                newjob = Job(arch, pkgconfig, ver, multiarch=march)
-                self._new_buildjob(newjob)
-            ret = f'rebuild job added for {pkgdirname} {" ".join(buildarchs)}'
-            logger.info(ret)
-        else:
-            ret = f'rebuild {pkgdirname} failed: cannot check update.'
-            logger.warning(ret)
-        return ret
+        pkgdirnames = [str(p) for p in pkgdirnames]
+        existing = list()
+        rets = dict()
+        for pkgdirname in pkgdirnames:
+            if not (REPO_ROOT / pkgdirname).exists():
+                rets[pkgdirname] = f'rebuild failed: no such dir {pkgdirname}'
+                logger.warning(rets[pkgdirname])
+                continue
+            existing.append(pkgdirname)
+        self._reload_pkgconfigs(existing)
+        updates = updmgr.check_rebuild(existing, clean=clean)
+        for pkgdirname in existing:
+            update = updates.get(pkgdirname, None)
+            if update:
+                (pkgconfig, ver, buildarchs) = update
+                march = True if len(buildarchs) >= 2 else False
+                for arch in buildarchs:
+                    newjob = Job(arch, pkgconfig, ver, multiarch=march)
+                    self._new_buildjob(newjob)
+                rets[pkgdirname] = f'rebuild job added for {pkgdirname} {" ".join(buildarchs)}'
+                logger.info(rets[pkgdirname])
+            else:
+                rets[pkgdirname] = f'rebuild {pkgdirname} failed: cannot check update.'
+                logger.warning(rets[pkgdirname])
+        return [rets[p] for p in pkgdirnames]
     def _new_buildjob(self, job):
         assert type(job) is Job
-        job_to_remove = list()
-        for previous_job in self.__buildjobs:
-            if job.pkgconfig.dirname == previous_job.pkgconfig.dirname and \
-               job.arch == previous_job.arch:
-                job_to_remove.append(previous_job)
-        for oldjob in job_to_remove:
-            self.__buildjobs.remove(oldjob)
-            logger.info('removed an old job for %s %s, %s => %s',
-                        job.pkgconfig.dirname, job.arch,
-                        oldjob.version, job.version)
-        logger.info('new job for %s %s %s',
-                     job.pkgconfig.dirname, job.arch, job.version)
-        self.__buildjobs.append(job)
+        if not job.trace_id:
+            job.trace_id = updmgr.check_trace(job.pkgconfig.dirname) or tracing.new_id()
+        with self.__jobs_lock:
+            job_to_remove = list()
+            for previous_job in self.__buildjobs:
+                if job.pkgconfig.dirname == previous_job.pkgconfig.dirname and \
+                   job.arch == previous_job.arch:
+                    job_to_remove.append(previous_job)
+            for oldjob in job_to_remove:
+                self.__buildjobs.remove(oldjob)
+                logger.info('removed an old job for %s %s, %s => %s',
+                            job.pkgconfig.dirname, job.arch,
+                            oldjob.version, job.version)
+            logger.info('new job for %s %s %s, trace %s',
+                         job.pkgconfig.dirname, job.arch, job.version, job.trace_id)
+            self.__buildjobs.append(job)
     def __get_job(self):
         if self.__curr_job:
             logger.error(f'Job {self.__curr_job} failed and is not cleaned.')
             self.__finish_job(self.__curr_job, force=True)
             return self.__get_job()
-        jobs = self.__buildjobs
-        if jobs:
-            jobs.sort(reverse=True)
-            self.__curr_job = jobs.pop(0)
-            return self.__curr_job
+        with self.__jobs_lock:
+            jobs = self.__buildjobs
+            if jobs:
+                jobs.sort(reverse=True)
+                self.__curr_job = jobs.pop(0)
+                return self.__curr_job
     def __finish_job(self, pkgdir, force=False):
         if not force:
             assert pkgdir == self.__curr_job.pkgconfig.dirname
@@ -203,143 +260,6 @@ class jobsManager:
             self.__finish_job(self.__curr_job, force=True)
         else:
             raise RuntimeError('Unexpected behavior')
-    def __makepkg(self, job):
-        cwd = REPO_ROOT / job.pkgconfig.dirname
-        if job.multiarch:
-            # assume a clean env, no source avail
-            mkcmd = MAKEPKG_MAKE_CMD_MARCH
-        else:
-            mkcmd = MAKEPKG_MAKE_CMD_CLEAN if job.pkgconfig.cleanbuild \
-                                        else MAKEPKG_MAKE_CMD
-        logger.info('makepkg in %s %s', job.pkgconfig.dirname, job.arch)
-        # run pre-makepkg-scripts
-        logger.debug('running pre-build scripts')
-        for scr in getattr(job.pkgconfig, 'prebuild', list()):
-            if type(scr) is str:
-                try:
-                    mon_nspawn_shell(arch=job.arch, cwd=cwd, cmdline=scr, seconds=60*60)
-                except Exception:
-                    print_exc_plus()
-        # actually makepkg
-        try:
-            ret = mon_nspawn_shell(arch=job.arch, cwd=cwd, cmdline=mkcmd,
-                                    logfile = cwd / MAKEPKG_LOGFILE,
-                                    short_return = True,
-                                    seconds=job.pkgconfig.timeout*60)
-        except Exception:
-            logger.error(f'Job {job} failed. Running build-failure scripts')
-            for scr in getattr(job.pkgconfig, 'failure', list()):
-                if type(scr) is str:
-                    try:
-                        mon_nspawn_shell(arch=job.arch, cwd=cwd, cmdline=scr, seconds=60*60)
-                    except Exception:
-                        print_exc_plus()
-            raise
-        # run post-makepkg-scripts
-        logger.debug('running post-build scripts')
-        for scr in getattr(job.pkgconfig, 'postbuild', list()):
-            if type(scr) is str:
-                try:
-                    mon_nspawn_shell(arch=job.arch, cwd=cwd, cmdline=scr, seconds=60*60)
-                except Exception:
-                    print_exc_plus()
-        return ret
-    def __clean(self, job, remove_pkg=False, rm_src=True):
-        cwd = REPO_ROOT / job.pkgconfig.dirname
-        logger.info('cleaning build dir for %s, %sremoving pkg',
-                    job.pkgconfig.dirname, '' if remove_pkg else 'not ')
-        for fpath in [f for f in cwd.iterdir()]:
-            if rm_src and fpath.is_dir() and \
-                          fpath.name in ('pkg', 'src'):
-                rmtree(fpath)
-            elif remove_pkg and fpath.is_file() and \
-                 ((not job.multiarch) or job.arch in fpath.name) and \
-                 (fpath.name.endswith(PKG_SUFFIX) or \
-                  fpath.name.endswith(PKG_SIG_SUFFIX)):
-                fpath.unlink()
-    def __sign(self, job):
-        logger.info('signing in %s %s', job.pkgconfig.dirname, job.arch)
-        cwd = REPO_ROOT / job.pkgconfig.dirname
-        for fpath in cwd.iterdir():
-            if fpath.name.endswith(PKG_SUFFIX):
-                bash(f'{GPG_SIGN_CMD} {fpath.name}', cwd=cwd)
-    def __upload(self, job, overwrite=False):
-        cwd = REPO_ROOT / job.pkgconfig.dirname
-        f_to_upload = list()
-        pkg_update_list = list()
-        for fpath in cwd.iterdir():
-            if fpath.name.endswith(PKG_SUFFIX) and \
-               get_pkg_details_from_name(fpath.name).ver == job.version:
-                sigpath = fpath.parent / f'{fpath.name}.sig'
-                assert sigpath.exists()
-                f_to_upload.append(sigpath)
-                f_to_upload.append(fpath)
-                pkg_update_list.append(fpath)
-        sizes = [f.stat().st_size / 1000 / 1000 for f in f_to_upload]
-        pkg_update_list_human = " ".join([f.name for f in pkg_update_list])
-        assert pkg_update_list
-        max_tries = 10
-        for tries in range(max_tries):
-            timeouts = rrun('push_start', args=([f.name for f in f_to_upload], sizes))
-            if type(timeouts) is list:
-                break
-            else:
-                if tries + 1 < max_tries:
-                    logger.warning(f'Remote is busy ({timeouts}), wait 1 min x10 [{tries+1}/10]')
-                    sleep(60)
-        else:
-            raise RuntimeError('Remote is busy and cannot connect')
-        assert len(f_to_upload) == len(timeouts)
-        pkgs_timeouts = {f_to_upload[i]:timeouts[i] for i in range(len(sizes))}
-        for f in f_to_upload:
-            max_tries = 5
-            for tries in range(max_tries):
-                timeout = pkgs_timeouts.get(f)
-                try:
-                    logger.info(f'Uploading {f.name}, timeout in {timeout}s')
-                    mon_bash(UPLOAD_CMD.format(src=f), seconds=int(timeout))
-                except Exception:
-                    time_to_sleep = (tries + 1) * 60
-                    logger.error(f'We are getting problem uploading {f.name}, wait {time_to_sleep} secs')
-                    patret = rrun('push_add_time', args=(f.name, time_to_sleep + timeout))
-                    if not patret is None:
-                        logger.error(f'Unable to run push_add_time, reason: {patret}')
-                    print_exc_plus()
-                    if tries + 1 < max_tries:
-                        sleep(time_to_sleep)
-                else:
-                    break
-            else:
-                logger.error(f'Upload {f.name} failed, running push_fail and abort.')
-                pfret = rrun('push_fail', args=(f.name,))
-                if not pfret is None:
-                    logger.error(f'Unable to run push_fail, reason: {pfret}')
-                raise RuntimeError('Unable to upload some files')
-        logger.info(f'Requesting repo update for {pkg_update_list_human}')
-        res = "unexpected"
-        max_tries = 5
-        for tries in range(max_tries):
-            try:
-                res = rrun('push_done', args=([f.name for f in f_to_upload],), kwargs={'overwrite': overwrite,})
-            except Exception:
-                time_to_sleep = (tries + 1) * 60
-                logger.info(f'Error updating {pkg_update_list_human}, wait {time_to_sleep} secs')
-                print_exc_plus()
-                if tries + 1 < max_tries:
-                    sleep(time_to_sleep)
-            else:
-                break
-        else:
-            ret = f'Update failed for {pkg_update_list_human}: max reties exceeded'
-            logger.error(ret)
-            raise RuntimeError(ret)
-        if res is None:
-            logger.info(f'Update success for {pkg_update_list_human}')
-        else:
-            ret = f'Update failed for {pkg_update_list_human}, reason: {res}'
-            logger.error(ret)
-            raise RuntimeError(ret)
-        return res is None
     def getup(self):
         '''
             check for updates now !!!
@@ -353,6 +273,9 @@ class jobsManager:
             create new jobs
             and run them
         '''
+        scheduler.reap()
+        for job in scheduler.take_orphans():
+            self._new_buildjob(job)
         if not self.__buildjobs:
             # This part check for updates
             if time() - self.last_updatecheck <= UPDATE_INTERVAL * 60:
@@ -384,23 +307,17 @@ class jobsManager:
             if not job:
                 logging.error('No job got')
                 return
-            if job.multiarch:
-                self.__clean(job, remove_pkg=True)
-                self.__makepkg(job)
-                self.__sign(job)
-                if self.__upload(job):
-                    self.__clean(job, remove_pkg=True)
-            else:
-                self.__makepkg(job)
-                self.__sign(job)
-                if self.__upload(job):
-                    if job.pkgconfig.cleanbuild:
-                        self.__clean(job, remove_pkg=True)
-                    else:
-                        self.__clean(job, rm_src=False, remove_pkg=True)
+            if scheduler.submit(job):
+                # a worker builds and uploads it
+                self.__finish_job(job.pkgconfig.dirname)
+                return 0
+            with tracing.trace(job.trace_id), \
+                 tracing.span('job', pkg=job.pkgconfig.dirname, arch=job.arch, version=job.version):
+                builder.run_job(job)
             self.__finish_job(job.pkgconfig.dirname)
             return 0
 
+scheduler = workerScheduler()
 jobsmgr = jobsManager()
 
 class updateManager:
@@ -408,8 +325,22 @@ class updateManager:
         self.__filename = filename
         self.__pkgerrs = dict()
         self.__pkgvers = dict()
+        self.__pkglocks = dict()
+        self.__pkglocks_lock = Lock()
+        self.__check_traces = dict()
+        self.__save_lock = Lock()
+        self.__version = 0
         self.__load()
-        self.__rebuilding = False
+    @property
+    def version(self):
+        '''
+            bumped whenever pkgvers or pkgerrs changes
+        '''
+        return self.__version
+    def __set(self, table, dirname, value):
+        if table.get(dirname, None) != value:
+            table[dirname] = value
+            self.__version += 1
     @property
     def pkgvers(self):
         return self.__pkgvers
@@ -434,19 +365,22 @@ class updateManager:
             assert len(pkgdata[pkgname]) == 2
         self.__pkgvers = {pkgname:pkgdata[pkgname][0] for pkgname in pkgdata}
         self.__pkgerrs = {pkgname:pkgdata[pkgname][1] for pkgname in pkgdata}
+        self.__version += 1
     def _save(self):
-        pkgdata = {pkgname:[self.__pkgvers[pkgname], self.__pkgerrs[pkgname]] for pkgname in self.__pkgvers}
-        pkgdatastr = json.dumps(pkgdata, indent=4)
-        pkgdatastr += '\n'
-        with open(self.__filename,"w") as f:
-            if f.writable:
-                f.write(pkgdatastr)
-            else:
-                logger.error('pkgver.json - Not writable')
+        with self.__save_lock:
+            pkgdata = {pkgname:[self.__pkgvers[pkgname], self.__pkgerrs.get(pkgname, 0)] for pkgname in list(self.__pkgvers)}
+            pkgdatastr = json.dumps(pkgdata, indent=4)
+            pkgdatastr += '\n'
+            with open(self.__filename,"w") as f:
+                if f.writable:
+                    f.write(pkgdatastr)
+                else:
+                    logger.error('pkgver.json - Not writable')
     def __get_package_list(self, dirname, arch):
         pkgdir = REPO_ROOT / dirname
         assert pkgdir.exists()
-        pkglist = nspawn_shell(arch, MAKEPKG_PKGLIST_CMD, cwd=pkgdir, RUN_CMD_TIMEOUT=5*60)
+        pkglist = nspawn_shell(arch, MAKEPKG_PKGLIST_CMD, cwd=pkgdir, RUN_CMD_TIMEOUT=5*60,
+                               session=True)
         pkglist = pkglist.split('\n')
         pkglist = [line for line in pkglist if not line.startswith('+')]
         return pkglist
@@ -454,69 +388,119 @@ class updateManager:
         pkgfiles = self.__get_package_list(dirname, arch)
         ver = get_pkg_details_from_name(pkgfiles[0]).ver
         return ver
-    def check_update(self, rebuild_package=None):
-        updates = list()
-        for pkg in jobsmgr.pkgconfigs:
+    def __pkglock(self, dirname):
+        with self.__pkglocks_lock:
+            return self.__pkglocks.setdefault(dirname, Lock())
+    def __check_one(self, pkg, rebuild=False):
+        '''
+            check a single package for updates
+            returns (pkgconfig, ver, buildarchs) or None
+        '''
+        pkgdir = REPO_ROOT / pkg.dirname
+        logger.info(f'{"[rebuild] " if rebuild else ""}checking update: {pkg.dirname}')
+        if self.__pkgerrs.get(pkg.dirname, 0) >= 2:
+            logger.warning(f'package: {pkg.dirname} too many failures checking update')
+            if not rebuild:
+                return None
+        pkgbuild = pkgdir / 'PKGBUILD'
+        archs = get_arch_from_pkgbuild(pkgbuild)
+        buildarchs = [BUILD_ARCH_MAPPING.get(arch, None) for arch in archs]
+        buildarchs = [arch for arch in buildarchs if arch is not None]
+        if not buildarchs:
+            logger.warning(f'No build arch for {pkg.dirname}, refuse to build.')
+            return None
+        # hopefully we only need to check one arch for update
+        arch = 'x86_64' if 'x86_64' in buildarchs else buildarchs[0] # prefer x86
+        # run pre_update_scripts
+        logger.debug('running pre-update scripts')
+        # update hooks must all succeed and keep their order
+        run_hooks(arch, pkgdir, pkg.hooks('update'),
+                  mode='serial' if pkg.hook_mode == 'serial' else 'batch',
+                  strict=True, stage='update', session=True)
+        mon_nspawn_shell(arch, MAKEPKG_UPD_CMD, cwd=pkgdir, seconds=5*60*60,
+                        logfile = pkgdir / PKG_UPDATE_LOGFILE,
+                        short_return = True, session=True)
+        if pkg.type in ('git', 'manual'):
+            ver = self.__get_new_ver(pkg.dirname, arch)
+            oldver = self.__pkgvers.get(pkg.dirname, None)
+            has_update = False
+            if rebuild:
+                has_update = True
+            if oldver:
+                res = vercmp(ver, oldver)
+                if res == 1:
+                    has_update = True
+                elif res == -1:
+                    logger.warning(f'package: {pkg.dirname} downgrade attempted')
+                elif res == 0:
+                    logger.info(f'package: {pkg.dirname} is up to date')
+            else:
+                has_update = True
+            # reset error counter
+            self.__set(self.__pkgerrs, pkg.dirname, 0)
+            if has_update:
+                self.__set(self.__pkgvers, pkg.dirname, ver)
+                return (pkg, ver, buildarchs)
+        else:
+            logger.warning(f'unknown package type: {pkg.type}')
+        return None
+    def check_trace(self, dirname):
+        '''
+            trace id of the last update check for dirname
+        '''
+        return self.__check_traces.get(dirname, None)
+    def __check_locked(self, pkg, rebuild=False, clean=False):
+        '''
+            clean: reset the dir first, with the lock held so that a
+            check running there is not wiped out
+        '''
+        trace_id = tracing.new_id()
+        self.__check_traces[pkg.dirname] = trace_id
+        with self.__pkglock(pkg.dirname), tracing.trace(trace_id), \
+             tracing.span('update_check', pkg=pkg.dirname, rebuild=rebuild):
             try:
-                if self.__rebuilding and not rebuild_package:
-                    logger.info(f'Stop checking updates for rebuild.')
-                    break
-                else:
-                    self.__rebuilding = bool(rebuild_package)
-                if rebuild_package and \
-                    rebuild_package != pkg.dirname:
-                    continue
-                pkgdir = REPO_ROOT / pkg.dirname
-                logger.info(f'{"[rebuild] " if rebuild_package else ""}checking update: {pkg.dirname}')
-                if self.__pkgerrs.get(pkg.dirname, 0) >= 2:
-                    logger.warning(f'package: {pkg.dirname} too many failures checking update')
-                    if rebuild_package is None:
-                        continue
-                pkgbuild = pkgdir / 'PKGBUILD'
-                archs = get_arch_from_pkgbuild(pkgbuild)
-                buildarchs = [BUILD_ARCH_MAPPING.get(arch, None) for arch in archs]
-                buildarchs = [arch for arch in buildarchs if arch is not None]
-                if not buildarchs:
-                    logger.warning(f'No build arch for {pkg.dirname}, refuse to build.')
-                    continue
-                # hopefully we only need to check one arch for update
-                arch = 'x86_64' if 'x86_64' in buildarchs else buildarchs[0] # prefer x86
-                # run pre_update_scripts
-                logger.debug('running pre-update scripts')
-                for scr in getattr(pkg, 'update', list()):
-                    if type(scr) is str:
-                        mon_nspawn_shell(arch, scr, cwd=pkgdir, seconds=60*60)
-                mon_nspawn_shell(arch, MAKEPKG_UPD_CMD, cwd=pkgdir, seconds=5*60*60,
-                                logfile = pkgdir / PKG_UPDATE_LOGFILE,
-                                short_return = True)
-                if pkg.type in ('git', 'manual'):
-                    ver = self.__get_new_ver(pkg.dirname, arch)
-                    oldver = self.__pkgvers.get(pkg.dirname, None)
-                    has_update = False
-                    if rebuild_package:
-                        has_update = True
-                    if oldver:
-                        res = vercmp(ver, oldver)
-                        if res == 1:
-                            has_update = True
-                        elif res == -1:
-                            logger.warning(f'package: {pkg.dirname} downgrade attempted')
-                        elif res == 0:
-                            logger.info(f'package: {pkg.dirname} is up to date')
-                    else:
-                        has_update = True
-                    # reset error counter
-                    self.__pkgerrs[pkg.dirname] = 0
-                    if has_update:
-                        self.__pkgvers[pkg.dirname] = ver
-                        updates.append((pkg, ver, buildarchs))
-                else:
-                    logger.warning(f'unknown package type: {pkg.type}')
+                if clean:
+                    jobsmgr.reset_dir(pkg.dirname)
+                return self.__check_one(pkg, rebuild=rebuild)
             except Exception:
-                self.__pkgerrs[pkg.dirname] = self.__pkgerrs.get(pkg.dirname, 0) + 1
+                self.__set(self.__pkgerrs, pkg.dirname, self.__pkgerrs.get(pkg.dirname, 0) + 1)
                 print_exc_plus()
+                return None
+    def check_update(self):
+        '''
+            check every package for updates
+        '''
+        updates = list()
+        with metrics.timer('buildbot_update_sweep_seconds', help='full update check duration'):
+            for pkg in list(jobsmgr.pkgconfigs):
+                update = self.__check_locked(pkg)
+                if update:
+                    updates.append(update)
+        self._save()
+        return updates
+    def check_rebuild(self, pkgdirnames, clean=False):
+        '''
+            force a check of the given packages only,
+            safe to run alongside check_update
+            clean: reset their dirs first
+            returns {pkgdirname: (pkgconfig, ver, buildarchs) or None}
+            up to UPDATE_CHECK_WORKERS packages are checked at once
+        '''
+        updates = dict()
+        pkgs = list()
+        for pkgdirname in dict.fromkeys(pkgdirnames):
+            pkg = jobsmgr.get_pkgconfig(pkgdirname)
+            if pkg is None:
+                logger.warning(f'[rebuild] no pkgconfig for {pkgdirname}')
+                updates[pkgdirname] = None
+                continue
+            pkgs.append(pkg)
+        if pkgs:
+            check = tracing.wrap(lambda pkg: self.__check_locked(pkg, rebuild=True, clean=clean))
+            with ThreadPoolExecutor(max_workers=max(1, min(UPDATE_CHECK_WORKERS, len(pkgs)))) as executor:
+                for (pkg, update) in zip(pkgs, executor.map(check, pkgs)):
+                    updates[pkg.dirname] = update
         self._save()
-        self.__rebuilding = False
         return updates
 
 updmgr = updateManager()
@@ -533,10 +517,34 @@ def info(human=False):
     ret += f"idle: {jobsmgr.idle}"
     return ret
 
+def __job_status(job):
+    if job is None:
+        return None
+    return {**job.to_dict(), 'added': job.added, 'priority': job.pkgconfig.priority}
+
+def status(fields=None):
+    '''
+        what info shows, as a dict instead of a repr
+        fields: the keys wanted, None for all of them
+    '''
+    jobs = jobsmgr.jobs
+    ret = {'build_jobs': [__job_status(job) for job in jobs['build_jobs']],
+           'upload_jobs': [__job_status(job) for job in jobs['upload_jobs']],
+           'current_job': __job_status(jobs['current_job']),
+           'workers': jobs['workers'],
+           'idle': jobsmgr.idle,
+           'last_updatecheck': jobsmgr.last_updatecheck,
+           'packages': len(jobsmgr.pkgconfigs or list())}
+    return wire.select(ret, fields)
+
 def rebuild_package(pkgdirname, clean=False):
     logger.info(f'rebuild command accecpted for {pkgdirname}')
     return jobsmgr.rebuild_package(pkgdirname, clean=clean)
 
+def rebuild_packages(pkgdirnames, clean=False):
+    logger.info(f'rebuild command accecpted for {pkgdirnames}')
+    return jobsmgr.rebuild_packages(pkgdirnames, clean=clean)
+
 def clean(pkgdirname):
     logger.info(f'clean command accecpted for {pkgdirname}')
     return jobsmgr.reset_dir(pkgdirname=pkgdirname)
@@ -549,38 +557,186 @@ def force_upload(pkgdirname, overwrite=False):
     logger.info(f'force_upload command accecpted for {pkgdirname}')
     return jobsmgr.force_upload_package(pkgdirname, overwrite=overwrite)
 
+def force_upload_packages(pkgdirnames, overwrite=False):
+    logger.info(f'force_upload command accecpted for {pkgdirnames}')
+    return jobsmgr.force_upload_packages(pkgdirnames, overwrite=overwrite)
+
 def getup():
     return jobsmgr.getup()
 
-def extras(action, pkgname=None):
+pkglist_view = pkglistView()
+
+def extras(action, pkgname=None, cursor=None, paged=False, etag=None,
+           fields=None, offset=0, limit=None):
+    '''
+        etag: for the pkg* actions, the etag of the last answer ('' if there
+        is none), the answer is then {'etag': ..., 'modified': bool, 'data': ...}
+        and data is None when nothing changed
+        fields: pkgdetail(s) only return these details
+        limit: pkglist and pkgdetails return a page, see wire.page
+    '''
     if action.startswith("pkg"):
-        p = extra_gen_pkglist(jobsmgr.pkgconfigs, updmgr.pkgvers, updmgr.pkgerrs)
+        pkglist_view.refresh(jobsmgr.pkgconfigs, updmgr.pkgvers, updmgr.pkgerrs,
+                             (jobsmgr.pkgconfigs_version, updmgr.version))
         if action == "pkgdetail":
-            return p[1].get(pkgname, None)
+            (current, data) = (pkglist_view.pkg_etag(pkgname),
+                               wire.select(pkglist_view.get(pkgname), fields))
         elif action == "pkgdetails":
-            return p[1]
+            (current, data) = (pkglist_view.etag, pkglist_view.pkgall)
+            if limit is not None:
+                data = wire.page(data, offset=offset, limit=limit)
+                data['items'] = {k: wire.select(v, fields) for (k, v) in data['items'].items()}
+            elif fields is not None:
+                data = {k: wire.select(v, fields) for (k, v) in data.items()}
         elif action == "pkglist":
-            return p[0]
+            (current, data) = (pkglist_view.etag, pkglist_view.namelist)
+            if limit is not None:
+                data = wire.page(data, offset=offset, limit=limit)
+        else:
+            return False
+        if etag is None:
+            return data
+        if current is not None and etag == current:
+            metrics.inc('buildbot_pkglist_not_modified_total', help='pkg* calls answered with not modified',
+                        action=action)
+            return {'etag': current, 'modified': False, 'data': None}
+        return {'etag': current, 'modified': True, 'data': data}
     elif action == "mainlog":
-        return extra_readmainlog(debug=False)
+        return extra_readmainlog(debug=False, cursor=cursor, paged=paged)
     elif action == "debuglog":
-        return extra_readmainlog(debug=True)
+        return extra_readmainlog(debug=True, cursor=cursor, paged=paged)
     elif action == "readpkglog":
         pkgname = str(pkgname)
-        return extra_readpkglog(pkgname, update=False)
+        return extra_readpkglog(pkgname, update=False, cursor=cursor, paged=paged)
     elif action == "readpkgupdlog":
         pkgname = str(pkgname)
-        return extra_readpkglog(pkgname, update=True)
+        return extra_readpkglog(pkgname, update=True, cursor=cursor, paged=paged)
     return False
 
+def log_subscribe(channel):
+    '''
+        channel: console, debug or makepkg
+        returns a subscription id for log_fetch
+    '''
+    if channel not in ('console', 'debug', 'makepkg'):
+        return False
+    return logstream.subscribe(channel)
+
+def log_fetch(sub_id, maxlines=1000):
+    '''
+        returns (lines, dropped) or None if the subscription expired
+    '''
+    return logstream.fetch(sub_id, maxlines=maxlines)
+
+def log_unsubscribe(sub_id):
+    return logstream.unsubscribe(sub_id)
+
+def worker_register(worker_id, arches, capacity=1):
+    '''
+        returns the heartbeat interval
+    '''
+    arches = [arch for arch in arches if arch in BUILD_ARCHS]
+    return scheduler.register(str(worker_id), arches, capacity=int(capacity))
+
+def worker_heartbeat(worker_id, running=list(), lines=list()):
+    '''
+        lines: makepkg output since the last heartbeat
+        returns False if the worker should register again
+    '''
+    for line in lines:
+        logstream.publish('makepkg', f'[{worker_id}] {line}')
+    ret = scheduler.heartbeat(worker_id, running=running)
+    scheduler.reap()
+    return ret
+
+def worker_pull(worker_id, slots=1):
+    jobs = scheduler.pull(worker_id, slots=slots)
+    if jobs is None:
+        return None
+    return [job.to_dict() for job in jobs]
+
+def worker_done(worker_id, job_id, success, message=None):
+    return scheduler.done(worker_id, job_id, success, message=message)
+
+def worker_unregister(worker_id):
+    return scheduler.unregister(worker_id)
+
+# funcname: (the same for a list of packages, its keyword argument)
+BATCH_GROUPS = {'rebuild_package': ('rebuild_packages', 'clean'),
+                'force_upload': ('force_upload_packages', 'overwrite')}
+
+def batch(ops):
+    '''
+        ops: [[funcname, args, kwargs], ...]
+        runs of rebuild_package or force_upload with the same options are
+        done in one call, the pkgconfigs are reloaded once and the update
+        checks run concurrently
+        returns [{'ok': True, 'result': ...} or {'ok': False, 'error': ...}]
+        in the order of ops
+    '''
+    rets = list()
+    def call(funcname, args, kwargs):
+        if funcname not in RPC_FUNCTIONS or funcname == 'batch':
+            logger.error('unexpected in batch: %s %s %s', funcname, args, kwargs)
+            return {'ok': False, 'error': f'unexpected: {funcname}'}
+        try:
+            return {'ok': True, 'result': run(funcname, args=args, kwargs=kwargs)}
+        except Exception as err:
+            print_exc_plus()
+            return {'ok': False, 'error': repr(err)}
+    ops = [(str(op[0]), list(op[1]) if len(op) > 1 else list(), dict(op[2]) if len(op) > 2 else dict())
+           for op in ops]
+    i = 0
+    while i < len(ops):
+        (funcname, args, kwargs) = ops[i]
+        group = BATCH_GROUPS.get(funcname, None)
+        if group is None or len(args) != 1 or set(kwargs) - {group[1]}:
+            rets.append(call(funcname, args, kwargs))
+            i += 1
+            continue
+        j = i
+        while j < len(ops) and ops[j][0] == funcname and len(ops[j][1]) == 1 and ops[j][2] == kwargs:
+            j += 1
+        pkgdirnames = [op[1][0] for op in ops[i:j]]
+        ret = call(group[0], [pkgdirnames], kwargs)
+        if ret['ok'] and type(ret['result']) is list and len(ret['result']) == len(pkgdirnames):
+            rets += [{'ok': True, 'result': r} for r in ret['result']]
+        else:
+            rets += [ret] * len(pkgdirnames)
+        i = j
+    metrics.inc('buildbot_batch_ops_total', len(ops), help='operations received in batch calls')
+    return rets
+
+RPC_FUNCTIONS = ('info', 'status', 'rebuild_package', 'rebuild_packages', 'clean', 'clean_all',
+                 'force_upload', 'force_upload_packages', 'getup', 'extras',
+                 'log_subscribe', 'log_fetch', 'log_unsubscribe',
+                 'worker_register', 'worker_heartbeat', 'worker_pull',
+                 'worker_done', 'worker_unregister', 'batch')
+
+# thread safe, answered while a slow call (a rebuild, a batch) runs,
+# the others still run one at a time
+CONCURRENT_RPC_FUNCTIONS = ('log_subscribe', 'log_fetch', 'log_unsubscribe',
+                            'worker_register', 'worker_heartbeat', 'worker_pull',
+                            'worker_done', 'worker_unregister')
+__rpc_lock = RLock()
+
 def run(funcname, args=list(), kwargs=dict()):
-    if funcname in ('info', 'rebuild_package', 'clean', 'clean_all',
-                    'force_upload', 'getup', 'extras'):
+    if funcname in RPC_FUNCTIONS:
         logger.debug('running: %s %s %s',funcname, args, kwargs)
-        ret = eval(funcname)(*args, **kwargs)
+        try:
+            with metrics.timer('buildbot_rpc_seconds', help='rpc latency', func=funcname):
+                if funcname in CONCURRENT_RPC_FUNCTIONS:
+                    ret = eval(funcname)(*args, **kwargs)
+                else:
+                    with __rpc_lock:
+                        ret = eval(funcname)(*args, **kwargs)
+        except Exception:
+            metrics.inc('buildbot_rpc_errors_total', help='rpc calls raising an exception', func=funcname)
+            raise
         logger.debug('run: done: %s %s %s',funcname, args, kwargs)
         return ret
     else:
+        metrics.inc('buildbot_rpc_errors_total', help='rpc calls raising an exception', func='unexpected')
         logger.error('unexpected: %s %s %s',funcname, args, kwargs)
         return False
 
@@ -588,21 +744,28 @@ def run(funcname, args=list(), kwargs=dict()):
 def __main():
     while True:
         try:
-            with Listener(MASTER_BIND_ADDRESS, authkey=MASTER_BIND_PASSWD) as listener:
-                with listener.accept() as conn:
-                    logger.debug('connection accepted from %s', listener.last_accepted)
-                    myrecv = conn.recv()
-                    if type(myrecv) is list and len(myrecv) == 3:
-                        (funcname, args, kwargs) = myrecv
-                        funcname = str(funcname)
-                        conn.send(run(funcname, args=args, kwargs=kwargs))
+            with Listener(MASTER_BIND_ADDRESS, authkey=MASTER_BIND_PASSWD, backlog=RPC_BACKLOG) as listener:
+                wire.serve(listener, run)
         except Exception:
             print_exc_plus()
+            sleep(1)
 
 if __name__ == '__main__':
     logger.info('Buildbot started.')
+    tracing.configure(TRACE_LOGFILE)
     __main() # start the Listener thread
     logger.info('Listener started.')
+    if MASTER_METRICS_ADDRESS:
+        metrics.serve(MASTER_METRICS_ADDRESS)
+        metrics.register_callback('buildbot_build_queue_depth',
+                                  lambda: len(jobsmgr.jobs['build_jobs']),
+                                  help='queued build jobs')
+        metrics.register_callback('buildbot_pkg_update_errors',
+                                  lambda: dict(updmgr.pkgerrs),
+                                  help='consecutive update check failures per package',
+                                  label='pkg')
+        metrics.register_callback('buildbot_workers', lambda: len(scheduler.workers),
+                                  help='registered build workers')
     while True:
         try:
             try:
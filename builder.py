@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# builder.py: Automatic management tool for an arch repo.
+# This file is part of Buildbot by JerryXiao
+
+# the steps of a build job: makepkg, sign, upload to repod
+# used by buildbot.py and by worker.py on remote hosts
+
+import logging
+from time import time, sleep
+from pathlib import Path
+from shutil import rmtree
+from uuid import uuid4
+
+from shared_vars import PKG_SUFFIX, PKG_SIG_SUFFIX
+
+from config import BUILD_ARCHS, PKGBUILD_DIR, \
+                   MAKEPKG_MAKE_CMD, MAKEPKG_MAKE_CMD_CLEAN, \
+                   MAKEPKG_MAKE_CMD_MARCH, UPLOAD_CMD, MAKEPKG_LOGFILE
+
+from utils import print_exc_plus, get_pkg_details_from_name, \
+                  mon_nspawn_shell, mon_bash, gpg_sign, run_hooks
+
+from client import run as rrun
+
+import metrics
+import tracing
+
+logger = logging.getLogger(f'buildbot.{__name__}')
+
+REPO_ROOT = Path(PKGBUILD_DIR)
+
+class Job:
+    def __init__(self, buildarch, pkgconfig, version, multiarch=False):
+        assert buildarch in BUILD_ARCHS
+        self.arch = buildarch
+        self.pkgconfig = pkgconfig
+        self.version = version
+        self.multiarch = multiarch
+        self.added = time()
+        self.trace_id = None
+        self.job_id = uuid4().hex[:12]
+        # times the job was lost with a worker
+        self.attempts = 0
+    def __repr__(self):
+        ret = "Job("
+        for myproperty in (
+            'arch', 'pkgconfig', 'version', 'multiarch', 'added', 'trace_id', 'job_id'
+            ):
+            ret += f'{myproperty}={getattr(self, myproperty, None)},'
+        ret += ')'
+        return ret
+    def __lt__(self, job2):
+        return self.pkgconfig.priority < job2.pkgconfig.priority
+    def to_dict(self):
+        '''
+            what a worker needs to run the job
+        '''
+        return {'job_id': self.job_id, 'dirname': self.pkgconfig.dirname, 'arch': self.arch,
+                'version': self.version, 'multiarch': self.multiarch,
+                'trace_id': self.trace_id}
+    @classmethod
+    def from_dict(cls, jobdict, pkgconfig):
+        assert pkgconfig.dirname == jobdict['dirname']
+        job = cls(jobdict['arch'], pkgconfig, jobdict['version'], multiarch=jobdict['multiarch'])
+        job.job_id = jobdict['job_id']
+        job.trace_id = jobdict['trace_id']
+        return job
+
+def makepkg(job):
+    cwd = REPO_ROOT / job.pkgconfig.dirname
+    if job.multiarch:
+        # assume a clean env, no source avail
+        mkcmd = MAKEPKG_MAKE_CMD_MARCH
+    else:
+        mkcmd = MAKEPKG_MAKE_CMD_CLEAN if job.pkgconfig.cleanbuild \
+                                    else MAKEPKG_MAKE_CMD
+    logger.info('makepkg in %s %s', job.pkgconfig.dirname, job.arch)
+    # run pre-makepkg-scripts
+    logger.debug('running pre-build scripts')
+    with tracing.span('prebuild'):
+        run_hooks(job.arch, cwd, job.pkgconfig.hooks('prebuild'),
+                  mode=job.pkgconfig.hook_mode, stage='prebuild')
+    # actually makepkg
+    try:
+        with tracing.span('makepkg', cmd=mkcmd):
+            ret = mon_nspawn_shell(arch=job.arch, cwd=cwd, cmdline=mkcmd,
+                                    logfile = cwd / MAKEPKG_LOGFILE,
+                                    short_return = True, stream = 'makepkg',
+                                    seconds=job.pkgconfig.timeout*60)
+    except Exception:
+        logger.error(f'Job {job} failed. Running build-failure scripts')
+        with tracing.span('failure'):
+            run_hooks(job.arch, cwd, job.pkgconfig.hooks('failure'),
+                      mode=job.pkgconfig.hook_mode, stage='failure')
+        raise
+    # run post-makepkg-scripts
+    logger.debug('running post-build scripts')
+    with tracing.span('postbuild'):
+        run_hooks(job.arch, cwd, job.pkgconfig.hooks('postbuild'),
+                  mode=job.pkgconfig.hook_mode, stage='postbuild')
+    return ret
+
+def clean(job, remove_pkg=False, rm_src=True):
+    cwd = REPO_ROOT / job.pkgconfig.dirname
+    logger.info('cleaning build dir for %s, %sremoving pkg',
+                job.pkgconfig.dirname, '' if remove_pkg else 'not ')
+    for fpath in [f for f in cwd.iterdir()]:
+        if rm_src and fpath.is_dir() and \
+                      fpath.name in ('pkg', 'src'):
+            rmtree(fpath)
+        elif remove_pkg and fpath.is_file() and \
+             ((not job.multiarch) or job.arch in fpath.name) and \
+             (fpath.name.endswith(PKG_SUFFIX) or \
+              fpath.name.endswith(PKG_SIG_SUFFIX)):
+            fpath.unlink()
+
+def sign(job):
+    logger.info('signing in %s %s', job.pkgconfig.dirname, job.arch)
+    cwd = REPO_ROOT / job.pkgconfig.dirname
+    with tracing.span('sign'):
+        gpg_sign([fpath for fpath in cwd.iterdir() if fpath.name.endswith(PKG_SUFFIX)])
+
+def upload(job, overwrite=False):
+    with tracing.span('upload'):
+        return __do_upload(job, overwrite=overwrite)
+
+def __do_upload(job, overwrite=False):
+    cwd = REPO_ROOT / job.pkgconfig.dirname
+    f_to_upload = list()
+    pkg_update_list = list()
+    for fpath in cwd.iterdir():
+        if fpath.name.endswith(PKG_SUFFIX) and \
+           get_pkg_details_from_name(fpath.name).ver == job.version:
+            sigpath = fpath.parent / f'{fpath.name}.sig'
+            assert sigpath.exists()
+            f_to_upload.append(sigpath)
+            f_to_upload.append(fpath)
+            pkg_update_list.append(fpath)
+    sizes = [f.stat().st_size / 1000 / 1000 for f in f_to_upload]
+    pkg_update_list_human = " ".join([f.name for f in pkg_update_list])
+    assert pkg_update_list
+    max_tries = 10
+    for tries in range(max_tries):
+        timeouts = rrun('push_start', args=([f.name for f in f_to_upload], sizes))
+        if type(timeouts) is list:
+            break
+        else:
+            if tries + 1 < max_tries:
+                logger.warning(f'Remote is busy ({timeouts}), wait 1 min x10 [{tries+1}/10]')
+                sleep(60)
+    else:
+        raise RuntimeError('Remote is busy and cannot connect')
+    assert len(f_to_upload) == len(timeouts)
+    pkgs_timeouts = {f_to_upload[i]:timeouts[i] for i in range(len(sizes))}
+    for f in f_to_upload:
+        max_tries = 5
+        for tries in range(max_tries):
+            timeout = pkgs_timeouts.get(f)
+            try:
+                logger.info(f'Uploading {f.name}, timeout in {timeout}s')
+                upload_start = time()
+                with tracing.span('upload_file', file=f.name, attempt=tries+1):
+                    mon_bash(UPLOAD_CMD.format(src=f), seconds=int(timeout))
+                metrics.inc('buildbot_upload_bytes_total', f.stat().st_size, help='bytes uploaded to repod')
+                metrics.inc('buildbot_upload_seconds_total', time() - upload_start, help='time spent uploading')
+            except Exception:
+                metrics.inc('buildbot_upload_failures_total', help='failed upload attempts')
+                time_to_sleep = (tries + 1) * 60
+                logger.error(f'We are getting problem uploading {f.name}, wait {time_to_sleep} secs')
+                patret = rrun('push_add_time', args=(f.name, time_to_sleep + timeout))
+                if not patret is None:
+                    logger.error(f'Unable to run push_add_time, reason: {patret}')
+                print_exc_plus()
+                if tries + 1 < max_tries:
+                    sleep(time_to_sleep)
+            else:
+                break
+        else:
+            logger.error(f'Upload {f.name} failed, running push_fail and abort.')
+            pfret = rrun('push_fail', args=(f.name,))
+            if not pfret is None:
+                logger.error(f'Unable to run push_fail, reason: {pfret}')
+            raise RuntimeError('Unable to upload some files')
+    logger.info(f'Requesting repo update for {pkg_update_list_human}')
+    res = "unexpected"
+    max_tries = 5
+    for tries in range(max_tries):
+        try:
+            res = rrun('push_done', args=([f.name for f in f_to_upload],), kwargs={'overwrite': overwrite,})
+        except Exception:
+            time_to_sleep = (tries + 1) * 60
+            logger.info(f'Error updating {pkg_update_list_human}, wait {time_to_sleep} secs')
+            print_exc_plus()
+            if tries + 1 < max_tries:
+                sleep(time_to_sleep)
+        else:
+            break
+    else:
+        ret = f'Update failed for {pkg_update_list_human}: max reties exceeded'
+        logger.error(ret)
+        raise RuntimeError(ret)
+    if res is None:
+        logger.info(f'Update success for {pkg_update_list_human}')
+    else:
+        ret = f'Update failed for {pkg_update_list_human}, reason: {res}'
+        logger.error(ret)
+        raise RuntimeError(ret)
+    return res is None
+
+def run_job(job):
+    if job.multiarch:
+        clean(job, remove_pkg=True)
+        makepkg(job)
+        sign(job)
+        if upload(job):
+            clean(job, remove_pkg=True)
+    else:
+        makepkg(job)
+        sign(job)
+        if upload(job):
+            if job.pkgconfig.cleanbuild:
+                clean(job, remove_pkg=True)
+            else:
+                clean(job, rm_src=False, remove_pkg=True)
@@ -5,6 +5,7 @@
 
 import logging
 import os
+import json
 from multiprocessing.connection import Client
 from time import sleep
 
@@ -13,51 +14,112 @@ abspath=os.path.dirname(abspath)
 os.chdir(abspath)
 
 from config import REPOD_BIND_ADDRESS, REPOD_BIND_PASSWD, \
-                   MASTER_BIND_ADDRESS, MASTER_BIND_PASSWD, \
-                   CONSOLE_LOGFILE, MAIN_LOGFILE
+                   MASTER_BIND_ADDRESS, MASTER_BIND_PASSWD
 
 from utils import print_exc_plus
 
+import tracing
+import wire
+
 logger = logging.getLogger(f'buildbot.{__name__}')
 
 
-def run(funcname, args=list(), kwargs=dict(), retries=0, server=(REPOD_BIND_ADDRESS, REPOD_BIND_PASSWD)):
+def run(funcname, args=list(), kwargs=dict(), retries=0, server=(REPOD_BIND_ADDRESS, REPOD_BIND_PASSWD),
+        max_retries=10, failed=False):
+    '''
+        failed: returned if the call could not be made or got no answer
+    '''
     try:
-        logger.info('client: %s %s %s',funcname, args, kwargs)
+        # do not flood the console while following logs or from workers
+        log = logger.debug if funcname.startswith(('log_', 'worker_')) else logger.info
+        log('client: %s %s %s',funcname, args, kwargs)
         (addr, authkey) = server
         with Client(addr, authkey=authkey) as conn:
-            conn.send([funcname, args, kwargs])
-            return conn.recv()
+            wire.nodelay(conn)
+            ctx = tracing.current()
+            if ctx:
+                # join the trace on the server side
+                wire.send(conn, [funcname, args, kwargs, ctx])
+            else:
+                wire.send(conn, [funcname, args, kwargs])
+            return wire.recv(conn)
     except ConnectionRefusedError:
-        if retries <= 10:
+        if retries < max_retries:
             logger.info("Server refused, retry after 60s")
             sleep(60)
-            return run(funcname, args=args, kwargs=kwargs, retries=retries+1)
+            return run(funcname, args=args, kwargs=kwargs, retries=retries+1, server=server,
+                       max_retries=max_retries, failed=failed)
         else:
             logger.error("Server refused")
-            return False
+            return failed
     except EOFError:
         logger.error('Internal server error')
-        return False
+        return failed
     except Exception:
         print_exc_plus()
+        return failed
+
+def run_batch(ops, server=(MASTER_BIND_ADDRESS, MASTER_BIND_PASSWD), max_retries=10):
+    '''
+        ops: [(funcname, args, kwargs), ...], one connection for all of them
+        returns [{'ok': True, 'result': ...} or {'ok': False, 'error': ...}]
+        a server without batch gets one call per op
+    '''
+    ops = [[funcname, list(args), dict(kwargs)] for (funcname, args, kwargs) in ops]
+    rets = run('batch', args=(ops,), server=server, max_retries=max_retries)
+    if type(rets) is list and len(rets) == len(ops):
+        return rets
+    logger.warning('batch unavailable, calling one by one')
+    rets = list()
+    for (funcname, args, kwargs) in ops:
+        ret = run(funcname, args=args, kwargs=kwargs, server=server, max_retries=max_retries)
+        rets.append({'ok': True, 'result': ret} if ret is not False else
+                    {'ok': False, 'error': f'{funcname} failed'})
+    return rets
 
 if __name__ == '__main__':
     import argparse
     from utils import configure_logger
     configure_logger(logger)
-    def print_log(debug=False):
-        if debug:
-            os.system(f'tail -n 43 -f \"{MAIN_LOGFILE}\"')
-        else:
-            os.system(f'tail -n 43 -f \"{CONSOLE_LOGFILE}\"')
+    def print_log(debug=False, build=False):
+        server=(MASTER_BIND_ADDRESS, MASTER_BIND_PASSWD)
+        channel = 'makepkg' if build else ('debug' if debug else 'console')
+        sub_id = run('log_subscribe', args=(channel,), server=server)
+        if not sub_id:
+            logger.error('Unable to subscribe to %s log', channel)
+            return
+        try:
+            if not build:
+                tail = run('extras', args=('debuglog' if debug else 'mainlog',), server=server)
+                if tail:
+                    print('\n'.join(tail.split('\n')[-43:]), end='', flush=True)
+            while True:
+                ret = run('log_fetch', args=(sub_id,), server=server)
+                if not ret:
+                    logger.error('Log subscription expired')
+                    break
+                (lines, dropped) = ret
+                if dropped:
+                    print(f'[{dropped} lines dropped]')
+                print(''.join(lines), end='', flush=True)
+                sleep(1)
+        finally:
+            run('log_unsubscribe', args=(sub_id,), server=server)
+    def print_batch(rets):
+        for ret in rets:
+            if ret['ok']:
+                logger.info(ret['result'])
+            else:
+                logger.error(ret['error'])
     try:
         actions = {
                     'info':     'show buildbot info',
+                    'status':   '[field1 field2] show buildbot status as json',
                     'update':   '[--overwrite] update pushed files to the repo',
                     'clean':    '[dir / all] checkout pkgbuilds in packages',
                     'rebuild':  '[dir1 dir2 --clean] rebuild packages',
-                    'log':      '[--debug] print log',
+                    'log':      '[--debug] follow log',
+                    'buildlog': 'follow the output of the running build',
                     'upload':   '[dir1 dir2 --overwrite] force upload packages',
                     'getup':    'check for updates now'
                   }
@@ -82,6 +144,9 @@ if __name__ == '__main__':
         if action[0] == 'info':
             server=(MASTER_BIND_ADDRESS, MASTER_BIND_PASSWD)
             logger.info(run('info', server=server))
+        elif action[0] == 'status':
+            server=(MASTER_BIND_ADDRESS, MASTER_BIND_PASSWD)
+            print(json.dumps(run('status', kwargs={'fields': action[1:] or None}, server=server), indent=4))
         elif action[0] == 'getup':
             server=(MASTER_BIND_ADDRESS, MASTER_BIND_PASSWD)
             logger.info(run('getup', server=server))
@@ -97,27 +162,29 @@ if __name__ == '__main__':
             if 'all' in action[1:]:
                 logger.info(run('clean_all', server=server))
             else:
-                for p in action[1:]:
-                    logger.info(run('clean', args=(p,), server=server))
+                print_batch(run_batch([('clean', (p,), {}) for p in action[1:]], server=server))
         elif action[0] == 'rebuild':
             if len(action) <= 1:
                 print('Error: Need package name')
                 parser.print_help()
                 parser.exit(status=1)
             server=(MASTER_BIND_ADDRESS, MASTER_BIND_PASSWD)
-            for p in action[1:]:
-                logger.info(run('rebuild_package', args=(p,), kwargs={'clean': args.clean}, server=server))
+            print_batch(run_batch([('rebuild_package', (p,), {'clean': args.clean}) for p in action[1:]],
+                                  server=server))
         elif action[0] == 'upload':
             if len(action) <= 1:
                 print('Error: Need package name')
                 parser.print_help()
                 parser.exit(status=1)
             server=(MASTER_BIND_ADDRESS, MASTER_BIND_PASSWD)
-            for p in action[1:]:
-                logger.info(run('force_upload', args=(p,), kwargs={'overwrite': args.overwrite}, server=server))
+            print_batch(run_batch([('force_upload', (p,), {'overwrite': args.overwrite}) for p in action[1:]],
+                                  server=server))
         elif action[0] == 'log':
             logger.info('printing logs')
             print_log(debug=args.debug)
+        elif action[0] == 'buildlog':
+            logger.info('printing build logs')
+            print_log(build=True)
         else:
             parser.error("Please choose an action")
     except Exception:
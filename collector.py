@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# collector.py: Automatic management tool for an arch repo.
+# This file is part of Buildbot by JerryXiao
+
+# garbage collection for the repo dirs, runs in a thread of repod.py
+# every GC_INTERVAL secs a pass lists each dir of GC_POLICIES and picks
+# what its policy does not keep:
+#   keep_versions -- recent versions of every package (vercmp only runs
+#                    for packages having more than that)
+#   max_age       -- secs
+#   max_files, max_bytes -- oldest files go first
+# files in recycled/ are deleted, files elsewhere are thrown away to
+# recycled/. the work is done GC_BATCH files at a time with the repo lock
+# held, and waits while a push is in progress. unreferenced blobs of the
+# object store are dropped at the end of a pass, listed once and deleted
+# in batches the same way.
+
+import os
+import logging
+from pathlib import Path
+from threading import Thread, Event, Lock
+from time import time
+
+from config import GC_POLICIES, GC_INTERVAL, GC_BATCH, GC_STEP_INTERVAL
+from shared_vars import PKG_SUFFIX
+from utils import get_pkg_details_from_name, print_exc_plus
+
+import metrics
+
+logger = logging.getLogger(f'buildbot.{__name__}')
+
+RECYCLED_DIR = 'recycled'
+
+def recycled_time(fpath, st):
+    '''
+        throw_away appends _{time()} to the name
+    '''
+    try:
+        return float(fpath.name.rsplit('_', 1)[1])
+    except (IndexError, ValueError):
+        return st.st_ctime
+
+def pkg_fname(fname):
+    '''
+        the package a file belongs to, None for other files
+    '''
+    if fname.endswith('.sig'):
+        fname = fname[:-4]
+    return fname if fname.endswith(PKG_SUFFIX) else None
+
+class garbageCollector:
+    def __init__(self, policies=GC_POLICIES, interval=GC_INTERVAL, batch=GC_BATCH,
+                 step_interval=GC_STEP_INTERVAL, lock=None, busy=None):
+        '''
+            lock: held while removing files, shared with the rpc handlers
+            busy: callable, no work is done while it returns True
+        '''
+        assert type(batch) is int and batch >= 1
+        self.policies = policies
+        self.interval = interval
+        self.batch = batch
+        self.step_interval = step_interval
+        self.lock = lock if lock is not None else Lock()
+        self.busy = busy if busy is not None else (lambda: False)
+        self.__stop = Event()
+        self.__wakeup = Event()
+        self.__thread = None
+        self.last_pass = None
+        self.passes = 0
+    def __repr__(self):
+        return f'garbageCollector({self.policies}, interval={self.interval}, batch={self.batch})'
+    def select(self, dirname, policy, now=None):
+        '''
+            returns [(fpath, lstat)] of files the policy does not keep
+        '''
+        now = now if now is not None else time()
+        basedir = Path(dirname)
+        if not basedir.is_dir():
+            return list()
+        files = dict()
+        for fpath in basedir.iterdir():
+            if fpath.name.startswith('.'):
+                continue
+            try:
+                st = fpath.lstat()
+            except FileNotFoundError:
+                continue
+            if fpath.is_dir() and not fpath.is_symlink():
+                continue
+            files[fpath.name] = (fpath, st)
+        selected = set()
+        keep_versions = policy.get('keep_versions', None)
+        if keep_versions:
+            families = dict()
+            for fname in files:
+                if fname.endswith(PKG_SUFFIX):
+                    pkg = get_pkg_details_from_name(fname)
+                    families.setdefault((pkg.pkgname, pkg.arch), list()).append(pkg)
+            for family in families.values():
+                if len(family) > keep_versions:
+                    for pkg in sorted(family, reverse=True)[keep_versions:]:
+                        selected.add(pkg.fname)
+        max_age = policy.get('max_age', None)
+        if max_age:
+            for (fname, (fpath, st)) in files.items():
+                mtime = recycled_time(fpath, st) if dirname == RECYCLED_DIR else st.st_mtime
+                if now - mtime > max_age:
+                    selected.add(pkg_fname(fname) or fname)
+        (max_files, max_bytes) = (policy.get('max_files', None), policy.get('max_bytes', None))
+        if max_files or max_bytes:
+            remaining = sorted([(fpath, st) for (fname, (fpath, st)) in files.items()
+                                if (pkg_fname(fname) or fname) not in selected],
+                               key=lambda f: recycled_time(*f) if dirname == RECYCLED_DIR else f[1].st_mtime)
+            count = len(remaining)
+            size = sum([st.st_size for (_, st) in remaining])
+            for (fpath, st) in remaining:
+                if not ((max_files and count > max_files) or (max_bytes and size > max_bytes)):
+                    break
+                selected.add(pkg_fname(fpath.name) or fpath.name)
+                count -= 1
+                size -= st.st_size
+        # a package and its signature go together
+        return [(fpath, st) for (fname, (fpath, st)) in files.items()
+                if (pkg_fname(fname) or fname) in selected]
+    def __wait(self, secs):
+        '''
+            returns True if stopped
+        '''
+        return self.__stop.wait(secs)
+    def __step(self, dirname, items):
+        '''
+            returns bytes reclaimed
+        '''
+        from repo import throw_away
+        reclaimed = 0
+        while self.busy():
+            if self.__wait(self.step_interval):
+                return reclaimed
+        with self.lock:
+            for (fpath, st) in items:
+                try:
+                    if dirname == RECYCLED_DIR:
+                        fpath.unlink()
+                        if st.st_nlink == 1:
+                            reclaimed += st.st_size
+                    else:
+                        throw_away(fpath)
+                except FileNotFoundError:
+                    logger.debug(f'{fpath} is gone already')
+        return reclaimed
+    def collect(self):
+        '''
+            one pass over all dirs
+            returns {dirname: (files removed, bytes reclaimed)}
+        '''
+        from repo import store
+        start = time()
+        report = dict()
+        # recycled last, it gets what the others throw away
+        dirnames = sorted(self.policies, key=lambda d: d == RECYCLED_DIR)
+        for dirname in dirnames:
+            # vercmp is slow, files vanishing meanwhile are skipped in __step
+            selected = self.select(dirname, self.policies[dirname])
+            (count, reclaimed) = (0, 0)
+            for i in range(0, len(selected), self.batch):
+                if self.__stop.is_set():
+                    break
+                items = selected[i:i+self.batch]
+                reclaimed += self.__step(dirname, items)
+                count += len(items)
+                if i + self.batch < len(selected) and self.__wait(self.step_interval):
+                    break
+            report[dirname] = (count, reclaimed)
+            if count:
+                logger.info(f'gc: {dirname}: {count} files removed, {reclaimed} bytes reclaimed')
+        # objects/ is listed once without the lock, store.gc checks the
+        # link count again before deleting
+        candidates = store.unreferenced()
+        (count, reclaimed) = (0, 0)
+        for i in range(0, len(candidates), self.batch):
+            if self.__stop.is_set():
+                break
+            while self.busy():
+                if self.__wait(self.step_interval):
+                    break
+            with self.lock:
+                (blobs, size) = store.gc(blobs=candidates[i:i+self.batch])
+            count += blobs
+            reclaimed += size
+            if i + self.batch < len(candidates) and self.__wait(self.step_interval):
+                break
+        report['objects'] = (count, reclaimed)
+        for (dirname, (count, reclaimed)) in report.items():
+            metrics.inc('repod_gc_files_total', count, help='files removed by the gc', dir=dirname)
+            metrics.inc('repod_gc_reclaimed_bytes_total', reclaimed, help='bytes reclaimed by the gc', dir=dirname)
+        total = sum([r for (_, r) in report.values()])
+        self.passes += 1
+        self.last_pass = {'time': start, 'seconds': time() - start, 'reclaimed': total,
+                          'dirs': {d: {'files': c, 'bytes': r} for (d, (c, r)) in report.items()}}
+        logger.info(f'gc pass finished in {time() - start:.2f}s, {total} bytes reclaimed')
+        return report
+    def trigger(self):
+        '''
+            start a pass now
+        '''
+        self.__wakeup.set()
+    def status(self):
+        return {'interval': self.interval, 'batch': self.batch, 'passes': self.passes,
+                'last_pass': self.last_pass}
+    def __run(self):
+        while not self.__stop.is_set():
+            try:
+                self.collect()
+            except Exception:
+                print_exc_plus()
+            self.__wakeup.wait(self.interval)
+            self.__wakeup.clear()
+    def start(self):
+        if self.__thread is not None:
+            return
+        self.__thread = Thread(target=self.__run, name='gc')
+        self.__thread.daemon = True
+        self.__thread.start()
+        logger.info(f'gc started, {self.policies}')
+    def stop(self):
+        self.__stop.set()
+        self.__wakeup.set()
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
@@ -11,6 +11,12 @@ BUILD_ARCH_MAPPING = {'aarch64': 'aarch64', 'x86_64': 'x86_64', 'any': 'x86_64',
 
 AUTOBUILD_FNAME = 'autobuild.yaml'
 
+# rpc wire format, see wire.py
+RPC_COMPRESS_MIN = 16*1024 # bytes, larger messages are compressed, None to disable
+RPC_COMPRESS_LEVEL = 1 # zlib level
+RPC_MAX_MESSAGE = 256*1024*1024 # bytes, larger messages are refused
+RPC_BACKLOG = 64 # connections waiting to be accepted, more get lost with busy workers
+
 
 #### config for repo.py
 
@@ -18,6 +24,15 @@ REPO_CMD = 'repo-add --verify --remove'
 REPO_REMOVE_CMD = 'repo-remove --verify'
 RECENT_VERSIONS_KEPT = 3
 PREFERRED_ANY_BUILD_ARCH = 'x86_64'
+REGENERATE_JOBS = 4 # arches regenerated at once, 1 to disable the process pool
+# how _update puts packages into www, tried in order
+# www must be on the filesystem of the package store (repo/objects)
+# hardlink: www and archive share the file
+# the other methods are fallbacks, their copy is linked to its blob afterwards
+# reflink: copy on write clone (btrfs, xfs)
+# kernel: copy_file_range / sendfile, userspace: plain copy
+PUBLISH_METHODS = ['hardlink', 'reflink', 'kernel', 'userspace']
+SNAPSHOTS_KEPT = 5 # snapshots of www to roll back to, at least 1: the journal and the index need them
 
 
 #### config for repod.py
@@ -26,7 +41,18 @@ REPOD_BIND_ADDRESS = ('localhost', 7010)
 REPOD_BIND_PASSWD = b'mypassword'
 
 REPO_PUSH_BANDWIDTH = 1 # 1Mbps
+REPOD_METRICS_ADDRESS = ('localhost', 7013) # None to disable
+REPOD_TRACE_LOGFILE = 'repod.trace.jsonl' # None to disable
 GPG_VERIFY_CMD = 'gpg --verify'
+GPG_VERIFY_WORKERS = 4
+# garbage collection, see collector.py
+GC_INTERVAL = 60*60 # secs between passes
+GC_BATCH = 50 # files removed with the repo lock held
+GC_STEP_INTERVAL = 1 # secs between batches
+GC_POLICIES = {
+    'archive': {'keep_versions': RECENT_VERSIONS_KEPT, 'max_bytes': 50*1024**3},
+    'recycled': {'max_age': 7*24*60*60, 'max_bytes': 10*1024**3},
+}
 
 
 #### config for package.py
@@ -36,12 +62,15 @@ GPG_KEY = 'BEE4F1D5A661CA1FEA65C38093962CE07A0D5B7D'
 GPG_SIGN_CMD = (f'gpg --default-key {GPG_KEY} --no-armor '
                  '--pinentry-mode loopback --passphrase \'\' '
                  '--detach-sign --yes --')
+GPG_SIGN_WORKERS = 4
 
 #### config for buildbot.py
 
 UPDATE_INTERVAL = 60 # mins
+UPDATE_CHECK_WORKERS = 4 # packages of a rebuild / force_upload checked at once
 MASTER_BIND_ADDRESS = ('localhost', 7011)
 MASTER_BIND_PASSWD = b'mypassword'
+MASTER_METRICS_ADDRESS = ('localhost', 7012) # None to disable
 PKGBUILD_DIR = 'pkgbuilds'
 MAKEPKG = 'makepkg --nosign --needed --noconfirm --noprogressbar --nocolor'
 
@@ -57,6 +86,22 @@ SHELL_ARCH_X64 = ['/usr/bin/sudo', 'machinectl', '--quiet', 'shell', 'build@arch
 SHELL_ARCH_ARM64 = ['/usr/bin/sudo', 'machinectl', '--quiet', 'shell', 'root@alarm', '/bin/su', '-l', 'alarm', '-c']
 SHELL_ARM64_ADDITIONAL = 'set -e; set -x'
 SHELL_TRAP = 'trap \'echo ++ exit $?\' ERR EXIT'
+# long-lived shells for update checks, see session.py
+NSPAWN_SESSIONS = True
+SESSION_ARCH_X64 = ['/usr/bin/sudo', 'machinectl', '--quiet', 'shell', 'build@archlinux', '/bin/bash']
+SESSION_ARCH_ARM64 = ['/usr/bin/sudo', 'machinectl', '--quiet', 'shell', 'root@alarm', '/bin/su', '-l', 'alarm']
+# build arch => [(kind, options)], see executor.py
+# kinds: local, machinectl, bwrap, unshare, remote, fake
+BUILD_EXECUTORS = {
+    'x86_64': [('machinectl', {'name': 'archlinux', 'shell': SHELL_ARCH_X64,
+                               'session_shell': SESSION_ARCH_X64})],
+    'aarch64': [('machinectl', {'name': 'alarm', 'shell': SHELL_ARCH_ARM64,
+                                'session_shell': SESSION_ARCH_ARM64,
+                                'additional': SHELL_ARM64_ADDITIONAL})],
+}
+HOOK_MODE = 'batch' # default for autobuild.yaml hooks: mode, batch / serial / parallel
+HOOK_TIMEOUT = 60 # default for autobuild.yaml hooks: timeout, mins
+HOOK_MARKER = 'BUILDBOT_HOOK'
 
 UPLOAD_CMD = 'rsync -avPh \"{src}\" repoupload:/srv/repo/buildbot/repo/updates/'
 
@@ -64,8 +109,52 @@ GIT_PULL = 'git pull'
 GIT_RESET_SUBDIR = 'git checkout HEAD -- .'
 
 
+# live log streaming (client.py log)
+LOG_STREAM_BUFFER = 2000 # lines kept per subscriber
+LOG_STREAM_EXPIRE = 120 # secs, drop subscribers not polling
+
+# logging, see utils.configure_logger and notify.py
+LOG_QUEUE_SIZE = 10000 # records buffered for the background writer
+NOTIFY_INTERVAL = 60 # secs, at most one notification per interval
+NOTIFY_MAX_LINES = 200 # lines kept for the next digest
+NOTIFY_MAX_CHARS = 4000
+
+# exception reports, see utils.print_exc_plus
+EXC_MAX_FRAMES = 8 # innermost frames listed with locals
+EXC_MAX_LOCALS = 30 # locals listed per frame
+EXC_REPR_MAXSTRING = 200 # chars per value
+EXC_DEDUP_WINDOW = 10*60 # secs, repeated tracebacks are only counted
+
 # logfiles
 MAIN_LOGFILE = 'buildbot.log'
 CONSOLE_LOGFILE = 'buildbot.log.console'
 PKG_UPDATE_LOGFILE = 'buildbot.log.update'
 MAKEPKG_LOGFILE = 'buildbot.log.makepkg'
+TRACE_LOGFILE = 'buildbot.trace.jsonl' # None to disable
+
+#### config for worker.py
+
+WORKER_BIND_ADDRESS = ('localhost', 7014) # remote executor rpc, None to disable
+WORKER_BIND_PASSWD = b'mypassword'
+WORKER_NAME = None # defaults to the hostname
+WORKER_ARCHS = ['x86_64', 'aarch64'] # the arches of its BUILD_EXECUTORS
+WORKER_CAPACITY = 1 # concurrent build jobs
+WORKER_PULL_INTERVAL = 10 # secs between asking for jobs when idle
+WORKER_HEARTBEAT = 10 # secs
+WORKER_TIMEOUT = 60 # secs without heartbeat before the master reassigns its jobs
+WORKER_MAX_ATTEMPTS = 3 # give up on a job lost with this many workers
+
+#### config for mirror.py
+
+MIRROR_SOURCE = None # url or dir where www is served, files are downloaded from here
+MIRROR_DEST = None # the mirror of www
+MIRROR_INTERVAL = 5*60 # secs between syncs with --forever
+MIRROR_BATCH = 100 # journal entries asked for at once
+
+#### config for httpd.py
+
+HTTPD_BIND_ADDRESS = None # ('0.0.0.0', 8080) to serve www from repod.py
+HTTPD_KEEPALIVE_TIMEOUT = 15 # secs
+HTTPD_CACHE_SIZE = 64*1024*1024 # bytes of small files kept in memory
+HTTPD_CACHE_MAX_FILE = 4*1024*1024 # larger files are always sent from disk
+HTTPD_CACHE_SUFFIXES = ['.db', '.files', '.db.tar.gz', '.files.tar.gz', '.sig']
@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# executor.py: Automatic management tool for an arch repo.
+# This file is part of Buildbot by JerryXiao
+
+# build executors
+# every build arch maps to a pool of executors, commands go to the least
+# loaded one. utils.nspawn_shell runs everything through here.
+#   local     -- /bin/bash on this host
+#   machinectl-- machinectl shell into a container (the default)
+#   bwrap     -- bubblewrap sandbox around a sysroot
+#   unshare   -- unshare(1) + chroot into a sysroot
+#   remote    -- a worker.py on another host, over the rpc
+#   fake      -- canned output, for tests and benchmarks
+
+import os
+import logging
+import subprocess
+import shlex
+from subprocess import CalledProcessError
+from pathlib import Path
+from threading import Lock
+from time import sleep
+
+from config import BUILD_EXECUTORS, CONTAINER_BUILDBOT_ROOT, SHELL_TRAP, \
+                   NSPAWN_SESSIONS
+
+from utils import run_cmd, logstream
+from session import sessionManager, SessionError
+
+import metrics
+import tracing
+
+logger = logging.getLogger(f'buildbot.{__name__}')
+
+BUILDBOT_ROOT = Path(os.path.dirname(os.path.abspath(__file__)))
+
+class ExecutorError(Exception):
+    '''
+        the executor is unable to run the command at all
+    '''
+    pass
+
+def _write_output(output, logfile=None, stream=None, short_return=False):
+    '''
+        for executors which get the output at once
+    '''
+    if logfile:
+        with open(logfile, 'w') as f:
+            f.write(output)
+    if stream:
+        for line in output.splitlines(keepends=True):
+            logstream.publish(stream, line)
+    if short_return:
+        output = ''.join(output.splitlines(keepends=True)[-20:])
+    return output
+
+class baseExecutor:
+    kind = 'base'
+    def __init__(self, name=None, capacity=1, root=CONTAINER_BUILDBOT_ROOT):
+        assert type(capacity) is int and capacity >= 1
+        self.name = name if name else f'{self.kind}-{id(self):x}'
+        self.capacity = capacity
+        self.root = Path(root)
+        self.active = 0
+    def __repr__(self):
+        return f'{type(self).__name__}({self.name}, active={self.active}/{self.capacity})'
+    def path(self, cwd):
+        return self.root / cwd if cwd else self.root
+    def run(self, cmdline, cwd=None, **kwargs):
+        '''
+            cwd is relative to the buildbot root
+            kwargs are the ones of run_cmd, plus session
+            returns the output, raises CalledProcessError
+        '''
+        raise NotImplementedError
+    def close(self):
+        pass
+
+class localExecutor(baseExecutor):
+    kind = 'local'
+    def __init__(self, root=BUILDBOT_ROOT, **kwargs):
+        super().__init__(root=root, **kwargs)
+    def run(self, cmdline, cwd=None, session=False, **kwargs):
+        command = f'cd {shlex.quote(str(self.path(cwd)))}; {cmdline}'
+        return run_cmd(['/bin/bash', '-x', '-e', '-c', command], **kwargs)
+
+class machinectlExecutor(baseExecutor):
+    kind = 'machinectl'
+    def __init__(self, shell, session_shell=None, additional=None, **kwargs):
+        super().__init__(**kwargs)
+        self.__shell = shell
+        self.__additional = additional
+        self.__sessions = sessionManager({self.name: session_shell}) \
+                          if session_shell and NSPAWN_SESSIONS else None
+    def __session_run(self, cmdline, cwd, keepalive=False, RUN_CMD_TIMEOUT=60, logfile=None,
+                      short_return=False, stream=None, **kwargs):
+        logf = None
+        def on_line(line):
+            nonlocal logf
+            if logfile:
+                if logf is None:
+                    logf = open(logfile, 'w')
+                logf.write(line)
+                logf.flush()
+            if stream:
+                logstream.publish(stream, line)
+        try:
+            (code, outstr) = self.__sessions.run(self.name, cmdline, cwd=cwd, timeout=RUN_CMD_TIMEOUT,
+                                                 on_line=on_line, keepalive=keepalive)
+        finally:
+            if logf:
+                logf.close()
+        metrics.inc('buildbot_session_commands_total', help='commands run in shell sessions',
+                    executor=self.name)
+        if short_return:
+            outstr = ''.join(outstr.splitlines(keepends=True)[-20:])
+        if code != 0:
+            raise subprocess.CalledProcessError(code, cmdline, outstr)
+        return outstr
+    def run(self, cmdline, cwd=None, session=False, **kwargs):
+        cwd = self.path(cwd)
+        if session and self.__sessions:
+            try:
+                return self.__session_run(cmdline, cwd, **kwargs)
+            except SessionError as err:
+                logger.debug(f'{self.name}: falling back to one-shot shell, {err}')
+        additional = f'{self.__additional}; ' if self.__additional else ''
+        command = f'{additional}{SHELL_TRAP}; cd {shlex.quote(str(cwd))}; {cmdline}'
+        ret = run_cmd(self.__shell + [command,], **kwargs)
+        if not ret.endswith('++ exit 0\n'):
+            raise subprocess.CalledProcessError(1, cmdline, ret)
+        return ret
+    def close(self):
+        if self.__sessions:
+            self.__sessions.close()
+
+class sandboxExecutor(baseExecutor):
+    '''
+        prefix + /bin/bash -x -e -c, for bwrap and unshare
+    '''
+    kind = 'sandbox'
+    def __init__(self, prefix, **kwargs):
+        super().__init__(**kwargs)
+        self.__prefix = prefix
+    def run(self, cmdline, cwd=None, session=False, **kwargs):
+        command = f'cd {shlex.quote(str(self.path(cwd)))}; {cmdline}'
+        return run_cmd(self.__prefix + ['/bin/bash', '-x', '-e', '-c', command], **kwargs)
+
+class bwrapExecutor(sandboxExecutor):
+    kind = 'bwrap'
+    def __init__(self, sysroot, root=CONTAINER_BUILDBOT_ROOT, **kwargs):
+        root = Path('/') / root
+        prefix = ['bwrap', '--bind', str(sysroot), '/', '--dev', '/dev', '--proc', '/proc',
+                  '--bind', str(BUILDBOT_ROOT), str(root),
+                  '--unshare-all', '--share-net', '--die-with-parent']
+        super().__init__(prefix, root=root, **kwargs)
+
+class unshareExecutor(sandboxExecutor):
+    '''
+        BUILDBOT_ROOT must be bind mounted at sysroot/root beforehand
+        unshare needs root, the build runs as user of sysroot (setpriv of util-linux),
+        like the build user of the machinectl shells
+    '''
+    kind = 'unshare'
+    def __init__(self, sysroot, user='build', group=None, root=CONTAINER_BUILDBOT_ROOT, **kwargs):
+        assert user and user not in ('root', 0)
+        prefix = ['/usr/bin/sudo', 'unshare', '--mount', '--pid', '--ipc', '--uts', '--fork',
+                  f'--root={sysroot}',
+                  'setpriv', f'--reuid={user}', f'--regid={group if group else user}',
+                  '--init-groups', '--reset-env']
+        super().__init__(prefix, root=Path('/') / root, **kwargs)
+
+class remoteExecutor(baseExecutor):
+    '''
+        run commands on a worker.py, cwd is resolved by the worker
+    '''
+    kind = 'remote'
+    def __init__(self, address, authkey, arch=None, **kwargs):
+        super().__init__(**kwargs)
+        self.address = tuple(address)
+        self.__authkey = authkey
+        self.arch = arch
+    def run(self, cmdline, cwd=None, logfile=None, stream=None, short_return=False, **kwargs):
+        from client import run as rrun
+        kwargs = {k: v for (k, v) in kwargs.items() if k in
+                  ('keepalive', 'KEEPALIVE_TIMEOUT', 'RUN_CMD_TIMEOUT', 'session')}
+        ret = rrun('execute', args=(self.arch, cmdline), kwargs={'cwd': str(cwd) if cwd else None, **kwargs},
+                   server=(self.address, self.__authkey), max_retries=0)
+        if not (type(ret) in (list, tuple) and len(ret) == 2):
+            raise ExecutorError(f'{self.name}: bad response {ret!r}')
+        (code, output) = ret
+        output = _write_output(output, logfile=logfile, stream=stream, short_return=short_return)
+        if code != 0:
+            raise subprocess.CalledProcessError(code, cmdline, output)
+        return output
+
+class fakeExecutor(baseExecutor):
+    '''
+        handler(cmdline, cwd) returns the output or raises,
+        every call is recorded in calls
+    '''
+    kind = 'fake'
+    def __init__(self, handler=None, delay=0.0, **kwargs):
+        super().__init__(**kwargs)
+        self.handler = handler
+        self.delay = delay
+        self.calls = list()
+        self.__lock = Lock()
+    def run(self, cmdline, cwd=None, logfile=None, stream=None, short_return=False, **kwargs):
+        with self.__lock:
+            self.calls.append((cmdline, str(cwd) if cwd else None))
+        if self.delay:
+            sleep(self.delay)
+        output = self.handler(cmdline, cwd) if self.handler else ''
+        return _write_output(output, logfile=logfile, stream=stream, short_return=short_return)
+
+EXECUTOR_KINDS = {
+    'local': localExecutor,
+    'machinectl': machinectlExecutor,
+    'bwrap': bwrapExecutor,
+    'unshare': unshareExecutor,
+    'remote': remoteExecutor,
+    'fake': fakeExecutor,
+}
+
+def make_executor(kind, options=dict()):
+    if kind not in EXECUTOR_KINDS:
+        raise TypeError(f'unknown executor kind {kind}')
+    return EXECUTOR_KINDS[kind](**options)
+
+class executorPool:
+    def __init__(self, arch):
+        self.arch = arch
+        self.__executors = list()
+        self.__lock = Lock()
+    def __repr__(self):
+        return f'executorPool({self.arch}, {self.__executors})'
+    @property
+    def executors(self):
+        return list(self.__executors)
+    def add(self, executor):
+        with self.__lock:
+            assert not [e for e in self.__executors if e.name == executor.name]
+            self.__executors.append(executor)
+    def remove(self, name):
+        with self.__lock:
+            for executor in [e for e in self.__executors if e.name == name]:
+                self.__executors.remove(executor)
+                return executor
+    def capacity(self):
+        return sum([e.capacity for e in self.__executors])
+    def acquire(self):
+        '''
+            the least loaded executor, the first registered one wins a tie
+        '''
+        with self.__lock:
+            if not self.__executors:
+                return None
+            executor = min(self.__executors, key=lambda e: e.active / e.capacity)
+            executor.active += 1
+            return executor
+    def release(self, executor):
+        with self.__lock:
+            executor.active -= 1
+    def run(self, cmdline, cwd=None, **kwargs):
+        executor = self.acquire()
+        if executor is None:
+            raise ExecutorError(f'no executor for {self.arch}')
+        try:
+            with metrics.timer('buildbot_executor_seconds', help='executor wall time',
+                               arch=self.arch, executor=executor.name), \
+                 tracing.span('exec', arch=self.arch, executor=executor.name, cmdline=cmdline[:200]):
+                return executor.run(cmdline, cwd=cwd, **kwargs)
+        finally:
+            self.release(executor)
+
+pools = dict()
+__pools_lock = Lock()
+__configured = False
+
+def get_pool(arch):
+    global __configured
+    with __pools_lock:
+        if not __configured:
+            __configured = True
+            for (barch, executors) in BUILD_EXECUTORS.items():
+                for (kind, options) in executors:
+                    pools.setdefault(barch, executorPool(barch)).add(make_executor(kind, options))
+        return pools.setdefault(arch, executorPool(arch))
+
+def register(arch, executor):
+    logger.info(f'registering executor {executor} for {arch}')
+    get_pool(arch).add(executor)
+
+def unregister(arch, name):
+    executor = get_pool(arch).remove(name)
+    if executor:
+        logger.info(f'unregistered executor {executor} for {arch}')
+        executor.close()
+    return executor
+
+def run(arch, cmdline, cwd=None, **kwargs):
+    return get_pool(arch).run(cmdline, cwd=cwd, **kwargs)
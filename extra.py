@@ -5,6 +5,8 @@
 
 import os
 import logging
+from threading import Lock
+from time import time
 
 from pathlib import Path
 from utils import print_exc_plus
@@ -14,7 +16,7 @@ from config import PKGBUILD_DIR, MAIN_LOGFILE, CONSOLE_LOGFILE, \
 
 import re
 
-ASCII_CRL_REPL = re.compile('\x1B[@-_][0-?]*[ -/]*[@-~]')
+ASCII_CRL_REPL = re.compile(b'\x1B[@-_][0-?]*[ -/]*[@-~]')
 
 logger = logging.getLogger(f'buildbot.{__name__}')
 
@@ -24,45 +26,157 @@ os.chdir(abspath)
 
 REPO_ROOT = Path(PKGBUILD_DIR)
 
+def __hook_lines(pc, stage):
+    '''
+        one line per hook, with its timeout if it is not the default one
+    '''
+    lines = list()
+    for (cmd, seconds) in pc.hooks(stage):
+        mins = int(seconds) // 60
+        lines.append(cmd if mins == pc.hook_timeout else f'{cmd}  # timeout: {mins} mins')
+    return '\n'.join(lines)
+
+def pkg_entry(pc, pkgvers, pkgerrs):
+    ps = ('type', 'cleanbuild', 'timeout', 'priority')
+    hps = ('prebuild', 'postbuild', 'update', 'failure')
+    dps = {p:getattr(pc, p, None) for p in ps}
+    dhps = {p:__hook_lines(pc, p) for p in hps}
+    # additional package details
+    ves = {'version': pkgvers.get(pc.dirname, None), 'errors': pkgerrs.get(pc.dirname, None)}
+    return {**dps, **dhps, **ves}
+
 # generate package list
 def gen_pkglist(pkgconfigs, pkgvers, pkgerrs):
     # pkgall contains details
     # namelist is a list of pkgnames
     pkgall = dict()
     for pc in pkgconfigs:
-        ps = ('type', 'cleanbuild', 'timeout', 'priority')
-        hps = ('prebuild', 'postbuild', 'update', 'failure')
-        dps = {p:getattr(pc, p, None) for p in ps}
-        dhps = {p:'\n'.join([str(cmd) for cmd in getattr(pc, p, None)]) for p in hps}
-        # additional package details
-        ves = {'version': pkgvers.get(pc.dirname, None), 'errors': pkgerrs.get(pc.dirname, None)}
-        pkgall[pc.dirname] = {**dps, **dhps, **ves}
+        pkgall[pc.dirname] = pkg_entry(pc, pkgvers, pkgerrs)
     namelist = [k for k in pkgall]
     return (namelist, pkgall)
 
-def __simpleread(fpath, limit=4096-100, dosub=False):
-    with open(fpath, 'r') as f:
-        c = f.read()
+class pkglistView:
+    '''
+        gen_pkglist kept between calls
+        it is only looked at again when the version of its sources changed
+        (jobsManager.pkgconfigs_version, updateManager.version), and then
+        only the entries of packages whose pkgconfig object, version or
+        error count changed are rebuilt
+        etags: the whole list has the source versions, a package has the
+        generation it was last rebuilt in, both start with the time the
+        view was created since the counters start over on a restart
+    '''
+    def __init__(self):
+        self.__epoch = f'{int(time()):x}'
+        self.__lock = Lock()
+        self.__key = None
+        self.__generation = 0
+        self.namelist = list()
+        self.pkgall = dict()
+        # dirname: (pkgconfig, version, errors, generation)
+        self.__sources = dict()
+    def __repr__(self):
+        return f'pkglistView(key={self.__key}, packages={len(self.pkgall)})'
+    def refresh(self, pkgconfigs, pkgvers, pkgerrs, key):
+        '''
+            key: the source versions, nothing is done when it did not change
+            returns the etag of the list
+        '''
+        with self.__lock:
+            if key == self.__key:
+                return self.etag
+            self.__generation += 1
+            (pkgall, sources, rebuilt) = (dict(), dict(), 0)
+            for pc in pkgconfigs or list():
+                (ver, err) = (pkgvers.get(pc.dirname, None), pkgerrs.get(pc.dirname, None))
+                old = self.__sources.get(pc.dirname, None)
+                if old and old[0] is pc and old[1:3] == (ver, err):
+                    pkgall[pc.dirname] = self.pkgall[pc.dirname]
+                    sources[pc.dirname] = old
+                else:
+                    pkgall[pc.dirname] = pkg_entry(pc, pkgvers, pkgerrs)
+                    sources[pc.dirname] = (pc, ver, err, self.__generation)
+                    rebuilt += 1
+            # swapped, not changed in place, readers may hold the old ones
+            (self.pkgall, self.__sources) = (pkgall, sources)
+            self.namelist = list(pkgall)
+            self.__key = key
+            logger.debug(f'pkglist: rebuilt {rebuilt} of {len(pkgall)} packages')
+            return self.etag
+    @property
+    def etag(self):
+        if self.__key is None:
+            return None
+        return '-'.join([self.__epoch, *[str(v) for v in self.__key]])
+    def pkg_etag(self, dirname):
+        source = self.__sources.get(dirname, None)
+        return f'{self.__epoch}-{source[3]}' if source else None
+    def get(self, dirname):
+        return self.pkgall.get(dirname, None)
+
+def __cutpoint(c, limit):
+    '''
+        smallest offset p so that c[p:] with ansi sequences
+        removed is no longer than limit
+    '''
+    excess = len(c) - limit
+    p = 0
+    for m in ASCII_CRL_REPL.finditer(c):
+        excess -= m.end() - m.start()
+    if excess <= 0:
+        return 0
+    for m in ASCII_CRL_REPL.finditer(c):
+        gap = m.start() - p
+        if gap >= excess:
+            return p + excess
+        excess -= gap
+        p = m.end()
+    return p + excess
+
+def __tailread(fpath, limit=4096-100, dosub=False, cursor=None):
+    '''
+        read the last limit bytes before byte offset cursor
+        (defaults to the end of file) without loading the whole file
+        returns (text, start offset of text, file size)
+    '''
+    with open(fpath, 'rb') as f:
+        size = f.seek(0, os.SEEK_END)
+        end = size if cursor is None else max(0, min(int(cursor), size))
+        # ansi sequences are stripped after reading, read more
+        start = max(0, end - (2*limit if dosub else limit))
+        f.seek(start)
+        c = f.read(end - start)
+    p = __cutpoint(c, limit) if dosub else 0
+    # do not begin with a partial utf-8 character
+    while p < len(c) and (start + p) > 0 and (c[p] & 0xC0) == 0x80:
+        p += 1
+    c = c[p:]
+    start += p
     if dosub:
-        c = ASCII_CRL_REPL.sub('', c[-2*limit:])
-    if len(c) > limit:
-        c = c[-limit:]
-    return c
+        c = ASCII_CRL_REPL.sub(b'', c)
+    return (c.decode('utf-8', errors='replace'), start, size)
+
+def __read(fpath, dosub=False, cursor=None, paged=False):
+    (text, start, size) = __tailread(fpath, dosub=dosub, cursor=cursor)
+    if paged:
+        return {'log': text, 'cursor': start, 'size': size}
+    return text
+
 # read logs
-def readpkglog(pkgdirname, update=False):
+def readpkglog(pkgdirname, update=False, cursor=None, paged=False):
     cwd = REPO_ROOT / pkgdirname
     logfile = PKG_UPDATE_LOGFILE if update else MAKEPKG_LOGFILE
     if cwd.exists() and (cwd / logfile).exists():
         logger.debug(f'formatting {"update" if update else "build"} logs in {pkgdirname}')
-        return __simpleread(cwd / logfile, dosub=True)
+        return __read(cwd / logfile, dosub=True, cursor=cursor, paged=paged)
     else:
         logger.debug(f'not found: {"update" if update else "build"} log in dir {pkgdirname}')
         return f"{cwd / logfile} cannot be found"
-def readmainlog(debug=False):
+def readmainlog(debug=False, cursor=None, paged=False):
     logfile = MAIN_LOGFILE if debug else CONSOLE_LOGFILE
     if (Path('.') / logfile).exists():
         logger.debug(f'formatting buildbot{" debug" if debug else ""} logs')
-        return __simpleread(Path('.') / logfile)
+        return __read(Path('.') / logfile, cursor=cursor, paged=paged)
     else:
         logger.debug(f'not found: buildbot{" debug" if debug else ""} log')
         return f"{Path('.') / logfile} cannot be found"
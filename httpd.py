@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# httpd.py: Automatic management tool for an arch repo.
+# This file is part of Buildbot by JerryXiao
+
+# static http server for www, optional (HTTPD_BIND_ADDRESS)
+#   python httpd.py -b 0.0.0.0:8080
+# or started by repod.py. asyncio, GET and HEAD only, keep-alive,
+# Range (one range), ETag / If-None-Match, If-Modified-Since.
+# files are sent with sendfile(2), small hot files (HTTPD_CACHE_SUFFIXES:
+# signatures and databases) are kept in memory while their inode, size
+# and mtime stay the same. directory listings are cached gzipped too.
+
+import os
+import gzip
+import asyncio
+import logging
+import mimetypes
+import posixpath
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+from html import escape
+from pathlib import Path
+from threading import Thread
+from urllib.parse import unquote, urlsplit, quote
+
+from config import HTTPD_BIND_ADDRESS, HTTPD_CACHE_SIZE, HTTPD_CACHE_MAX_FILE, \
+                   HTTPD_CACHE_SUFFIXES, HTTPD_KEEPALIVE_TIMEOUT
+
+import metrics
+
+logger = logging.getLogger(f'buildbot.{__name__}')
+
+abspath = os.path.abspath(__file__)
+WWW_ROOT = Path(abspath).parent / 'repo' / 'www'
+
+REASONS = {200: 'OK', 206: 'Partial Content', 301: 'Moved Permanently', 304: 'Not Modified',
+           400: 'Bad Request', 403: 'Forbidden', 404: 'Not Found', 405: 'Method Not Allowed',
+           416: 'Range Not Satisfiable', 500: 'Internal Server Error'}
+MAX_HEADERS = 100
+
+class httpError(Exception):
+    def __init__(self, code):
+        super().__init__(code)
+        self.code = code
+
+def etag_of(st):
+    return f'"{st.st_ino:x}-{st.st_size:x}-{st.st_mtime_ns:x}"'
+
+def parse_range(header, size):
+    '''
+        returns (first byte, last byte), None to send everything
+        or False if the range is not satisfiable
+    '''
+    if not header.startswith('bytes='):
+        return None
+    spec = header[6:].strip()
+    if ',' in spec:
+        # multipart responses are not worth it, send everything
+        return None
+    (first, _, last) = spec.partition('-')
+    try:
+        if first == '':
+            suffix = int(last)
+            if suffix <= 0:
+                return False
+            (first, last) = (max(0, size - suffix), size - 1)
+        else:
+            first = int(first)
+            last = min(int(last), size - 1) if last else size - 1
+    except ValueError:
+        return None
+    if first < 0 or first > last or first >= size:
+        return False
+    return (first, last)
+
+class hotCache:
+    '''
+        lru of small files, entries are checked against a fresh stat
+    '''
+    def __init__(self, size=HTTPD_CACHE_SIZE, max_file=HTTPD_CACHE_MAX_FILE,
+                 suffixes=HTTPD_CACHE_SUFFIXES):
+        self.size = size
+        self.max_file = max_file
+        self.suffixes = tuple(suffixes)
+        self.used = 0
+        self.__entries = OrderedDict()
+    def eligible(self, name, st):
+        return st.st_size <= self.max_file and name.endswith(self.suffixes)
+    def get(self, key, st):
+        ident = (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+        entry = self.__entries.get(key, None)
+        if entry and entry[0] == ident:
+            self.__entries.move_to_end(key)
+            metrics.inc('httpd_cache_hits_total', help='requests served from memory')
+            return entry[1]
+        metrics.inc('httpd_cache_misses_total', help='cacheable requests read from disk')
+        return None
+    def put(self, key, st, data):
+        ident = (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+        old = self.__entries.pop(key, None)
+        if old:
+            self.used -= len(old[1])
+        if len(data) > self.size:
+            return
+        self.__entries[key] = (ident, data)
+        self.used += len(data)
+        while self.used > self.size:
+            (_, (_, evicted)) = self.__entries.popitem(last=False)
+            self.used -= len(evicted)
+
+class staticServer:
+    def __init__(self, root=WWW_ROOT, keepalive=HTTPD_KEEPALIVE_TIMEOUT, cache=None):
+        self.root = Path(root)
+        self.keepalive = keepalive
+        self.cache = cache if cache is not None else hotCache()
+        self.server = None
+        self.loop = None
+    def __repr__(self):
+        return f'staticServer({self.root})'
+    def resolve(self, target):
+        '''
+            returns the path relative to root, the tree is trusted: its
+            symlinks (snapshots, archive) may point outside root
+        '''
+        path = unquote(urlsplit(target).path)
+        if not path.startswith('/') or '\x00' in path:
+            raise httpError(400)
+        rel = posixpath.normpath(path).lstrip('/')
+        if rel == '.' or rel == '':
+            rel = ''
+        if rel.split('/')[0] == '..':
+            raise httpError(403)
+        return (path, rel)
+    def listing(self, path, fpath, st):
+        '''
+            returns (html, gzipped html)
+        '''
+        key = ('index', str(fpath))
+        cached = self.cache.get(key, st)
+        if cached:
+            return cached
+        names = sorted([f.name + ('/' if f.is_dir() else '') for f in fpath.iterdir()
+                        if not f.name.startswith('.')])
+        lines = [f'<html><head><title>Index of {escape(path)}</title></head><body>',
+                 f'<h1>Index of {escape(path)}</h1><hr><pre>']
+        if path != '/':
+            lines.append('<a href="../">../</a>')
+        lines += [f'<a href="{quote(name)}">{escape(name)}</a>' for name in names]
+        lines.append('</pre><hr></body></html>\n')
+        html = '\n'.join(lines).encode('utf-8')
+        data = (html, gzip.compress(html, compresslevel=6))
+        self.cache.put(key, st, data)
+        return data
+    def respond(self, method, target, headers):
+        '''
+            returns (code, headers, body or None, (file, first, count) or None)
+        '''
+        (path, rel) = self.resolve(target)
+        fpath = self.root / rel if rel else self.root
+        try:
+            st = fpath.stat()
+        except (FileNotFoundError, NotADirectoryError):
+            raise httpError(404)
+        except PermissionError:
+            raise httpError(403)
+        out = {'Last-Modified': formatdate(st.st_mtime, usegmt=True)}
+        if fpath.is_dir():
+            if not path.endswith('/'):
+                return (301, {'Location': quote(f'{path}/')}, b'', None)
+            (html, gzipped) = self.listing(path, fpath, st)
+            out['Content-Type'] = 'text/html; charset=utf-8'
+            out['Vary'] = 'Accept-Encoding'
+            if 'gzip' in headers.get('accept-encoding', ''):
+                out['Content-Encoding'] = 'gzip'
+                return (200, out, gzipped, None)
+            return (200, out, html, None)
+        etag = etag_of(st)
+        out['ETag'] = etag
+        out['Accept-Ranges'] = 'bytes'
+        out['Content-Type'] = mimetypes.guess_type(fpath.name)[0] or 'application/octet-stream'
+        inm = headers.get('if-none-match', None)
+        if inm is not None:
+            if inm.strip() == '*' or etag in [t.strip() for t in inm.split(',')]:
+                return (304, out, b'', None)
+        elif 'if-modified-since' in headers:
+            try:
+                if int(st.st_mtime) <= parsedate_to_datetime(headers['if-modified-since']).timestamp():
+                    return (304, out, b'', None)
+            except (TypeError, ValueError):
+                pass
+        (code, first, count) = (200, 0, st.st_size)
+        if 'range' in headers and headers.get('if-range', etag) in (etag, out['Last-Modified']):
+            rng = parse_range(headers['range'], st.st_size)
+            if rng is False:
+                return (416, {'Content-Range': f'bytes */{st.st_size}'}, b'', None)
+            if rng:
+                (code, first, count) = (206, rng[0], rng[1] - rng[0] + 1)
+                out['Content-Range'] = f'bytes {rng[0]}-{rng[1]}/{st.st_size}'
+        if method == 'HEAD':
+            out['Content-Length'] = str(count)
+            return (code, out, None, None)
+        if self.cache.eligible(fpath.name, st):
+            data = self.cache.get(('file', str(fpath)), st)
+            if data is None:
+                with open(fpath, 'rb') as f:
+                    data = f.read()
+                self.cache.put(('file', str(fpath)), st, data)
+            return (code, out, data[first:first+count], None)
+        return (code, out, None, (fpath, first, count))
+    async def __read_request(self, reader):
+        '''
+            returns (method, target, version, headers) or None at eof
+        '''
+        line = await reader.readline()
+        if not line:
+            return None
+        if not line.endswith(b'\n'):
+            raise httpError(400)
+        parts = line.decode('latin-1').split()
+        if len(parts) != 3 or not parts[2].startswith('HTTP/1.'):
+            raise httpError(400)
+        headers = dict()
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n'):
+                break
+            if not line or len(headers) >= MAX_HEADERS or b':' not in line:
+                raise httpError(400)
+            (name, _, value) = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        if 'transfer-encoding' in headers:
+            raise httpError(400)
+        length = int(headers.get('content-length', 0) or 0)
+        if length:
+            await reader.readexactly(length)
+        return (parts[0], parts[1], parts[2], headers)
+    def __head(self, code, headers, keep_alive, length=None):
+        lines = [f'HTTP/1.1 {code} {REASONS.get(code, "Unknown")}',
+                 f'Date: {formatdate(usegmt=True)}', 'Server: buildbot-httpd',
+                 f'Connection: {"keep-alive" if keep_alive else "close"}']
+        if length is not None and code != 304 and 'Content-Length' not in headers:
+            headers['Content-Length'] = str(length)
+        lines += [f'{k}: {v}' for (k, v) in headers.items()]
+        return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+    async def handle(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(self.__read_request(reader), self.keepalive)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+                    return
+                if request is None:
+                    return
+                (method, target, version, headers) = request
+                connection = headers.get('connection', '').lower()
+                keep_alive = ('close' not in connection) if version == 'HTTP/1.1' else \
+                             ('keep-alive' in connection)
+                try:
+                    if method not in ('GET', 'HEAD'):
+                        raise httpError(405)
+                    (code, out, body, sendfile) = self.respond(method, target, headers)
+                except httpError as err:
+                    (code, out, body, sendfile) = (err.code, {'Content-Type': 'text/plain'},
+                                                   f'{err.code} {REASONS[err.code]}\n'.encode('utf-8'), None)
+                    if err.code == 405:
+                        out['Allow'] = 'GET, HEAD'
+                metrics.inc('httpd_requests_total', help='http requests', code=str(code))
+                logger.debug(f'httpd: {method} {target} {code}')
+                if sendfile:
+                    (fpath, first, count) = sendfile
+                    writer.write(self.__head(code, out, keep_alive, length=count))
+                    await writer.drain()
+                    with open(fpath, 'rb') as f:
+                        await loop.sendfile(writer.transport, f, offset=first, count=count)
+                    sent = count
+                elif body is None:
+                    writer.write(self.__head(code, out, keep_alive))
+                    sent = 0
+                else:
+                    if method == 'HEAD':
+                        writer.write(self.__head(code, out, keep_alive, length=len(body)))
+                    else:
+                        writer.write(self.__head(code, out, keep_alive, length=len(body)) + body)
+                    sent = len(body) if method != 'HEAD' else 0
+                await writer.drain()
+                metrics.inc('httpd_sent_bytes_total', sent, help='body bytes sent')
+                if not keep_alive:
+                    return
+        except httpError as err:
+            writer.write(self.__head(err.code, {'Content-Type': 'text/plain'}, False, length=0))
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception:
+            logger.exception('httpd: unexpected error')
+        finally:
+            try:
+                writer.close()
+                await writer.wait_closed()
+            except Exception:
+                pass
+    async def start(self, address):
+        (host, port) = address
+        self.server = await asyncio.start_server(self.handle, host, port, reuse_address=True)
+        logger.info(f'httpd serving {self.root} on {address}')
+        return self.server
+    async def serve_forever(self, address):
+        await self.start(address)
+        async with self.server:
+            await self.server.serve_forever()
+
+def serve(address=HTTPD_BIND_ADDRESS, root=WWW_ROOT):
+    '''
+        serve root on address in a daemon thread with its own event loop
+        returns the staticServer
+    '''
+    server = staticServer(root=root)
+    loop = asyncio.new_event_loop()
+    started = loop.run_until_complete(server.start(address))
+    def run():
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_until_complete(started.serve_forever())
+        except asyncio.CancelledError:
+            # stop()
+            pass
+    tr = Thread(target=run, name='httpd')
+    tr.daemon = True
+    tr.start()
+    server.loop = loop
+    return server
+
+def stop(server):
+    server.loop.call_soon_threadsafe(server.server.close)
+
+if __name__ == '__main__':
+    import argparse
+    from utils import configure_logger
+    configure_logger(logger, logfile='httpd.log', rotate_size=1024*1024*10)
+    parser = argparse.ArgumentParser(description='Static http server for the repo.')
+    parser.add_argument('-b', '--bind', default=None, help='host:port, defaults to HTTPD_BIND_ADDRESS')
+    parser.add_argument('-r', '--root', default=str(WWW_ROOT), help='dir to serve')
+    args = parser.parse_args()
+    if args.bind:
+        (host, _, port) = args.bind.rpartition(':')
+        address = (host, int(port))
+    else:
+        address = HTTPD_BIND_ADDRESS
+    if not address:
+        parser.error('no address to bind')
+    try:
+        asyncio.run(staticServer(root=args.root).serve_forever(address))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# journal.py: Automatic management tool for an arch repo.
+# This file is part of Buildbot by JerryXiao
+
+# change journal of www/<arch> for mirrors, see mirror.py
+# every published snapshot appends one line to journal.jsonl:
+#   {"seq": 3, "time": ..., "snapshot": 7, "changes": [
+#       {"op": "add", "path": "x86_64/foo-1-1-x86_64.pkg.tar.xz", "size": 1234, "sha256": "..."},
+#       {"op": "link", "path": "x86_64/bar-1-1-any.pkg.tar.xz", "target": "../any/bar-1-1-any.pkg.tar.xz"},
+#       {"op": "remove", "path": "x86_64/foo-0-1-x86_64.pkg.tar.xz"}]}
+# files are compared by inode first, so only what changed is hashed.
+# the first entry lists the whole tree. manifest.json is the tree as of
+# the last entry.
+
+import os
+import json
+import stat
+import logging
+from pathlib import Path
+from threading import Lock
+from time import time
+
+from store import objectStore
+
+import metrics
+
+logger = logging.getLogger(f'buildbot.{__name__}')
+
+def listdir(mydir):
+    '''
+        {name: lstat}, dotfiles (unfinished writes) are skipped
+    '''
+    files = dict()
+    if mydir is None or not mydir.is_dir():
+        return files
+    for fpath in mydir.iterdir():
+        if fpath.name.startswith('.'):
+            continue
+        st = fpath.lstat()
+        if fpath.is_dir() and not fpath.is_symlink():
+            continue
+        files[fpath.name] = st
+    return files
+
+def diff(old_dirs, new_dirs):
+    '''
+        old_dirs, new_dirs: {arch: dir}, a missing arch is empty
+        returns the changes from old to new
+    '''
+    changes = list()
+    for arch in sorted(set(old_dirs) | set(new_dirs)):
+        (olddir, newdir) = (old_dirs.get(arch, None), new_dirs.get(arch, None))
+        (old, new) = (listdir(olddir), listdir(newdir))
+        for (name, st) in sorted(new.items()):
+            path = f'{arch}/{name}'
+            ost = old.get(name, None)
+            if stat.S_ISLNK(st.st_mode):
+                target = os.readlink(newdir / name)
+                if ost and stat.S_ISLNK(ost.st_mode) and os.readlink(olddir / name) == target:
+                    continue
+                changes.append({'op': 'link', 'path': path, 'target': target})
+                continue
+            if ost and (ost.st_dev, ost.st_ino) == (st.st_dev, st.st_ino):
+                continue
+            digest = objectStore.digest_of(newdir / name)
+            if ost and stat.S_ISREG(ost.st_mode) and ost.st_size == st.st_size and \
+               objectStore.digest_of(olddir / name) == digest:
+                continue
+            changes.append({'op': 'add', 'path': path, 'size': st.st_size, 'sha256': digest})
+        for name in sorted(old):
+            if name not in new:
+                changes.append({'op': 'remove', 'path': f'{arch}/{name}'})
+    return changes
+
+def apply(files, changes):
+    '''
+        files: {path: change}, as in the manifest
+    '''
+    for change in changes:
+        if change['op'] == 'remove':
+            files.pop(change['path'], None)
+        else:
+            files[change['path']] = change
+    return files
+
+class changeJournal:
+    def __init__(self, path='journal.jsonl', manifest='manifest.json'):
+        self.path = Path(path)
+        self.manifest_path = Path(manifest)
+        self.__lock = Lock()
+        # [(seq, offset in the journal)]
+        self.__index = None
+    def __repr__(self):
+        return f'changeJournal({self.path}, seq={self.seq})'
+    def __load(self):
+        if self.__index is not None:
+            return
+        self.__index = list()
+        if not self.path.exists():
+            return
+        with open(self.path, 'rb+') as f:
+            offset = 0
+            for line in f:
+                if not line.endswith(b'\n'):
+                    # cut short by a crash, the next entry goes here
+                    logger.warning(f'dropping a partial line at the end of {self.path}')
+                    f.truncate(offset)
+                    break
+                self.__index.append((json.loads(line)['seq'], offset))
+                offset += len(line)
+    @property
+    def seq(self):
+        with self.__lock:
+            self.__load()
+            return self.__index[-1][0] if self.__index else 0
+    def record(self, changes, **info):
+        '''
+            returns the seq of the new entry
+        '''
+        with self.__lock:
+            self.__load()
+            seq = self.__index[-1][0] + 1 if self.__index else 1
+            entry = {'seq': seq, 'time': time(), **info, 'changes': changes}
+            with open(self.path, 'ab') as f:
+                offset = f.tell()
+                f.write(json.dumps(entry).encode('utf-8') + b'\n')
+                f.flush()
+                os.fsync(f.fileno())
+            self.__index.append((seq, offset))
+            files = apply(self.__read_manifest()['files'], changes)
+            self.__write_manifest({'seq': seq, 'files': files})
+        metrics.inc('repod_journal_changes_total', len(changes), help='changes written to the journal')
+        logger.info(f'journal: entry {seq}, {len(changes)} changes')
+        return seq
+    def record_snapshot(self, old_dirs, new_dirs, snapshot_id):
+        '''
+            on_commit of snapshotManager
+        '''
+        if not self.path.exists():
+            # the first entry has everything
+            old_dirs = dict()
+        return self.record(diff(old_dirs, new_dirs), snapshot=snapshot_id)
+    def __read_manifest(self):
+        if not self.manifest_path.exists():
+            return {'seq': 0, 'files': dict()}
+        with open(self.manifest_path, 'r') as f:
+            return json.load(f)
+    def __write_manifest(self, manifest):
+        tmp = self.manifest_path.parent / f'.{self.manifest_path.name}.writing'
+        with open(tmp, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(tmp, self.manifest_path)
+    def manifest(self):
+        with self.__lock:
+            return self.__read_manifest()
+    def changes(self, since=0, limit=None):
+        '''
+            entries after seq since, at most limit of them
+            returns {'seq': last seq, 'entries': [...]}
+            entries is None if since is unknown here, sync the manifest then
+        '''
+        with self.__lock:
+            self.__load()
+            last = self.__index[-1][0] if self.__index else 0
+            if since > last:
+                return {'seq': last, 'entries': None}
+            entries = list()
+            # seq n is at index n - 1
+            if since < len(self.__index):
+                with open(self.path, 'rb') as f:
+                    f.seek(self.__index[since][1])
+                    for line in f:
+                        entries.append(json.loads(line))
+                        if limit and len(entries) >= limit:
+                            break
+            return {'seq': last, 'entries': entries}
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# metrics.py: Automatic management tool for an arch repo.
+# This file is part of Buildbot by JerryXiao
+
+# counters, gauges and summaries (count + sum) kept in memory,
+# exposed in prometheus text format over http
+
+import logging
+from threading import Thread, Lock
+from time import perf_counter
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(f'buildbot.{__name__}')
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join([f'{k}="{_escape(v)}"' for (k, v) in labels]) + '}'
+
+class metricsRegistry:
+    def __init__(self):
+        self.__lock = Lock()
+        # name => [type, help, {labels: value}]
+        self.__metrics = dict()
+        # name => [type, help, func, label]
+        self.__callbacks = dict()
+    def __get(self, name, mtype, help):
+        metric = self.__metrics.get(name, None)
+        if metric is None:
+            metric = self.__metrics[name] = [mtype, help, dict()]
+        else:
+            assert metric[0] == mtype
+        return metric[2]
+    def inc(self, name, value=1, help='', **labels):
+        key = tuple(sorted(labels.items()))
+        with self.__lock:
+            values = self.__get(name, 'counter', help)
+            values[key] = values.get(key, 0) + value
+    def set(self, name, value, help='', **labels):
+        key = tuple(sorted(labels.items()))
+        with self.__lock:
+            self.__get(name, 'gauge', help)[key] = value
+    def observe(self, name, value, help='', **labels):
+        key = tuple(sorted(labels.items()))
+        with self.__lock:
+            values = self.__get(name, 'summary', help)
+            (count, total) = values.get(key, (0, 0.0))
+            values[key] = (count + 1, total + value)
+    @contextmanager
+    def timer(self, name, help='', **labels):
+        '''
+            observe the time spent in the with block, in seconds
+        '''
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, perf_counter() - start, help=help, **labels)
+    def register_callback(self, name, func, mtype='gauge', help='', label='name'):
+        '''
+            func is called on every scrape, it returns a number
+            or a dict of {label_value: number}
+        '''
+        with self.__lock:
+            self.__callbacks[name] = [mtype, help, func, label]
+    def exposition(self):
+        lines = list()
+        with self.__lock:
+            metrics = {k: [v[0], v[1], dict(v[2])] for (k, v) in self.__metrics.items()}
+            callbacks = dict(self.__callbacks)
+        for (name, (mtype, help, func, label)) in callbacks.items():
+            try:
+                ret = func()
+            except Exception:
+                logger.exception(f'metrics callback {name} failed')
+                continue
+            if type(ret) is dict:
+                values = {((label, k),): v for (k, v) in ret.items()}
+            else:
+                values = {tuple(): ret}
+            metrics[name] = [mtype, help, values]
+        for name in sorted(metrics):
+            (mtype, help, values) = metrics[name]
+            if help:
+                lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} {mtype}')
+            for (key, value) in values.items():
+                labels = _format_labels(key)
+                if mtype == 'summary':
+                    (count, total) = value
+                    lines.append(f'{name}_count{labels} {count}')
+                    lines.append(f'{name}_sum{labels} {total}')
+                else:
+                    lines.append(f'{name}{labels} {value}')
+        return '\n'.join(lines) + '\n'
+
+registry = metricsRegistry()
+inc = registry.inc
+set_gauge = registry.set
+observe = registry.observe
+timer = registry.timer
+register_callback = registry.register_callback
+
+def serve(address, registry=registry):
+    '''
+        serve /metrics on address in a daemon thread
+        returns the http server
+    '''
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] not in ('/', '/metrics'):
+                self.send_error(404)
+                return
+            body = registry.exposition().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        def log_message(self, format, *args):
+            logger.debug('metrics: ' + format, *args)
+    server = ThreadingHTTPServer(address, MetricsHandler)
+    server.daemon_threads = True
+    tr = Thread(target=server.serve_forever)
+    tr.daemon = True
+    tr.start()
+    logger.info('metrics listening on %s', address)
+    return server
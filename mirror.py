@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# mirror.py: Automatic management tool for an arch repo.
+# This file is part of Buildbot by JerryXiao
+
+# incremental mirror of www/<arch>
+#   python mirror.py -s https://example.org/ -d /srv/mirror
+# asks repod for the journal entries after the last one applied
+# (.mirror.json in the mirror), downloads the added files from the
+# source (an url or a local dir), checks their size and sha256 and
+# applies everything at once: packages first, database files next,
+# removals last. a mirror repod does not know about, or one that cannot
+# fetch what the journal lists, is synced from the manifest.
+
+import os
+import json
+import logging
+import shutil
+import urllib.request
+from pathlib import Path
+from time import sleep
+
+from config import REPOD_BIND_ADDRESS, REPOD_BIND_PASSWD, REPO_NAME, ARCHS, \
+                   MIRROR_SOURCE, MIRROR_DEST, MIRROR_INTERVAL, MIRROR_BATCH
+from client import run as rrun
+from store import objectStore
+from utils import print_exc_plus
+
+import metrics
+
+logger = logging.getLogger(f'buildbot.{__name__}')
+
+STATE_FNAME = '.mirror.json'
+
+def is_db_path(path):
+    fname = path.rsplit('/', 1)[-1]
+    return fname.startswith(f'{REPO_NAME}.db') or fname.startswith(f'{REPO_NAME}.files')
+
+class mirrorError(Exception):
+    pass
+
+class mirrorSync:
+    def __init__(self, dest, source, server=(REPOD_BIND_ADDRESS, REPOD_BIND_PASSWD),
+                 batch=MIRROR_BATCH):
+        self.dest = Path(dest)
+        self.source = str(source)
+        self.server = server
+        self.batch = batch
+        self.dest.mkdir(mode=0o755, exist_ok=True, parents=True)
+    def __repr__(self):
+        return f'mirrorSync({self.source} => {self.dest}, seq={self.seq})'
+    @property
+    def seq(self):
+        try:
+            with open(self.dest / STATE_FNAME, 'r') as f:
+                return json.load(f)['seq']
+        except FileNotFoundError:
+            return 0
+    @seq.setter
+    def seq(self, seq):
+        tmp = self.dest / f'{STATE_FNAME}.writing'
+        with open(tmp, 'w') as f:
+            json.dump({'seq': seq}, f)
+        os.replace(tmp, self.dest / STATE_FNAME)
+    def __rpc(self, funcname, **kwargs):
+        ret = rrun(funcname, kwargs=kwargs, server=self.server, max_retries=0)
+        if not ret:
+            raise mirrorError(f'{funcname} failed: {ret}')
+        return ret
+    def __open(self, path):
+        if '://' in self.source:
+            return urllib.request.urlopen(f'{self.source.rstrip("/")}/{path}', timeout=60)
+        return open(Path(self.source) / path, 'rb')
+    def fetch(self, change):
+        '''
+            returns the downloaded file, not in place yet
+        '''
+        dst = self.dest / change['path']
+        dst.parent.mkdir(mode=0o755, exist_ok=True, parents=True)
+        tmp = dst.parent / f'.{dst.name}.mirroring'
+        if dst.exists() and not dst.is_symlink() and dst.stat().st_size == change['size'] and \
+           objectStore.digest_of(dst) == change['sha256']:
+            return None
+        try:
+            with self.__open(change['path']) as fsrc, open(tmp, 'wb') as fdst:
+                shutil.copyfileobj(fsrc, fdst, 1024*1024)
+        except OSError as err:
+            # a 404 too
+            raise mirrorError(f'unable to fetch {change["path"]}: {err}')
+        if tmp.stat().st_size != change['size'] or objectStore.digest_of(tmp) != change['sha256']:
+            tmp.unlink()
+            raise mirrorError(f'{change["path"]} does not match the journal')
+        metrics.inc('mirror_fetched_bytes_total', change['size'], help='bytes downloaded')
+        return tmp
+    def apply(self, changes):
+        '''
+            the last change of every path wins
+        '''
+        latest = dict()
+        for change in changes:
+            latest.pop(change['path'], None)
+            latest[change['path']] = change
+        adds = [c for c in latest.values() if c['op'] != 'remove']
+        # the database files go last, packages have to be there first
+        adds.sort(key=lambda c: is_db_path(c['path']))
+        fetched = [(c, self.fetch(c) if c['op'] == 'add' else None) for c in adds]
+        for (change, tmp) in fetched:
+            dst = self.dest / change['path']
+            if change['op'] == 'link':
+                link = dst.parent / f'.{dst.name}.mirroring'
+                if link.is_symlink():
+                    link.unlink()
+                link.symlink_to(change['target'])
+                os.replace(link, dst)
+            elif tmp is not None:
+                os.replace(tmp, dst)
+        removed = 0
+        for change in [c for c in latest.values() if c['op'] == 'remove']:
+            dst = self.dest / change['path']
+            if dst.exists() or dst.is_symlink():
+                dst.unlink()
+                removed += 1
+        logger.info(f'applied {len(adds)} files, removed {removed}')
+        return (len(adds), removed)
+    def full_sync(self):
+        '''
+            make the mirror look like the manifest
+        '''
+        manifest = self.__rpc('manifest')
+        files = manifest['files']
+        logger.warning(f'full sync at {manifest["seq"]}, {len(files)} files')
+        self.apply(list(files.values()))
+        # an arch without files is not in the manifest
+        archs = set(ARCHS) | set([path.split('/', 1)[0] for path in files])
+        for arch in archs:
+            mydir = self.dest / arch
+            if not mydir.is_dir():
+                continue
+            for fpath in mydir.iterdir():
+                if not fpath.name.startswith('.') and f'{arch}/{fpath.name}' not in files:
+                    fpath.unlink()
+        self.seq = manifest['seq']
+        return manifest['seq']
+    def sync(self):
+        '''
+            returns the seq the mirror is at
+            every pending entry is read before anything is fetched, a file
+            added and removed again since the last sync is never fetched
+        '''
+        since = start = self.seq
+        changes = list()
+        while True:
+            ret = self.__rpc('changes', since=since, limit=self.batch)
+            if ret['entries'] is None:
+                return self.full_sync()
+            for entry in ret['entries']:
+                changes += entry['changes']
+            if ret['entries']:
+                since = ret['entries'][-1]['seq']
+            if not ret['entries'] or since >= ret['seq']:
+                break
+        if since == start:
+            return since
+        try:
+            self.apply(changes)
+        except mirrorError as err:
+            # the source moved on while we were reading
+            logger.warning(f'unable to apply {start} to {since}: {err}, syncing from the manifest')
+            return self.full_sync()
+        self.seq = since
+        logger.info(f'mirror at {since}')
+        return since
+    def run_forever(self, interval=MIRROR_INTERVAL):
+        while True:
+            try:
+                self.sync()
+            except Exception:
+                print_exc_plus()
+            sleep(interval)
+
+if __name__ == '__main__':
+    import argparse
+    from utils import configure_logger
+    configure_logger(logger, logfile='mirror.log', rotate_size=1024*1024*10)
+    parser = argparse.ArgumentParser(description='Incremental mirror of the repo.')
+    parser.add_argument('-s', '--source', default=MIRROR_SOURCE, help='url or dir to download files from')
+    parser.add_argument('-d', '--dest', default=MIRROR_DEST, help='mirror dir')
+    parser.add_argument('-f', '--forever', action='store_true', help=f'sync every {MIRROR_INTERVAL} secs')
+    parser.add_argument('--full', action='store_true', help='sync from the manifest')
+    args = parser.parse_args()
+    if not (args.source and args.dest):
+        parser.error('source and dest are required')
+    mirror = mirrorSync(args.dest, args.source)
+    if args.forever:
+        mirror.run_forever()
+    elif args.full:
+        mirror.full_sync()
+    else:
+        mirror.sync()
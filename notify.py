@@ -3,14 +3,76 @@
 # notify.py: Automatic management tool for an arch repo.
 # This file is part of Buildbot by JerryXiao
 
-from utils import background
 import subprocess
+from collections import deque
+from threading import Thread, Lock, Event
+
+from config import NOTIFY_INTERVAL, NOTIFY_MAX_LINES, NOTIFY_MAX_CHARS
+
+class notifier:
+    '''
+        collect messages and send them as one digest per interval
+        at most max_lines messages are kept, older ones are counted and dropped
+    '''
+    def __init__(self, interval=NOTIFY_INTERVAL, max_lines=NOTIFY_MAX_LINES,
+                 max_chars=NOTIFY_MAX_CHARS):
+        self.__interval = interval
+        self.__max_chars = max_chars
+        self.__lines = deque(maxlen=max_lines)
+        self.__dropped = 0
+        self.__lock = Lock()
+        self.__wakeup = Event()
+        self.__thread = None
+    def send(self, content):
+        with self.__lock:
+            if len(self.__lines) == self.__lines.maxlen:
+                self.__dropped += 1
+            self.__lines.append(str(content))
+            if self.__thread is None:
+                self.__thread = Thread(target=self.__loop)
+                self.__thread.daemon = True
+                self.__thread.start()
+    def flush(self, wait=False):
+        '''
+            wait: send the pending digest now, in this thread (at exit)
+        '''
+        if wait:
+            self.__deliver(self.__digest())
+        else:
+            self.__wakeup.set()
+    def __digest(self):
+        with self.__lock:
+            lines = list(self.__lines)
+            dropped = self.__dropped
+            self.__lines.clear()
+            self.__dropped = 0
+        if not lines:
+            return None
+        digest = '\n'.join(lines)
+        if len(digest) > self.__max_chars:
+            digest = '...\n' + digest[-self.__max_chars:]
+        if dropped:
+            digest = f'[{dropped} messages dropped]\n{digest}'
+        return digest
+    def __loop(self):
+        while True:
+            self.__wakeup.wait(self.__interval)
+            self.__wakeup.clear()
+            self.__deliver(self.__digest())
+    def __deliver(self, digest):
+        if digest:
+            try:
+                subprocess.run(['python', 'tgapi.py', digest], stdout=subprocess.DEVNULL,
+                               stderr=subprocess.DEVNULL, timeout=60)
+            except:
+                pass
+
+__notifier = notifier()
 
 # wip
 # does nothing
-@background
 def send(content):
-    try:
-        subprocess.run(['python', 'tgapi.py', str(content)], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-    except:
-        pass
+    __notifier.send(content)
+
+def flush(wait=False):
+    __notifier.flush(wait=wait)
@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# pkgindex.py: Automatic management tool for an arch repo.
+# This file is part of Buildbot by JerryXiao
+
+# metadata of the published packages in sqlite
+# .PKGINFO and the file list are read once when a package shows up in
+# www/<arch> (after every snapshot, see repo.py), queries never open a
+# package again:
+#   search   -- full text over names and descriptions (fts5)
+#   provides -- packages named X or providing X
+#   owns     -- packages containing a file, a path or a bare name
+#   depends  -- packages depending on X
+#   info     -- everything known about a package
+#   outdated -- published versions older than the ones in pkgver.json
+
+import os
+import re
+import sqlite3
+import logging
+import tarfile
+from pathlib import Path
+from threading import Lock
+
+from config import PKGBUILD_DIR
+from shared_vars import PKG_SUFFIX
+from utils import get_pkg_details_from_name, get_pkgbase_from_pkgbuild, run_cmd, \
+                  alpm_vercmp, print_exc_plus
+
+import metrics
+
+logger = logging.getLogger(f'buildbot.{__name__}')
+
+# .PKGINFO keys stored as relations
+RELATIONS = {'depend': 'depend', 'makedepend': 'makedepend', 'checkdepend': 'checkdepend',
+             'optdepend': 'optdepend', 'provides': 'provide', 'conflict': 'conflict',
+             'replaces': 'replace', 'group': 'group', 'license': 'license'}
+QUERIES = ('search', 'provides', 'owns', 'depends', 'info', 'outdated')
+DEP_RE = re.compile(r'([^<>=:\s]+)\s*(.*)')
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS packages (
+    id INTEGER PRIMARY KEY, fname TEXT UNIQUE NOT NULL, arch TEXT NOT NULL,
+    pkgname TEXT NOT NULL, pkgbase TEXT, version TEXT NOT NULL, description TEXT,
+    url TEXT, packager TEXT, builddate INTEGER, size INTEGER, csize INTEGER);
+CREATE INDEX IF NOT EXISTS packages_pkgname ON packages (pkgname);
+CREATE INDEX IF NOT EXISTS packages_pkgbase ON packages (pkgbase);
+CREATE TABLE IF NOT EXISTS relations (
+    pkg INTEGER NOT NULL, kind TEXT NOT NULL, name TEXT NOT NULL, spec TEXT);
+CREATE INDEX IF NOT EXISTS relations_name ON relations (kind, name);
+CREATE INDEX IF NOT EXISTS relations_pkg ON relations (pkg);
+CREATE TABLE IF NOT EXISTS files (pkg INTEGER NOT NULL, path TEXT NOT NULL, name TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS files_path ON files (path);
+CREATE INDEX IF NOT EXISTS files_name ON files (name);
+CREATE INDEX IF NOT EXISTS files_pkg ON files (pkg);
+CREATE VIRTUAL TABLE IF NOT EXISTS packages_fts USING fts5 (pkgname, description);
+'''
+
+def parse_pkginfo(text):
+    '''
+        returns {key: [values]}
+    '''
+    info = dict()
+    for line in text.split('\n'):
+        line = line.strip()
+        if not line or line.startswith('#') or ' = ' not in line:
+            continue
+        (key, _, value) = line.partition(' = ')
+        info.setdefault(key, list()).append(value)
+    return info
+
+def read_pkg(fpath):
+    '''
+        returns (.PKGINFO text, [file paths])
+    '''
+    try:
+        (text, files) = (None, list())
+        with tarfile.open(fpath, 'r:*') as tar:
+            for member in tar:
+                if member.name == '.PKGINFO':
+                    text = tar.extractfile(member).read().decode('utf-8', errors='replace')
+                elif not member.name.startswith('.') and not member.isdir():
+                    files.append(member.name)
+        return (text, files)
+    except tarfile.ReadError:
+        with open(fpath, 'rb') as f:
+            if f.read(4) != ZSTD_MAGIC:
+                raise
+        # zstd is not supported by tarfile
+        text = run_cmd(['bsdtar', '-xOf', str(fpath), '.PKGINFO'])
+        files = [f for f in run_cmd(['bsdtar', '-tf', str(fpath)]).split('\n')
+                 if f and not f.startswith('.') and not f.endswith('/')]
+        return (text, files)
+
+def load_pkgvers(fpath, pkgbuild_dir=PKGBUILD_DIR):
+    '''
+        {pkgbase: version} from the pkgver.json of buildbot.py
+        its keys are dirnames, the pkgbase is read from their PKGBUILDs
+        (split and renamed packages), the dirname is kept when that fails
+    '''
+    import json
+    try:
+        with open(fpath, 'r') as f:
+            pkgdata = json.load(f)
+    except FileNotFoundError:
+        logger.warning(f'{fpath} not found')
+        return dict()
+    pkgvers = dict()
+    for (dirname, data) in pkgdata.items():
+        try:
+            pkgbase = get_pkgbase_from_pkgbuild(Path(pkgbuild_dir) / dirname / 'PKGBUILD')
+        except (OSError, UnicodeDecodeError):
+            pkgbase = None
+        pkgvers[pkgbase or dirname] = data[0]
+    return pkgvers
+
+def first(info, key, default=None):
+    return info.get(key, [default])[0]
+
+class pkgIndex:
+    def __init__(self, path='pkgindex.sqlite'):
+        self.path = path
+        self.__lock = Lock()
+        self.__db = None
+    def __repr__(self):
+        return f'pkgIndex({self.path})'
+    @property
+    def db(self):
+        '''
+            opened on first use, relative to the cwd at that time
+        '''
+        if self.__db is None:
+            self.__db = sqlite3.connect(self.path, check_same_thread=False)
+            self.__db.row_factory = sqlite3.Row
+            self.__db.execute('PRAGMA journal_mode=WAL')
+            self.__db.executescript(SCHEMA)
+        return self.__db
+    def add(self, fpath, arch):
+        '''
+            must be called with self.__lock held
+        '''
+        pkg = get_pkg_details_from_name(fpath.name)
+        csize = fpath.stat().st_size
+        try:
+            (text, files) = read_pkg(fpath)
+        except Exception:
+            logger.warning(f'unable to read {fpath}, indexing its name only')
+            (text, files) = (None, list())
+        info = parse_pkginfo(text or '')
+        version = first(info, 'pkgver', pkg.ver)
+        cur = self.db.execute(
+            'INSERT INTO packages (fname, arch, pkgname, pkgbase, version, description, url, '
+            'packager, builddate, size, csize) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (fpath.name, arch, first(info, 'pkgname', pkg.pkgname), first(info, 'pkgbase', pkg.pkgname),
+             version, first(info, 'pkgdesc'), first(info, 'url'), first(info, 'packager'),
+             int(first(info, 'builddate', 0) or 0), int(first(info, 'size', 0) or 0), csize))
+        pkg_id = cur.lastrowid
+        relations = list()
+        for (key, kind) in RELATIONS.items():
+            for value in info.get(key, list()):
+                m = DEP_RE.match(value)
+                if m:
+                    relations.append((pkg_id, kind, m.group(1), m.group(2) or None))
+        self.db.executemany('INSERT INTO relations (pkg, kind, name, spec) VALUES (?, ?, ?, ?)', relations)
+        self.db.executemany('INSERT INTO files (pkg, path, name) VALUES (?, ?, ?)',
+                            [(pkg_id, f, f.rstrip('/').rsplit('/', 1)[-1]) for f in files])
+        self.db.execute('INSERT INTO packages_fts (rowid, pkgname, description) VALUES (?, ?, ?)',
+                        (pkg_id, first(info, 'pkgname', pkg.pkgname), first(info, 'pkgdesc', '')))
+        return pkg_id
+    def remove(self, pkg_id):
+        '''
+            must be called with self.__lock held
+        '''
+        for table in ('relations', 'files'):
+            self.db.execute(f'DELETE FROM {table} WHERE pkg = ?', (pkg_id,))
+        self.db.execute('DELETE FROM packages_fts WHERE rowid = ?', (pkg_id,))
+        self.db.execute('DELETE FROM packages WHERE id = ?', (pkg_id,))
+    def sync(self, dirs):
+        '''
+            dirs: {arch: dir}, index what is new there and forget what is gone
+            symlinks (arch=any packages) are indexed once, in any
+            returns (added, removed)
+        '''
+        published = dict()
+        for (arch, mydir) in dirs.items():
+            if not mydir.is_dir():
+                continue
+            for fpath in mydir.iterdir():
+                if fpath.name.endswith(PKG_SUFFIX) and not fpath.is_symlink():
+                    published[fpath.name] = (fpath, arch)
+        with self.__lock, self.db:
+            indexed = {row['fname']: row['id'] for row in self.db.execute('SELECT id, fname FROM packages')}
+            removed = [fname for fname in indexed if fname not in published]
+            for fname in removed:
+                self.remove(indexed[fname])
+            added = [fname for fname in published if fname not in indexed]
+            for fname in added:
+                self.add(*published[fname])
+        if added or removed:
+            metrics.inc('repod_pkgindex_added_total', len(added), help='packages indexed')
+            logger.info(f'pkgindex: {len(added)} added, {len(removed)} removed')
+        return (len(added), len(removed))
+    def __rows(self, sql, args=()):
+        with self.__lock:
+            return [dict(row) for row in self.db.execute(sql, args)]
+    def search(self, term, arch=None, limit=100):
+        # quoted, so that user input is not fts syntax
+        term = ' '.join([f'"{w}"*' for w in term.replace('"', ' ').split()])
+        if not term:
+            return list()
+        return self.__rows('SELECT p.* FROM packages_fts JOIN packages p ON p.id = packages_fts.rowid '
+                           'WHERE packages_fts MATCH ? AND (? IS NULL OR p.arch = ?) '
+                           'ORDER BY rank LIMIT ?', (term, arch, arch, limit))
+    def provides(self, name, arch=None, limit=100):
+        return self.__rows('SELECT p.*, NULL AS provides FROM packages p WHERE p.pkgname = ? '
+                           'AND (? IS NULL OR p.arch = ?) UNION '
+                           'SELECT p.*, r.spec AS provides FROM relations r JOIN packages p ON p.id = r.pkg '
+                           'WHERE r.kind = \'provide\' AND r.name = ? AND (? IS NULL OR p.arch = ?) LIMIT ?',
+                           (name, arch, arch, name, arch, arch, limit))
+    def owns(self, path, arch=None, limit=100):
+        '''
+            /usr/bin/foo and usr/bin/foo are paths, foo is a name
+        '''
+        path = path.lstrip('/')
+        column = 'path' if '/' in path else 'name'
+        return self.__rows(f'SELECT p.*, f.path FROM files f JOIN packages p ON p.id = f.pkg '
+                           f'WHERE f.{column} = ? AND (? IS NULL OR p.arch = ?) LIMIT ?',
+                           (path, arch, arch, limit))
+    def depends(self, name, arch=None, limit=100):
+        return self.__rows('SELECT p.*, r.kind, r.spec FROM relations r JOIN packages p ON p.id = r.pkg '
+                           'WHERE r.kind IN (\'depend\', \'makedepend\', \'checkdepend\', \'optdepend\') '
+                           'AND r.name = ? AND (? IS NULL OR p.arch = ?) LIMIT ?',
+                           (name, arch, arch, limit))
+    def info(self, pkgname, arch=None, limit=100):
+        pkgs = self.__rows('SELECT * FROM packages WHERE pkgname = ? AND (? IS NULL OR arch = ?) LIMIT ?',
+                           (pkgname, arch, arch, limit))
+        for pkg in pkgs:
+            for row in self.__rows('SELECT kind, name, spec FROM relations WHERE pkg = ?', (pkg['id'],)):
+                pkg.setdefault(row['kind'], list()).append(row['name'] + (row['spec'] or ''))
+            pkg['files'] = [row['path'] for row in
+                            self.__rows('SELECT path FROM files WHERE pkg = ?', (pkg['id'],))]
+        return pkgs
+    def outdated(self, pkgvers, arch=None, limit=100):
+        '''
+            pkgvers: {pkgbase: version}, see load_pkgvers
+        '''
+        rows = self.__rows('SELECT * FROM packages WHERE (? IS NULL OR arch = ?)', (arch, arch))
+        outdated = list()
+        for row in rows:
+            latest = pkgvers.get(row['pkgbase'], None)
+            if latest and alpm_vercmp(latest, row['version']) == 1:
+                row['latest'] = latest
+                outdated.append(row)
+                if len(outdated) >= limit:
+                    break
+        return outdated
+    def query(self, kind, term=None, arch=None, limit=100, pkgvers=None):
+        if kind not in QUERIES:
+            raise ValueError(f'unknown query {kind}, expected one of {QUERIES}')
+        with metrics.timer('repod_pkgindex_query_seconds', help='pkgindex query time', kind=kind):
+            if kind == 'outdated':
+                return self.outdated(pkgvers or dict(), arch=arch, limit=limit)
+            return getattr(self, kind)(str(term), arch=arch, limit=limit)
+    def count(self):
+        return self.__rows('SELECT COUNT(*) AS n FROM packages')[0]['n']
+
+if __name__ == '__main__':
+    import argparse
+    import json
+    from utils import configure_logger
+    from config import ARCHS
+    configure_logger(logger)
+    parser = argparse.ArgumentParser(description='Package metadata index.')
+    parser.add_argument('-i', '--index', default=None, help='index file, defaults to repo/pkgindex.sqlite')
+    parser.add_argument('-s', '--sync', action='store_true', help='index what is in www')
+    parser.add_argument('-q', '--query', nargs=2, metavar=('KIND', 'TERM'), default=None,
+                        help=f'one of {", ".join(QUERIES)}')
+    parser.add_argument('-a', '--arch', default=None, help='only this arch')
+    args = parser.parse_args()
+    root = Path(os.path.abspath(__file__)).parent / 'repo'
+    index = pkgIndex(args.index or str(root / 'pkgindex.sqlite'))
+    try:
+        if args.sync:
+            print(index.sync({arch: root / 'www' / arch for arch in ARCHS}))
+        elif args.query:
+            pkgvers = load_pkgvers(root.parent / 'pkgver.json', root.parent / PKGBUILD_DIR) \
+                      if args.query[0] == 'outdated' else None
+            print(json.dumps(index.query(args.query[0], args.query[1], arch=args.arch,
+                                         pkgvers=pkgvers), indent=4))
+        else:
+            parser.error('Please choose an action')
+    except Exception:
+        print_exc_plus()
+        parser.exit(status=1)
@@ -9,6 +9,8 @@
     # /updates/                        -- new packages goes in here
     # /recycled/                       -- litter bin
     # /archive/                        -- archive dir, old packages goes in here
+    # /objects/                        -- package store, see store.py
+    # /snapshots/                      -- www/<arch> point here, see snapshots.py
     # /www/                            -- http server root
     # /www/archive => /archive         -- archive dir for users
     # /www/aarch64                     -- packages for "aarch64"
@@ -18,15 +20,25 @@
     # /www/robots.txt => /r_r_n/r.txt  -- robots.txt
 
 import os
+import fcntl
+import multiprocessing
+import errno
 from pathlib import Path
 from shutil import copyfile as __copy_file
 import logging
 from utils import bash, Pkg, get_pkg_details_from_name, \
-                  print_exc_plus, configure_logger
+                  print_exc_plus, configure_logger, pool_map
 from time import time
+from functools import partial
+import metrics
+from store import objectStore
+from snapshots import snapshotManager
+from journal import changeJournal
+from pkgindex import pkgIndex
 
 from config import REPO_NAME, PKG_COMPRESSION, ARCHS, REPO_CMD, \
-                   REPO_REMOVE_CMD
+                   REPO_REMOVE_CMD, REGENERATE_JOBS, PUBLISH_METHODS, \
+                   RECENT_VERSIONS_KEPT
 from shared_vars import PKG_SUFFIX, PKG_SIG_SUFFIX
 
 abspath = os.path.abspath(__file__)
@@ -50,13 +62,101 @@ def copyfile(src, dst):
     dst = str(dst)
     __copy_file(src, dst, follow_symlinks=False)
 
+# linux/fs.h
+FICLONE = 0x40049409
+
+def __reflink(src, dst):
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+
+def __kernel_copy(src, dst):
+    '''
+        copy_file_range, or sendfile if the kernel refuses it
+    '''
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        size = os.fstat(fsrc.fileno()).st_size
+        (infd, outfd) = (fsrc.fileno(), fdst.fileno())
+        copied = 0
+        use_sendfile = False
+        while copied < size:
+            if not use_sendfile:
+                try:
+                    sent = os.copy_file_range(infd, outfd, size - copied)
+                except OSError as err:
+                    if err.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP):
+                        raise
+                    use_sendfile = True
+                    continue
+            else:
+                sent = os.sendfile(outfd, infd, copied, size - copied)
+            if sent == 0:
+                break
+            copied += sent
+
+__publishers = {
+    'hardlink': os.link,
+    'reflink': __reflink,
+    'kernel': __kernel_copy,
+    'userspace': copyfile,
+}
+
+def publish_file(src, dst, methods=None):
+    '''
+        put src at dst without passing its bytes through python if possible,
+        methods are tried in order, see PUBLISH_METHODS in config.py
+        dst is replaced atomically
+        returns the method used
+    '''
+    methods = methods if methods else PUBLISH_METHODS
+    if src.is_symlink():
+        methods = ['userspace']
+    tmp = dst.parent / f'.{dst.name}.publishing'
+    for method in methods:
+        if tmp.exists() or tmp.is_symlink():
+            tmp.unlink()
+        try:
+            __publishers[method](str(src), str(tmp))
+        except OSError as err:
+            logger.debug(f'publish {src} by {method} failed: {err!r}')
+            continue
+        os.replace(tmp, dst)
+        metrics.inc('repod_publish_files_total', help='files published to www', method=method)
+        return method
+    if tmp.exists():
+        tmp.unlink()
+    raise RuntimeError(f'unable to publish {src} to {dst} using {methods}')
+
 def prepare_env():
-    dirs = [Path('updates/'), Path('archive/'), Path('recycled/')] + \
+    dirs = [Path('updates/'), Path('archive/'), Path('recycled/'), Path('objects/')] + \
            [Path('www/') / arch for arch in ARCHS]
     for mydir in dirs:
         mydir.mkdir(mode=0o755, exist_ok=True, parents=True)
     symlink(Path('www/archive'), '../archive')
-prepare_env()
+    # a copy in www would not count as a reference to its blob
+    dev = os.stat('objects').st_dev
+    elsewhere = [str(mydir) for mydir in dirs if mydir.stat().st_dev != dev]
+    if elsewhere:
+        raise RuntimeError(f'{", ".join(elsewhere)} not on the filesystem of objects/, '
+                            'the package store needs hardlinks')
+# the processes of utils.pool_map only need the functions
+if multiprocessing.parent_process() is None:
+    prepare_env()
+
+# www, archive and recycled are hardlinks into the store
+store = objectStore('objects')
+# what every snapshot changed, for mirrors
+journal = changeJournal('journal.jsonl', 'manifest.json')
+# metadata of the published packages
+index = pkgIndex('pkgindex.sqlite')
+
+def __on_commit(old_dirs, new_dirs, snapshot_id):
+    try:
+        journal.record_snapshot(old_dirs, new_dirs, snapshot_id)
+    finally:
+        index.sync(new_dirs)
+
+# www/<arch> are symlinks to the current snapshot
+snapshots = snapshotManager(on_commit=__on_commit)
 
 
 def repo_add(fpaths):
@@ -66,7 +166,9 @@ def repo_add(fpaths):
         assert issubclass(type(fpath), os.PathLike) and \
                fpath.name.endswith(PKG_SUFFIX)
     dbpath = fpaths[0].parent / f'{REPO_NAME}.db.tar.gz'
-    return bash(f'{REPO_CMD} {dbpath} {" ".join([str(fpath) for fpath in fpaths])}', RUN_CMD_TIMEOUT=5*60)
+    metrics.inc('repod_repo_add_packages_total', len(fpaths), help='packages passed to repo-add')
+    with metrics.timer('repod_repo_add_seconds', help='repo-add wall time'):
+        return bash(f'{REPO_CMD} {dbpath} {" ".join([str(fpath) for fpath in fpaths])}', RUN_CMD_TIMEOUT=5*60)
 
 def repo_remove(fpaths):
     assert type(fpaths) is list
@@ -82,7 +184,8 @@ def repo_remove(fpaths):
         if sigpath.exists() or sigpath.is_symlink():
             throw_away(sigpath)
     pkgnames = [get_pkg_details_from_name(fpath.name).pkgname for fpath in fpaths]
-    return bash(f'{REPO_REMOVE_CMD} {dbpath} {" ".join(pkgnames)}', RUN_CMD_TIMEOUT=5*60)
+    with metrics.timer('repod_repo_remove_seconds', help='repo-remove wall time'):
+        return bash(f'{REPO_REMOVE_CMD} {dbpath} {" ".join(pkgnames)}', RUN_CMD_TIMEOUT=5*60)
 
 def throw_away(fpath):
     assert issubclass(type(fpath), os.PathLike)
@@ -141,38 +244,82 @@ def filter_old_pkg(fpaths, keep_new=1, archive=False, recycle=False):
     for pkg in old_pkgs:
         fullpath = fpaths[0].parent / pkg.fname
         sigpath = fpaths[0].parent / f'{pkg.fname}.sig'
+        # a symlink to an any package may be dangling already
+        sig_exists = sigpath.exists() or sigpath.is_symlink()
         if archive:
             archive_pkg(fullpath)
-            if sigpath.exists():
+            if sig_exists:
                 archive_pkg(sigpath)
         elif recycle:
             throw_away(fullpath)
-            if sigpath.exists():
+            if sig_exists:
                 throw_away(sigpath)
     return (new_pkgs, old_pkgs)
 
 
-def _clean_archive(keep_new=3):
+def purge_recycled():
+    '''
+        empty the litter bin
+        returns (files removed, bytes reclaimed)
+        a file still linked from elsewhere reclaims nothing
+    '''
+    (count, size) = (0, 0)
+    for fpath in Path('recycled').iterdir():
+        if fpath.is_dir() and not fpath.is_symlink():
+            continue
+        st = fpath.lstat()
+        fpath.unlink()
+        count += 1
+        if st.st_nlink == 1:
+            size += st.st_size
+    return (count, size)
+
+def _clean_archive(keep_new=RECENT_VERSIONS_KEPT):
+    '''
+        keep_new versions of every package in the archive,
+        empty recycled/ and drop blobs nothing links to
+    '''
     logger.info('starting clean')
     basedir = Path('archive')
     dir_list = [fpath for fpath in basedir.iterdir() if fpath.name.endswith(PKG_SUFFIX)]
     filter_old_pkg(dir_list, keep_new=keep_new, recycle=True)
-    logger.info('finished clean')
+    (files, freed) = purge_recycled()
+    (blobs, reclaimed) = store.gc()
+    metrics.inc('repod_clean_reclaimed_bytes_total', freed + reclaimed, help='bytes reclaimed by clean')
+    logger.info(f'finished clean, {files} recycled files and {blobs} blobs removed, '
+                f'{freed + reclaimed} bytes reclaimed')
     return True
 
-def _regenerate(target_archs=ARCHS, just_symlink=False):
-    if just_symlink:
-        logger.info('starting regenerate symlinks %s', target_archs)
-    else:
-        logger.info('starting regenerate %s', target_archs)
+def _store_existing():
+    '''
+        move packages published before the store existed into it,
+        identical files in www and archive are shared afterwards
+    '''
+    logger.info('starting store')
+    dirs = [Path('archive')] + [Path('www') / arch for arch in ARCHS]
+    count = 0
+    for mydir in dirs:
+        for fpath in mydir.iterdir():
+            if fpath.name.startswith('.'):
+                continue
+            nosigname = fpath.name[:-4] if fpath.name.endswith('.sig') else fpath.name
+            if nosigname.endswith(PKG_SUFFIX) and store.put(fpath):
+                count += 1
+    logger.info(f'finished store, {count} files, {store.stats()}')
+    return True
+
+def __repo_files():
     rn = REPO_NAME
     repo_files = (f"{rn}.db {rn}.db.tar.gz {rn}.db.tar.gz.old "
                   f"{rn}.files {rn}.files.tar.gz {rn}.files.tar.gz.old")
     repo_files = repo_files.split(' ')
     repo_files_essential = [fname for fname in repo_files if not fname.endswith('.old')]
     assert repo_files_essential
+    return (repo_files, repo_files_essential)
+
+def __symlink_any(target_archs, root):
     # make symlink for arch=any pkgs
-    basedir = Path('www') / 'any'
+    basedir = root / 'any'
     if basedir.exists():
         for pkgfile in basedir.iterdir():
             if pkgfile.name.endswith(PKG_SUFFIX) and \
@@ -186,56 +333,100 @@ def _regenerate(target_archs=ARCHS, just_symlink=False):
                         symlink(pkgfile.parent / '..' / arch / pkgfile.name, f'../any/{pkgfile.name}')
                         symlink(sigfile.parent / '..' / arch / sigfile.name, f'../any/{sigfile.name}')
     else:
-        logger.error(f'{arch} dir does not exist!')
-    if just_symlink:
-        return True
-    # run repo_add
+        logger.error('any dir does not exist!')
+
+def __move_misplaced(target_archs, root):
+    '''
+        move packages found in the dir of another arch to their own one,
+        before the arches are processed concurrently
+    '''
     for arch in target_archs:
-        basedir = Path('www') / arch
-        repo_files_count = list()
-        pkgs_to_add = list()
+        basedir = root / arch
         if not basedir.exists():
-            logger.error(f'{arch} dir does not exist!')
             continue
-        filter_old_pkg([f for f in basedir.iterdir() if f.name.endswith(PKG_SUFFIX)],
-                       keep_new=1, recycle=True)
-        pkgfiles = [f for f in basedir.iterdir()]
-        for pkgfile in pkgfiles:
-            if pkgfile.name in repo_files:
-                repo_files_count.append(pkgfile.name)
+        for pkgfile in [f for f in basedir.iterdir() if f.name.endswith(PKG_SUFFIX)]:
+            sigfile = Path(f"{pkgfile}.sig")
+            if not sigfile.exists():
                 continue
-            if pkgfile.name.endswith(PKG_SIG_SUFFIX):
-                if not Path(str(pkgfile)[:-4]).exists() and pkgfile.exists():
-                    logger.warning(f"{pkgfile} has no package!")
-                    throw_away(pkgfile)
-                    continue
-            elif pkgfile.name.endswith(PKG_SUFFIX):
-                sigfile = Path(f"{pkgfile}.sig")
-                if not sigfile.exists():
-                    logger.warning(f"{pkgfile} has no signature!")
-                    throw_away(pkgfile)
-                    continue
-                realarch = get_pkg_details_from_name(pkgfile.name).arch
-                if realarch != 'any' and realarch != arch:
-                    newpath = pkgfile.parent / '..' / realarch / pkgfile.name
-                    newSigpath= Path(f'{newpath}.sig')
-                    logger.info(f'Moving {pkgfile} to {newpath}, {sigfile} to {newSigpath}')
-                    assert not (newpath.exists() or newSigpath.exists())
-                    pkgfile.rename(newpath)
-                    sigfile.rename(newSigpath)
-                    pkgs_to_add.append(newpath)
-                else:
-                    pkgs_to_add.append(pkgfile)
-            else:
-                logger.warning(f"{pkgfile} is garbage!")
+            realarch = get_pkg_details_from_name(pkgfile.name).arch
+            if realarch != 'any' and realarch != arch:
+                newpath = pkgfile.parent / '..' / realarch / pkgfile.name
+                newSigpath= Path(f'{newpath}.sig')
+                logger.info(f'Moving {pkgfile} to {newpath}, {sigfile} to {newSigpath}')
+                assert not (newpath.exists() or newSigpath.exists())
+                pkgfile.rename(newpath)
+                sigfile.rename(newSigpath)
+
+def _regenerate_arch(arch, root=Path('www')):
+    '''
+        filter old packages, check signatures and run repo-add for one arch
+        runs in a pool process, see _regenerate
+    '''
+    (repo_files, repo_files_essential) = __repo_files()
+    basedir = root / arch
+    repo_files_count = list()
+    pkgs_to_add = list()
+    if not basedir.exists():
+        logger.error(f'{arch} dir does not exist!')
+        return False
+    filter_old_pkg([f for f in basedir.iterdir() if f.name.endswith(PKG_SUFFIX)],
+                   keep_new=1, recycle=True)
+    pkgfiles = [f for f in basedir.iterdir()]
+    for pkgfile in pkgfiles:
+        if pkgfile.name in repo_files:
+            repo_files_count.append(pkgfile.name)
+            continue
+        if pkgfile.name.endswith(PKG_SIG_SUFFIX):
+            if not Path(str(pkgfile)[:-4]).exists() and (pkgfile.exists() or pkgfile.is_symlink()):
+                logger.warning(f"{pkgfile} has no package!")
                 throw_away(pkgfile)
-        if pkgs_to_add:
-            logger.info("repo-add: %s", repo_add(pkgs_to_add))
+                continue
+        elif pkgfile.name.endswith(PKG_SUFFIX):
+            sigfile = Path(f"{pkgfile}.sig")
+            if not sigfile.exists():
+                logger.warning(f"{pkgfile} has no signature!")
+                throw_away(pkgfile)
+                continue
+            pkgs_to_add.append(pkgfile)
         else:
-            logger.warning('repo-add: Nothing to do in %s', arch)
-        for rfile in repo_files_essential:
-            if rfile not in repo_files_count:
-                logger.error(f'{rfile} does not exist in {arch}!')
+            logger.warning(f"{pkgfile} is garbage!")
+            throw_away(pkgfile)
+    if pkgs_to_add:
+        logger.info("repo-add: %s", repo_add(pkgs_to_add))
+    else:
+        logger.warning('repo-add: Nothing to do in %s', arch)
+    for rfile in repo_files_essential:
+        if rfile not in repo_files_count:
+            logger.error(f'{rfile} does not exist in {arch}!')
+    return True
+
+def _regenerate(target_archs=ARCHS, just_symlink=False, jobs=REGENERATE_JOBS, root=None):
+    '''
+        the symlinks of arch=any packages are made first,
+        then up to jobs arches are regenerated concurrently
+        root: a snapshot being staged, a new one is made if None
+    '''
+    if root is None:
+        with snapshots.transaction() as root:
+            return _regenerate(target_archs=target_archs, just_symlink=just_symlink,
+                               jobs=jobs, root=root)
+    if just_symlink:
+        logger.info('starting regenerate symlinks %s', target_archs)
+    else:
+        logger.info('starting regenerate %s', target_archs)
+    __symlink_any(target_archs, root)
+    if just_symlink:
+        return True
+    __move_misplaced(target_archs, root)
+    failed = list()
+    with metrics.timer('repod_regenerate_seconds', help='regenerate wall time'):
+        for (arch, _, error) in pool_map(partial(_regenerate_arch, root=root),
+                                         list(target_archs), jobs=jobs):
+            if error:
+                logger.error(f'regenerate {arch} failed\n{error}')
+                failed.append(arch)
+    if failed:
+        raise RuntimeError(f'regenerate failed for {failed}')
     logger.info('finished regenerate')
     return True
 
@@ -246,48 +437,56 @@ def _update(overwrite=False):
     pkgs_to_add = dict()
     filter_old_pkg([f for f in update_path.iterdir() if f.name.endswith(PKG_SUFFIX)],
                    keep_new=1, archive=True)
-    for pkg_to_add in update_path.iterdir():
-        if pkg_to_add.is_dir():
-            continue
-        else:
-            if pkg_to_add.name.endswith(PKG_SUFFIX):
-                sigfile = Path(f"{pkg_to_add}.sig")
-                if sigfile.exists():
-                    arch = get_pkg_details_from_name(pkg_to_add.name).arch
-                    pkg_nlocation = pkg_to_add.parent / '..' / 'www' / arch / pkg_to_add.name
-                    sig_nlocation = Path(f'{pkg_nlocation}.sig')
-                    logger.info(f'Copying {pkg_to_add} to {pkg_nlocation}, {sigfile} to {sig_nlocation}')
-                    if overwrite:
-                        for nlocation in (pkg_nlocation, sig_nlocation):
-                            if nlocation.exists():
-                                logger.warning(f'Overwriting {nlocation}')
-                    else:
-                        should_continue = False
-                        for nlocation in (pkg_nlocation, sig_nlocation):
-                            if nlocation.exists():
-                                logger.warning('Same version is already in the repo.')
-                                throw_away(pkg_to_add)
-                                should_continue = True
-                                break
-                        if should_continue:
-                            continue
-                    copyfile(pkg_to_add, pkg_nlocation)
-                    copyfile(sigfile, sig_nlocation)
-                    archive_pkg(pkg_to_add)
-                    archive_pkg(sigfile)
-                    if arch == 'any':
-                        for arch in ARCHS:
-                            pkg_nlocation = pkg_to_add.parent / '..' / 'www' / arch / pkg_to_add.name
+    published = list()
+    # updates are archived only once the new snapshot is out
+    with snapshots.transaction() as www:
+        for pkg_to_add in update_path.iterdir():
+            if pkg_to_add.is_dir():
+                continue
+            else:
+                if pkg_to_add.name.endswith(PKG_SUFFIX):
+                    sigfile = Path(f"{pkg_to_add}.sig")
+                    if sigfile.exists():
+                        arch = get_pkg_details_from_name(pkg_to_add.name).arch
+                        pkg_nlocation = www / arch / pkg_to_add.name
+                        sig_nlocation = Path(f'{pkg_nlocation}.sig')
+                        logger.info(f'Publishing {pkg_to_add} to {pkg_nlocation}, {sigfile} to {sig_nlocation}')
+                        if overwrite:
+                            for nlocation in (pkg_nlocation, sig_nlocation):
+                                if nlocation.exists():
+                                    logger.warning(f'Overwriting {nlocation}')
+                        else:
+                            should_continue = False
+                            for nlocation in (pkg_nlocation, sig_nlocation):
+                                if nlocation.exists():
+                                    logger.warning('Same version is already in the repo.')
+                                    throw_away(pkg_to_add)
+                                    should_continue = True
+                                    break
+                            if should_continue:
+                                continue
+                        store.put(pkg_to_add)
+                        store.put(sigfile)
+                        for (src, nlocation) in ((pkg_to_add, pkg_nlocation), (sigfile, sig_nlocation)):
+                            if publish_file(src, nlocation) != 'hardlink':
+                                # link the copy to its blob, or the blob looks unreferenced
+                                store.put(nlocation)
+                        published += [pkg_to_add, sigfile]
+                        if arch == 'any':
+                            for arch in ARCHS:
+                                pkg_nlocation = www / arch / pkg_to_add.name
+                                pkgs_to_add.setdefault(arch, list()).append(pkg_nlocation)
+                        else:
                             pkgs_to_add.setdefault(arch, list()).append(pkg_nlocation)
                     else:
-                        pkgs_to_add.setdefault(arch, list()).append(pkg_nlocation)
-                else:
-                    logger.warning(f'{pkg_to_add} has no signature!')
-                    throw_away(pkg_to_add)
-    if 'any' in pkgs_to_add:
-        _regenerate(target_archs=ARCHS, just_symlink=True)
-    for arch in pkgs_to_add:
-        logger.info("repo-add: %s", repo_add(pkgs_to_add[arch]))
+                        logger.warning(f'{pkg_to_add} has no signature!')
+                        throw_away(pkg_to_add)
+        if 'any' in pkgs_to_add:
+            _regenerate(target_archs=ARCHS, just_symlink=True, root=www)
+        for arch in pkgs_to_add:
+            logger.info("repo-add: %s", repo_add(pkgs_to_add[arch]))
+    for fpath in published:
+        archive_pkg(fpath)
     # remove add other things
     for other in update_path.iterdir():
         if other.is_dir():
@@ -306,17 +505,18 @@ def _remove(pkgnames, target_archs=[a for a in ARCHS if a != 'any']):
         target_archs = ARCHS
     else:
         assert 'any' not in target_archs
-    for arch in target_archs:
-        remove_pkgs = list()
-        basedir = Path('www') / arch
-        for fpath in basedir.iterdir():
-            if fpath.name.endswith(PKG_SUFFIX) and \
-                get_pkg_details_from_name(fpath.name).pkgname in pkgnames:
-                remove_pkgs.append(fpath)
-        if remove_pkgs:
-            logger.info("repo-remove: %s", repo_remove(remove_pkgs))
-        else:
-            logger.warning(f'Nothing to remove in {arch}')
+    with snapshots.transaction() as www:
+        for arch in target_archs:
+            remove_pkgs = list()
+            basedir = www / arch
+            for fpath in basedir.iterdir():
+                if fpath.name.endswith(PKG_SUFFIX) and \
+                    get_pkg_details_from_name(fpath.name).pkgname in pkgnames:
+                    remove_pkgs.append(fpath)
+            if remove_pkgs:
+                logger.info("repo-remove: %s", repo_remove(remove_pkgs))
+            else:
+                logger.warning(f'Nothing to remove in {arch}')
     archive_dir = Path('archive')
     for fpath in archive_dir.iterdir():
         nosigname = fpath.name[:-4] if fpath.name.endswith('.sig') else fpath.name
@@ -336,7 +536,11 @@ if __name__ == '__main__':
         parser.add_argument('-u', '--update', action='store_true', help='get updates from updates dir, push them to the repo')
         parser.add_argument('-r', '--regenerate', action='store_true', help='regenerate the whole package database')
         parser.add_argument('-R', '--remove', nargs='?', default=False, help='remove comma split packages from the database')
-        parser.add_argument('-c', '--clean', action='store_true', help='clean archive, keep 3 recent versions')
+        parser.add_argument('-c', '--clean', action='store_true', help=f'clean archive, keep {RECENT_VERSIONS_KEPT} recent versions, empty recycled')
+        parser.add_argument('-s', '--store', action='store_true', help='move packages into the object store')
+        parser.add_argument('-S', '--snapshots', action='store_true', help='list snapshots')
+        parser.add_argument('-b', '--rollback', nargs='?', type=int, default=False, const=None, help='point www at a snapshot, defaults to the previous one')
+        parser.add_argument('-j', '--jobs', type=int, default=REGENERATE_JOBS, help=f'arches to regenerate at once, defaults to {REGENERATE_JOBS}')
         args = parser.parse_args()
         arch = args.arch
         arch = arch.split(',') if arch is not False else None
@@ -348,11 +552,18 @@ if __name__ == '__main__':
             _update(overwrite=args.overwrite)
         elif args.regenerate:
             if arch:
-                _regenerate(target_archs=arch)
+                _regenerate(target_archs=arch, jobs=args.jobs)
             else:
-                _regenerate()
+                _regenerate(jobs=args.jobs)
         elif args.clean:
-            _clean_archive(keep_new=3)
+            _clean_archive()
+        elif args.store:
+            _store_existing()
+        elif args.snapshots:
+            print(snapshots.status())
+        elif args.rollback is not False:
+            if snapshots.rollback(args.rollback) is False:
+                parser.exit(status=1)
         elif remove_pkgs:
             if arch:
                 _remove(remove_pkgs, target_archs=arch)
@@ -7,11 +7,12 @@ import logging
 from multiprocessing.connection import Listener
 from time import time, sleep
 from pathlib import Path
-from subprocess import CalledProcessError
+from threading import Lock
 import os
 
 from config import REPOD_BIND_ADDRESS, REPOD_BIND_PASSWD, REPO_PUSH_BANDWIDTH, \
-                   GPG_VERIFY_CMD
+                   REPOD_METRICS_ADDRESS, REPOD_TRACE_LOGFILE, HTTPD_BIND_ADDRESS, \
+                   RPC_BACKLOG
 
 from shared_vars import PKG_SUFFIX, PKG_SIG_SUFFIX
 
@@ -20,16 +21,24 @@ from shared_vars import PKG_SUFFIX, PKG_SIG_SUFFIX
 from repo import _clean_archive as clean, \
                  _regenerate as regenerate, \
                  _remove as remove, \
-                 _update as update
+                 _update as update, \
+                 snapshots as __snapshots, \
+                 journal as __journal, \
+                 index as __index
 
-from utils import bash, configure_logger, print_exc_plus
+from utils import bash, configure_logger, print_exc_plus, gpg_verify
+from collector import garbageCollector
+from pkgindex import load_pkgvers
+
+import metrics
+import tracing
+import wire
 
 abspath=os.path.abspath(__file__)
 abspath=os.path.dirname(abspath)
 os.chdir(abspath)
 
 logger = logging.getLogger('buildbot')
-configure_logger(logger, logfile='repod.log', rotate_size=1024*1024*10, enable_notify=True)
 
 class pushFm:
     def __init__(self):
@@ -110,6 +119,7 @@ class pushFm:
         if sorted(filter_sig(fnames)) == sorted(filter_sig(self.fnames)):
             try:
                 update_path = Path('updates')
+                to_verify = list()
                 for pkgfname in filter_sig(fnames):
                     pkg_found = False
                     sig_found = False
@@ -121,30 +131,24 @@ class pushFm:
                         elif fpath.name == f'{pkgfname}.sig':
                             sig_found = fpath
                     if pkg_found and sig_found:
-                        try:
-                            bash(f'{GPG_VERIFY_CMD} {sig_found} {pkg_found}')
-                        except CalledProcessError:
-                            ret = f'{pkg_found} GPG verify error'
-                            logger.error(ret)
-                            print_exc_plus()
-                            return ret
-                        else:
-                            # gpg verify success
-                            continue
+                        to_verify.append((sig_found, pkg_found))
                     else:
                         return f'file missing: pkg {pkg_found} sig {sig_found}'
-                    raise RuntimeError("unexpected error")
-                else:
-                    # gpg verified for all
-                    try:
-                        if update(overwrite=overwrite):
-                            return None
-                        else:
-                            raise RuntimeError('update return false')
-                    except Exception:
-                        print_exc_plus()
-                        return f'{pkg_found} update error'
-                    raise RuntimeError("unexpected error")
+                with tracing.span('gpg_verify', files=len(to_verify)):
+                    failed = gpg_verify(to_verify)
+                if failed:
+                    return f'{" ".join([str(f) for f in failed])} GPG verify error'
+                # gpg verified for all
+                try:
+                    with tracing.span('repo.update'):
+                        updated = update(overwrite=overwrite)
+                    if updated:
+                        return None
+                    else:
+                        raise RuntimeError('update return false')
+                except Exception:
+                    print_exc_plus()
+                    return f'{pkg_found} update error'
             finally:
                 self.__init__()
         else:
@@ -167,32 +171,90 @@ def push_fail(filename):
 def push_add_time(filename, atime):
     return pfm.add_time(filename, atime)
 
+# held by rpc calls changing the repo and by the gc between batches
+repo_lock = Lock()
+collector = garbageCollector(lock=repo_lock, busy=pfm.is_busy)
+
+def gc():
+    collector.trigger()
+    return None
+
+def gc_status():
+    return collector.status()
+
+def rollback(snapshot_id=None):
+    return __snapshots.rollback(snapshot_id)
+
+def snapshots():
+    return __snapshots.status()
+
+def changes(since=0, limit=None):
+    return __journal.changes(since=since, limit=limit)
+
+def manifest():
+    return __journal.manifest()
+
+def query(kind, term=None, arch=None, limit=100):
+    '''
+        see pkgindex.py, outdated compares with the pkgver.json of buildbot.py
+    '''
+    pkgvers = load_pkgvers(Path(abspath) / 'pkgver.json') if kind == 'outdated' else None
+    return __index.query(kind, term=term, arch=arch, limit=limit, pkgvers=pkgvers)
+
 # server part
 
 def run(funcname, args=list(), kwargs=dict()):
     if funcname in ('clean', 'regenerate', 'remove',
                     'update', 'push_start', 'push_done',
-                    'push_fail', 'push_add_time'):
+                    'push_fail', 'push_add_time', 'gc', 'gc_status',
+                    'rollback', 'snapshots', 'changes', 'manifest', 'query'):
         logger.info('running: %s %s %s', funcname, args, kwargs)
-        ret = eval(funcname)(*args, **kwargs)
+        try:
+            with metrics.timer('repod_rpc_seconds', help='rpc latency', func=funcname):
+                if funcname in ('clean', 'regenerate', 'remove', 'update', 'push_done', 'rollback'):
+                    with repo_lock:
+                        ret = eval(funcname)(*args, **kwargs)
+                else:
+                    ret = eval(funcname)(*args, **kwargs)
+        except Exception:
+            metrics.inc('repod_rpc_errors_total', help='rpc calls raising an exception', func=funcname)
+            raise
         logger.info('done: %s %s',funcname, ret)
         return ret
     else:
+        metrics.inc('repod_rpc_errors_total', help='rpc calls raising an exception', func='unexpected')
         logger.error('unexpected: %s %s %s',funcname, args, kwargs)
         return False
 
 if __name__ == '__main__':
+    # not at import, the regenerate pool imports this module again
+    # in every process it spawns, see utils.pool_map
+    configure_logger(logger, logfile='repod.log', rotate_size=1024*1024*10, enable_notify=True,
+                     background=True)
     logger.info('Buildbot.repod started.')
+    tracing.configure(REPOD_TRACE_LOGFILE)
+    if REPOD_METRICS_ADDRESS:
+        metrics.serve(REPOD_METRICS_ADDRESS)
+        metrics.register_callback('repod_push_busy', lambda: int(pfm.is_busy()),
+                                  help='1 while an upload is in progress')
+    collector.start()
+    if HTTPD_BIND_ADDRESS:
+        import httpd
+        httpd.serve(HTTPD_BIND_ADDRESS)
     while True:
         try:
-            with Listener(REPOD_BIND_ADDRESS, authkey=REPOD_BIND_PASSWD) as listener:
+            with Listener(REPOD_BIND_ADDRESS, authkey=REPOD_BIND_PASSWD, backlog=RPC_BACKLOG) as listener:
                 with listener.accept() as conn:
                     logger.debug('connection accepted from %s', listener.last_accepted)
-                    myrecv = conn.recv()
-                    if type(myrecv) is list and len(myrecv) == 3:
-                        (funcname, args, kwargs) = myrecv
+                    myrecv = wire.recv(conn)
+                    if type(myrecv) is list and len(myrecv) in (3, 4):
+                        (funcname, args, kwargs) = myrecv[:3]
                         funcname = str(funcname)
-                        conn.send(run(funcname, args=args, kwargs=kwargs))
+                        ctx = myrecv[3] if len(myrecv) == 4 and type(myrecv[3]) is dict else dict()
+                        with tracing.trace(ctx.get('trace_id', None), ctx.get('parent_id', None)), \
+                             tracing.span(f'rpc.{funcname}'):
+                            ret = run(funcname, args=args, kwargs=kwargs)
+                        wire.send(conn, ret)
         except Exception:
             print_exc_plus()
         except KeyboardInterrupt:
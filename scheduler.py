@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# scheduler.py: Automatic management tool for an arch repo.
+# This file is part of Buildbot by JerryXiao
+
+# build jobs for remote workers (worker.py)
+# every worker has a queue of assigned jobs, a new job goes to the least
+# loaded worker able to build its arch. a worker with nothing left in its
+# queue steals from the tail of the longest queue of another worker.
+# workers missing heartbeats for WORKER_TIMEOUT secs are dropped and
+# their jobs are assigned again, jobs no worker can take go back to
+# the master (take_orphans). a late result of a job assigned again is
+# accepted and withdraws the other copy.
+
+import logging
+from collections import deque
+from threading import Lock
+from time import time
+
+from config import WORKER_TIMEOUT, WORKER_MAX_ATTEMPTS, WORKER_HEARTBEAT
+
+import metrics
+
+logger = logging.getLogger(f'buildbot.{__name__}')
+
+class workerState:
+    def __init__(self, worker_id, arches, capacity):
+        assert type(capacity) is int and capacity >= 1
+        self.worker_id = worker_id
+        self.arches = list(arches)
+        self.capacity = capacity
+        self.queue = deque()
+        # job_id => (job, time pulled)
+        self.running = dict()
+        self.last_seen = time()
+        self.done = 0
+        self.failed = 0
+    def __repr__(self):
+        return (f'workerState({self.worker_id}, arches={self.arches}, capacity={self.capacity}, '
+                f'queued={len(self.queue)}, running={len(self.running)})')
+    def load(self):
+        return (len(self.queue) + len(self.running)) / self.capacity
+
+class workerScheduler:
+    def __init__(self, timeout=WORKER_TIMEOUT, max_attempts=WORKER_MAX_ATTEMPTS,
+                 heartbeat=WORKER_HEARTBEAT):
+        self.__timeout = timeout
+        self.__max_attempts = max_attempts
+        self.__heartbeat = heartbeat
+        self.__workers = dict()
+        self.__orphans = list()
+        self.__lock = Lock()
+        # job_id => (job, worker_id, success, message)
+        self.results = deque(maxlen=200)
+    def __repr__(self):
+        return f'workerScheduler({list(self.__workers.values())})'
+    @property
+    def workers(self):
+        return list(self.__workers.values())
+    def __place(self, job, exclude=None):
+        '''
+            must be called with self.__lock held
+            returns False if no worker can build job.arch
+        '''
+        workers = [w for w in self.__workers.values()
+                   if job.arch in w.arches and w.worker_id != exclude]
+        if not workers:
+            return False
+        worker = min(workers, key=lambda w: w.load())
+        worker.queue.append(job)
+        logger.info(f'job {job.job_id} {job.pkgconfig.dirname} {job.arch} queued on {worker.worker_id}')
+        return True
+    def __requeue(self, job, exclude=None, lost=False):
+        '''
+            must be called with self.__lock held
+        '''
+        if lost:
+            job.attempts += 1
+            metrics.inc('buildbot_worker_jobs_lost_total', help='jobs lost with a worker')
+            if job.attempts >= self.__max_attempts:
+                logger.error(f'job {job} lost {job.attempts} times, giving up')
+                self.results.append((job.job_id, None, False, 'lost too many times'))
+                return
+        if not self.__place(job, exclude=exclude):
+            logger.warning(f'no worker for {job.pkgconfig.dirname} {job.arch}, returning it to the master')
+            self.__orphans.append(job)
+    def register(self, worker_id, arches, capacity=1):
+        '''
+            a worker registering again loses its previous jobs to others
+            returns the heartbeat interval
+        '''
+        with self.__lock:
+            old = self.__workers.pop(worker_id, None)
+            self.__workers[worker_id] = workerState(worker_id, arches, capacity)
+            if old:
+                logger.warning(f'worker {worker_id} registered again, reassigning its jobs')
+                for (job, _) in old.running.values():
+                    self.__requeue(job, lost=True)
+                for job in old.queue:
+                    self.__requeue(job)
+        logger.info(f'worker {worker_id} registered, arches {arches}, capacity {capacity}')
+        return self.__heartbeat
+    def unregister(self, worker_id):
+        with self.__lock:
+            worker = self.__workers.pop(worker_id, None)
+            if worker is None:
+                return False
+            for (job, _) in worker.running.values():
+                self.__requeue(job, lost=True)
+            for job in worker.queue:
+                self.__requeue(job)
+        logger.info(f'worker {worker_id} unregistered')
+        return True
+    def heartbeat(self, worker_id, running=()):
+        '''
+            running: job ids the worker is building
+            returns False if the worker should register again
+        '''
+        with self.__lock:
+            worker = self.__workers.get(worker_id, None)
+            if worker is None:
+                return False
+            worker.last_seen = time()
+            # jobs handed out a while ago that the worker does not know about
+            running = set(running)
+            for (job_id, (job, pulled)) in list(worker.running.items()):
+                if job_id not in running and worker.last_seen - pulled > 2 * self.__heartbeat:
+                    logger.warning(f'worker {worker_id} lost job {job_id}')
+                    del worker.running[job_id]
+                    self.__requeue(job, lost=True)
+        return True
+    def can_build(self, arch):
+        with self.__lock:
+            return bool([w for w in self.__workers.values() if arch in w.arches])
+    def submit(self, job):
+        '''
+            replaces queued jobs of the same package and arch
+            returns False if no worker can build job.arch
+        '''
+        with self.__lock:
+            for worker in self.__workers.values():
+                for oldjob in [j for j in worker.queue if j.arch == job.arch and
+                               j.pkgconfig.dirname == job.pkgconfig.dirname]:
+                    worker.queue.remove(oldjob)
+                    logger.info('removed an old remote job for %s %s, %s => %s',
+                                job.pkgconfig.dirname, job.arch, oldjob.version, job.version)
+            return self.__place(job)
+    def __steal(self, thief):
+        '''
+            must be called with self.__lock held
+        '''
+        victims = sorted([w for w in self.__workers.values() if w is not thief and w.queue],
+                         key=lambda w: len(w.queue), reverse=True)
+        for victim in victims:
+            for job in reversed(victim.queue):
+                if job.arch in thief.arches:
+                    victim.queue.remove(job)
+                    metrics.inc('buildbot_worker_jobs_stolen_total', help='jobs stolen by idle workers')
+                    logger.info(f'worker {thief.worker_id} stole job {job.job_id} from {victim.worker_id}')
+                    return job
+        return None
+    def pull(self, worker_id, slots=1):
+        '''
+            returns up to slots jobs for the worker to run
+        '''
+        jobs = list()
+        with self.__lock:
+            worker = self.__workers.get(worker_id, None)
+            if worker is None:
+                return None
+            worker.last_seen = time()
+            while len(jobs) < slots:
+                job = worker.queue.popleft() if worker.queue else self.__steal(worker)
+                if job is None:
+                    break
+                worker.running[job.job_id] = (job, time())
+                jobs.append(job)
+        for job in jobs:
+            logger.info(f'worker {worker_id} runs job {job.job_id} {job.pkgconfig.dirname} {job.arch}')
+        return jobs
+    def __withdraw(self, job_id):
+        '''
+            must be called with self.__lock held
+            remove a job assigned again, wherever it is now
+        '''
+        for worker in self.__workers.values():
+            for job in worker.queue:
+                if job.job_id == job_id:
+                    worker.queue.remove(job)
+                    return job
+            if job_id in worker.running:
+                # built twice, the result of this copy is not expected
+                return worker.running.pop(job_id)[0]
+        for job in self.__orphans:
+            if job.job_id == job_id:
+                self.__orphans.remove(job)
+                return job
+        return None
+    def done(self, worker_id, job_id, success, message=None):
+        '''
+            a late result, of a job assigned again after its worker was
+            dropped, is accepted and the other copy withdrawn
+        '''
+        with self.__lock:
+            worker = self.__workers.get(worker_id, None)
+            if worker is not None and job_id in worker.running:
+                (job, _) = worker.running.pop(job_id)
+            else:
+                job = self.__withdraw(job_id)
+                if job is None:
+                    logger.warning(f'unexpected result of job {job_id} from {worker_id}')
+                    return False
+                logger.warning(f'late result of job {job_id} from {worker_id}, withdrawing its other copy')
+                metrics.inc('buildbot_worker_late_results_total', help='results of jobs assigned again')
+            if worker is not None:
+                if success:
+                    worker.done += 1
+                else:
+                    worker.failed += 1
+            self.results.append((job_id, worker_id, bool(success), message))
+        metrics.inc('buildbot_worker_jobs_total', help='jobs finished by workers',
+                    worker=worker_id, result='success' if success else 'failure')
+        if success:
+            logger.info(f'job {job} done on {worker_id}')
+        else:
+            logger.error(f'job {job} failed on {worker_id}: {message}. Correct the error and rebuild')
+        return True
+    def reap(self):
+        '''
+            drop workers missing heartbeats and reassign their jobs
+        '''
+        now = time()
+        with self.__lock:
+            dead = [w for w in self.__workers.values() if now - w.last_seen > self.__timeout]
+            for worker in dead:
+                logger.error(f'worker {worker.worker_id} timed out, reassigning its jobs')
+                metrics.inc('buildbot_worker_timeouts_total', help='workers missing heartbeats')
+                del self.__workers[worker.worker_id]
+            for worker in dead:
+                for (job, _) in worker.running.values():
+                    self.__requeue(job, lost=True)
+                for job in worker.queue:
+                    self.__requeue(job)
+        return [w.worker_id for w in dead]
+    def take_orphans(self):
+        '''
+            jobs no worker can take, the master builds them
+        '''
+        with self.__lock:
+            (orphans, self.__orphans) = (self.__orphans, list())
+        return orphans
+    def status(self):
+        with self.__lock:
+            return {w.worker_id: {'arches': w.arches, 'capacity': w.capacity,
+                                  'queued': [j.job_id for j in w.queue],
+                                  'running': [j.job_id for (j, _) in w.running.values()],
+                                  'done': w.done, 'failed': w.failed,
+                                  'last_seen': w.last_seen}
+                    for w in self.__workers.values()}
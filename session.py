@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# session.py: Automatic management tool for an arch repo.
+# This file is part of Buildbot by JerryXiao
+
+# long-lived shells in the build containers
+# every command is sent to the shell as
+#   __bb_cmd=$(base64 -d <<'MARKER_SEQ_IN'
+#   <'cd ...; cmdline' in base64, 76 chars a line>
+#   MARKER_SEQ_IN
+#   )
+#   ( timeout T /bin/bash -x -e -c "$__bb_cmd" ) </dev/null 2>&1; echo "MARKER_SEQ $?"
+# and its output is read until the marker line, which carries the exit code
+# commands needing input get  < <(yes '')  instead of /dev/null
+# machinectl shells run on a pty: on start echo, line editing and the
+# prompts are turned off, and base64 keeps the lines short and free of
+# anything the tty would interpret
+
+import logging
+import subprocess
+import re
+import shlex
+import base64
+from queue import Queue, Empty
+from threading import Thread, Lock
+from time import time
+from uuid import uuid4
+
+logger = logging.getLogger(f'buildbot.{__name__}')
+
+class SessionError(Exception):
+    '''
+        the session cannot be used, the command was not sent
+    '''
+    pass
+
+class shellSession:
+    def __init__(self, cmd, start_timeout=60):
+        assert type(cmd) is list
+        self.__cmd = cmd
+        self.__start_timeout = start_timeout
+        self.__proc = None
+        self.__lines = None
+        self.__nonce = uuid4().hex
+        self.__seq = 0
+        self.lock = Lock()
+        self.commands = 0
+    def __repr__(self):
+        return f'shellSession({self.__cmd}, alive={self.alive()}, commands={self.commands})'
+    def alive(self):
+        return self.__proc is not None and self.__proc.poll() is None
+    def __reader(self, stdout, lines):
+        for line in stdout:
+            lines.put(line.replace('\r', ''))
+        lines.put(None)
+    def __readline(self, deadline):
+        try:
+            return self.__lines.get(timeout=max(0.0, deadline - time()))
+        except Empty:
+            raise TimeoutError
+    def start(self):
+        logger.info('starting shell session %s', self.__cmd)
+        try:
+            self.__proc = subprocess.Popen(self.__cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                           stderr=subprocess.STDOUT, encoding='utf-8',
+                                           errors='replace', bufsize=1)
+        except OSError as err:
+            raise SessionError(f'unable to start {self.__cmd}: {err}')
+        self.__lines = Queue()
+        tr = Thread(target=self.__reader, args=(self.__proc.stdout, self.__lines))
+        tr.daemon = True
+        tr.start()
+        ready = f'__BB_READY_{self.__nonce}'
+        try:
+            # the echo of this line does not end with ready, the output does
+            self.__write('stty -echo 2>/dev/null; set +o emacs +o vi; PS1=; PS2=; PROMPT_COMMAND=; '
+                         f'echo "__BB_READY_""{self.__nonce}"\n')
+            deadline = time() + self.__start_timeout
+            while True:
+                line = self.__readline(deadline)
+                if line is None:
+                    raise SessionError('shell exited on startup')
+                if line.rstrip('\n').endswith(ready):
+                    return
+        except (TimeoutError, OSError) as err:
+            self.close()
+            raise SessionError(f'shell not ready: {err!r}')
+        except SessionError:
+            self.close()
+            raise
+    def __write(self, data):
+        self.__proc.stdin.write(data)
+        self.__proc.stdin.flush()
+    def run(self, cmdline, cwd=None, timeout=60, on_line=None, keepalive=False):
+        '''
+            run cmdline in the session, must be called with self.lock held
+            keepalive feeds newlines to the command, like run_cmd does
+            returns (returncode, output)
+            raises SessionError if the command could not be sent
+        '''
+        if not self.alive():
+            self.start()
+        self.__seq += 1
+        marker = f'__BB_END_{self.__nonce}_{self.__seq}'
+        inner = f'cd {shlex.quote(str(cwd))}; {cmdline}' if cwd else cmdline
+        encoded = base64.b64encode(inner.encode('utf-8')).decode('ascii')
+        encoded = '\n'.join([encoded[i:i+76] for i in range(0, len(encoded), 76)])
+        stdin = "< <(yes '')" if keepalive else '</dev/null'
+        command = (f"__bb_cmd=$(base64 -d <<'{marker}_IN'\n{encoded}\n{marker}_IN\n)\n"
+                   f'( timeout -k 10 {int(timeout)} /bin/bash -x -e -c "$__bb_cmd" ) '
+                   f'{stdin} 2>&1; echo "{marker} $?"\n')
+        try:
+            self.__write(command)
+        except OSError as err:
+            self.close()
+            raise SessionError(f'unable to write to shell: {err!r}')
+        self.commands += 1
+        output = list()
+        end = re.compile(rf'^{marker} (\d+)$')
+        # leave time for timeout(1) to kill the command
+        deadline = time() + timeout + 30
+        while True:
+            try:
+                line = self.__readline(deadline)
+            except TimeoutError:
+                self.close()
+                output.append('+ Buildbot: session timeout expired, session closed.\n')
+                return (124, ''.join(output))
+            if line is None:
+                self.close()
+                output.append('+ Buildbot: session exited unexpectedly.\n')
+                return (-1, ''.join(output))
+            m = end.match(line.rstrip('\n'))
+            if m:
+                return (int(m.group(1)), ''.join(output))
+            if marker in line:
+                # the tty echoing our command back
+                continue
+            output.append(line)
+            if on_line:
+                on_line(line)
+    def close(self):
+        if self.__proc is None:
+            return
+        proc = self.__proc
+        self.__proc = None
+        try:
+            proc.stdin.close()
+        except Exception:
+            pass
+        try:
+            proc.terminate()
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+        except Exception:
+            pass
+
+class sessionManager:
+    '''
+        one shell session per arch, a busy session is never waited for
+    '''
+    def __init__(self, commands, retry_after=10*60):
+        assert type(commands) is dict
+        self.__commands = commands
+        self.__sessions = dict()
+        self.__lock = Lock()
+        self.__retry_after = retry_after
+        # arch => time of the last failed start
+        self.__failed = dict()
+    def run(self, arch, cmdline, cwd=None, timeout=60, on_line=None, keepalive=False):
+        '''
+            returns (returncode, output)
+            raises SessionError when the caller should fall back to a one-shot shell
+        '''
+        with self.__lock:
+            if time() - self.__failed.get(arch, 0) < self.__retry_after:
+                raise SessionError(f'session for {arch} failed recently')
+            session = self.__sessions.get(arch, None)
+            if session is None:
+                cmd = self.__commands.get(arch, None)
+                if not cmd:
+                    raise SessionError(f'no session command for {arch}')
+                session = self.__sessions[arch] = shellSession(cmd)
+        if not session.lock.acquire(blocking=False):
+            raise SessionError(f'session for {arch} is busy')
+        try:
+            if not session.alive():
+                try:
+                    session.start()
+                except SessionError:
+                    self.__failed[arch] = time()
+                    raise
+            return session.run(cmdline, cwd=cwd, timeout=timeout, on_line=on_line,
+                               keepalive=keepalive)
+        finally:
+            session.lock.release()
+    def close(self):
+        with self.__lock:
+            for session in self.__sessions.values():
+                session.close()
+            self.__sessions = dict()
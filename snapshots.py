@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# snapshots.py: Automatic management tool for an arch repo.
+# This file is part of Buildbot by JerryXiao
+
+# atomic snapshots of www
+# www/<arch> => .current/<arch>, www/.current => ../snapshots/<id>
+# a change to the repo is staged in snapshots/<id>.staging: the database
+# files are copied, packages and signatures are hardlinked and symlinks
+# (arch=any packages) are recreated. when everything went well the
+# staging dir is renamed to snapshots/<id> and www/.current is replaced
+# (rename(2)), so every arch switches at once, otherwise it is simply
+# removed. the last SNAPSHOTS_KEPT snapshots are kept, rolling back is
+# pointing www/.current at an older one. on_commit(old dirs, new dirs, id)
+# is called after a snapshot is published, see journal.py, which is why
+# it cannot be used with keep=0.
+
+import os
+import logging
+from contextlib import contextmanager
+from pathlib import Path
+from shutil import copyfile, rmtree
+
+from config import ARCHS, REPO_NAME, SNAPSHOTS_KEPT
+from utils import print_exc_plus
+
+import metrics
+
+logger = logging.getLogger(f'buildbot.{__name__}')
+
+STAGING_SUFFIX = '.staging'
+CURRENT = '.current'
+
+def is_db_file(fname):
+    return fname.startswith(f'{REPO_NAME}.db') or fname.startswith(f'{REPO_NAME}.files')
+
+class snapshotManager:
+    def __init__(self, www='www', root='snapshots', archs=ARCHS, keep=SNAPSHOTS_KEPT,
+                 on_commit=None):
+        '''
+            keep: snapshots kept, 0 disables snapshots and www is changed in place
+            on_commit needs snapshots, keep=0 is refused with it
+        '''
+        if on_commit and not keep:
+            raise ValueError('on_commit needs snapshots, keep must be at least 1')
+        self.www = Path(www)
+        self.root = Path(root)
+        self.archs = list(archs)
+        self.keep = keep
+        self.on_commit = on_commit
+    def __repr__(self):
+        return f'snapshotManager({self.www} => {self.root}, keep={self.keep})'
+    @property
+    def enabled(self):
+        return bool(self.keep)
+    def current(self):
+        '''
+            the snapshot id www points at, None for plain dirs
+        '''
+        link = self.www / CURRENT
+        if link.is_symlink():
+            return int(Path(os.readlink(link)).name)
+        # before www/.current, every www/<arch> pointed at its snapshot
+        ids = [int(Path(os.readlink(self.www / arch)).parent.name) for arch in self.archs
+               if (self.www / arch).is_symlink()]
+        return max(ids) if ids else None
+    def snapshots(self):
+        if not self.root.exists():
+            return list()
+        return sorted([int(d.name) for d in self.root.iterdir() if d.name.isdigit()])
+    def __new_id(self):
+        ids = self.snapshots()
+        staging = [int(d.name[:-len(STAGING_SUFFIX)]) for d in self.root.iterdir()
+                   if d.name.endswith(STAGING_SUFFIX)] if self.root.exists() else list()
+        return max(ids + staging + [0]) + 1
+    def __replace_link(self, link, target):
+        tmp = link.parent / f'.{link.name.lstrip(".")}.swap'
+        if tmp.is_symlink():
+            tmp.unlink()
+        tmp.symlink_to(target)
+        os.replace(tmp, link)
+    def __swap(self, snapshot_id):
+        self.__replace_link(self.www / CURRENT, f'../{self.root.name}/{snapshot_id}')
+        for arch in self.archs:
+            link = self.www / arch
+            if not (link.is_symlink() and os.readlink(link) == f'{CURRENT}/{arch}'):
+                self.__replace_link(link, f'{CURRENT}/{arch}')
+    def init(self):
+        '''
+            turn plain www/<arch> dirs into the first snapshot
+        '''
+        plain = [arch for arch in self.archs if (self.www / arch).is_dir() and
+                 not (self.www / arch).is_symlink()]
+        if not plain:
+            if not (self.www / CURRENT).is_symlink() and self.current() is not None:
+                logger.warning(f'pointing {self.www}/<arch> at {self.www / CURRENT}')
+                self.__swap(self.current())
+            return
+        self.root.mkdir(mode=0o755, exist_ok=True)
+        snapshot_id = self.current() or self.__new_id()
+        snapshot = self.root / str(snapshot_id)
+        snapshot.mkdir(mode=0o755, exist_ok=True)
+        for arch in plain:
+            logger.warning(f'moving {self.www / arch} into snapshot {snapshot_id}')
+            os.rename(self.www / arch, snapshot / arch)
+        for arch in self.archs:
+            (snapshot / arch).mkdir(mode=0o755, exist_ok=True)
+        self.__swap(snapshot_id)
+    def stage(self):
+        '''
+            returns the staging dir, a copy of what www shows
+        '''
+        self.init()
+        snapshot_id = self.__new_id()
+        stage = self.root / f'{snapshot_id}{STAGING_SUFFIX}'
+        count = 0
+        for arch in self.archs:
+            src = (self.www / arch).resolve()
+            dst = stage / arch
+            dst.mkdir(mode=0o755, parents=True)
+            if not src.is_dir():
+                continue
+            for fpath in src.iterdir():
+                if fpath.is_symlink():
+                    (dst / fpath.name).symlink_to(os.readlink(fpath))
+                elif is_db_file(fpath.name):
+                    # repo-add may write these in place
+                    copyfile(fpath, dst / fpath.name)
+                elif fpath.is_file():
+                    os.link(fpath, dst / fpath.name)
+                count += 1
+        logger.debug(f'staged snapshot {snapshot_id}, {count} files')
+        return stage
+    def commit(self, stage):
+        '''
+            returns the new snapshot id
+        '''
+        snapshot_id = int(stage.name[:-len(STAGING_SUFFIX)])
+        snapshot = self.root / str(snapshot_id)
+        old_dirs = {arch: (self.www / arch).resolve() for arch in self.archs}
+        os.rename(stage, snapshot)
+        self.__swap(snapshot_id)
+        metrics.inc('repod_snapshots_total', help='snapshots published')
+        logger.info(f'published snapshot {snapshot_id}')
+        if self.on_commit:
+            try:
+                self.on_commit(old_dirs, {arch: snapshot / arch for arch in self.archs},
+                               snapshot_id)
+            except Exception:
+                print_exc_plus()
+        self.prune()
+        return snapshot_id
+    def abort(self, stage):
+        logger.error(f'dropping {stage}')
+        metrics.inc('repod_snapshots_aborted_total', help='snapshots dropped after an error')
+        rmtree(stage, ignore_errors=True)
+    @contextmanager
+    def transaction(self):
+        '''
+            yields the dir to change instead of www
+        '''
+        if not self.enabled:
+            yield self.www
+            return
+        stage = self.stage()
+        try:
+            yield stage
+        except BaseException:
+            self.abort(stage)
+            raise
+        self.commit(stage)
+    def prune(self):
+        '''
+            the current snapshot is never removed
+        '''
+        current = self.current()
+        old = [i for i in self.snapshots() if i != current]
+        old = old[:max(0, len(old) - (self.keep - 1))]
+        for snapshot_id in old:
+            logger.info(f'removing snapshot {snapshot_id}')
+            rmtree(self.root / str(snapshot_id))
+        return old
+    def rollback(self, snapshot_id=None):
+        '''
+            point www at snapshot_id, defaults to the one before the current
+            returns the id or False
+        '''
+        ids = self.snapshots()
+        current = self.current()
+        if snapshot_id is None:
+            older = [i for i in ids if current is not None and i < current]
+            if not older:
+                logger.error(f'nothing older than snapshot {current}')
+                return False
+            snapshot_id = older[-1]
+        elif snapshot_id not in ids:
+            logger.error(f'snapshot {snapshot_id} does not exist')
+            return False
+        old_dirs = {arch: (self.www / arch).resolve() for arch in self.archs}
+        self.__swap(snapshot_id)
+        logger.warning(f'rolled back from snapshot {current} to {snapshot_id}')
+        if self.on_commit:
+            try:
+                self.on_commit(old_dirs, {arch: self.root / str(snapshot_id) / arch
+                                          for arch in self.archs}, snapshot_id)
+            except Exception:
+                print_exc_plus()
+        return snapshot_id
+    def status(self):
+        return {'current': self.current(), 'snapshots': self.snapshots(), 'keep': self.keep}
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# store.py: Automatic management tool for an arch repo.
+# This file is part of Buildbot by JerryXiao
+
+# content addressed package store
+# objects/<sha256[:2]>/<sha256> holds every package and signature once,
+# www/<arch>, archive and recycled are hardlinks to these blobs.
+# the link count of a blob is its reference count, a blob only linked
+# from objects/ is garbage.
+
+import os
+import logging
+import hashlib
+from pathlib import Path
+
+import metrics
+
+logger = logging.getLogger(f'buildbot.{__name__}')
+
+class objectStore:
+    def __init__(self, root):
+        self.root = Path(root)
+    def __repr__(self):
+        return f'objectStore({self.root})'
+    def path(self, digest):
+        return self.root / digest[:2] / digest
+    @staticmethod
+    def digest_of(fpath, bufsize=1024*1024):
+        h = hashlib.sha256()
+        with open(fpath, 'rb') as f:
+            while True:
+                buf = f.read(bufsize)
+                if not buf:
+                    break
+                h.update(buf)
+        return h.hexdigest()
+    def contains(self, fpath):
+        '''
+            fpath is a link to a blob already
+        '''
+        digest = self.digest_of(fpath)
+        blob = self.path(digest)
+        try:
+            return os.path.samefile(fpath, blob)
+        except FileNotFoundError:
+            return False
+    def put(self, fpath):
+        '''
+            make fpath a link to its blob, a file with the same content
+            already stored is shared, fpath is replaced atomically
+            symlinks are left alone
+            returns the digest or None
+        '''
+        fpath = Path(fpath)
+        if fpath.is_symlink() or not fpath.is_file():
+            return None
+        digest = self.digest_of(fpath)
+        blob = self.path(digest)
+        blob.parent.mkdir(mode=0o755, exist_ok=True, parents=True)
+        try:
+            os.link(fpath, blob)
+            metrics.inc('repod_store_blobs_added_total', help='blobs added to the object store')
+        except FileExistsError:
+            if not os.path.samefile(fpath, blob):
+                tmp = fpath.parent / f'.{fpath.name}.linking'
+                if tmp.exists():
+                    tmp.unlink()
+                os.link(blob, tmp)
+                os.replace(tmp, fpath)
+                metrics.inc('repod_store_dedup_bytes_total', blob.stat().st_size,
+                            help='bytes saved by sharing blobs')
+                logger.debug(f'{fpath} deduplicated into {digest}')
+        return digest
+    def link(self, digest, dst):
+        os.link(self.path(digest), dst)
+    def refcount(self, digest):
+        '''
+            links outside objects/
+        '''
+        try:
+            return self.path(digest).stat().st_nlink - 1
+        except FileNotFoundError:
+            return 0
+    def blobs(self):
+        if not self.root.exists():
+            return
+        for subdir in self.root.iterdir():
+            if subdir.is_dir():
+                for blob in subdir.iterdir():
+                    yield blob
+    def unreferenced(self):
+        '''
+            blobs nothing links to right now, see gc
+        '''
+        unreferenced = list()
+        for blob in self.blobs():
+            try:
+                if blob.stat().st_nlink == 1:
+                    unreferenced.append(blob)
+            except FileNotFoundError:
+                continue
+        return unreferenced
+    def gc(self, limit=None, blobs=None):
+        '''
+            delete up to limit blobs nothing links to, out of blobs
+            (listed by unreferenced earlier) or the whole store
+            the link count is checked again before each unlink
+            returns (blobs deleted, bytes reclaimed)
+        '''
+        (count, size) = (0, 0)
+        for blob in (self.blobs() if blobs is None else blobs):
+            if limit is not None and count >= limit:
+                break
+            try:
+                st = blob.stat()
+            except FileNotFoundError:
+                continue
+            if st.st_nlink == 1:
+                blob.unlink()
+                count += 1
+                size += st.st_size
+        if count:
+            logger.info(f'object store gc: {count} blobs, {size} bytes reclaimed')
+        metrics.inc('repod_store_gc_bytes_total', size, help='bytes reclaimed by the object store gc')
+        return (count, size)
+    def stats(self):
+        (blobs, size, unreferenced) = (0, 0, 0)
+        for blob in self.blobs():
+            st = blob.stat()
+            blobs += 1
+            size += st.st_size
+            if st.st_nlink == 1:
+                unreferenced += 1
+        return {'blobs': blobs, 'bytes': size, 'unreferenced': unreferenced}
@@ -0,0 +1,12 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# test_executor.py: Automatic management tool for an arch repo.
+# This file is part of Buildbot by JerryXiao
+
+from executor import localExecutor
+
+def test_local_cwd_quoting(tmp_path):
+    mydir = tmp_path / "it's $(true) a dir"
+    mydir.mkdir()
+    output = localExecutor(root=tmp_path).run('pwd', cwd=mydir.name)
+    assert output.splitlines()[-1] == str(mydir)
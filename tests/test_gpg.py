@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# test_gpg.py: Automatic management tool for an arch repo.
+# This file is part of Buildbot by JerryXiao
+
+# gpg_sign and gpg_verify with a throwaway keyring
+
+import shutil
+import subprocess
+
+import pytest
+
+from utils import gpg_sign, gpg_verify
+
+pytestmark = pytest.mark.skipif(shutil.which('gpg') is None, reason='gpg is not installed')
+
+@pytest.fixture
+def sign_cmd(tmp_path, monkeypatch):
+    home = tmp_path / 'gnupg'
+    home.mkdir(mode=0o700)
+    monkeypatch.setenv('GNUPGHOME', str(home))
+    subprocess.run(['gpg', '--batch', '--pinentry-mode', 'loopback', '--passphrase', '',
+                    '--quick-gen-key', 'buildbot test <test@example.org>', 'ed25519', 'sign', 'never'],
+                   check=True, capture_output=True)
+    yield ('gpg --default-key test@example.org --no-armor --pinentry-mode loopback '
+           '--passphrase \'\' --detach-sign --yes --')
+    subprocess.run(['gpgconf', '--kill', 'all'], capture_output=True)
+
+@pytest.fixture
+def pkgs(tmp_path):
+    pkgdir = tmp_path / 'pkgs'
+    pkgdir.mkdir()
+    fpaths = list()
+    for i in range(8):
+        fpath = pkgdir / f'pkg{i}-1-1-x86_64.pkg.tar.xz'
+        fpath.write_bytes(f'package {i}\n'.encode() * 100)
+        fpaths.append(fpath)
+    return fpaths
+
+def sig_of(fpath):
+    return fpath.parent / f'{fpath.name}.sig'
+
+def test_sign_and_verify(sign_cmd, pkgs):
+    gpg_sign(pkgs, cmd=sign_cmd, workers=4)
+    for fpath in pkgs:
+        assert sig_of(fpath).exists()
+    assert gpg_verify([(sig_of(f), f) for f in pkgs], workers=4) == []
+
+def test_verify_reports_bad_files(sign_cmd, pkgs):
+    gpg_sign(pkgs, cmd=sign_cmd, workers=4)
+    (changed, unsigned) = (pkgs[2], pkgs[5])
+    with open(changed, 'ab') as f:
+        f.write(b'changed after signing\n')
+    sig_of(unsigned).unlink()
+    failed = gpg_verify([(sig_of(f), f) for f in pkgs], workers=4)
+    assert sorted(failed) == sorted([changed, unsigned])
+
+def test_sign_failure_raises(sign_cmd, pkgs):
+    with pytest.raises(subprocess.CalledProcessError):
+        gpg_sign(pkgs[:2] + [pkgs[0].parent / 'missing.pkg.tar.xz'], cmd=sign_cmd, workers=2)
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# test_metrics.py: Automatic management tool for an arch repo.
+# This file is part of Buildbot by JerryXiao
+
+# metrics.serve scraped over http on localhost
+
+import urllib.request
+import urllib.error
+
+import pytest
+
+import metrics
+
+@pytest.fixture
+def scrape():
+    registry = metrics.metricsRegistry()
+    server = metrics.serve(('localhost', 0), registry=registry)
+    (host, port) = server.server_address[:2]
+    def get(path='/metrics'):
+        with urllib.request.urlopen(f'http://{host}:{port}{path}', timeout=10) as resp:
+            return (resp.headers['Content-Type'], resp.read().decode('utf-8'))
+    yield (registry, get)
+    server.shutdown()
+    server.server_close()
+
+def test_exposition_format(scrape):
+    (registry, get) = scrape
+    registry.inc('test_requests_total', help='requests', method='GET')
+    registry.inc('test_requests_total', 2, help='requests', method='GET')
+    registry.inc('test_requests_total', help='requests', method='POST')
+    registry.set('test_queue_depth', 7, help='queued items')
+    registry.observe('test_latency_seconds', 0.5, help='latency')
+    registry.observe('test_latency_seconds', 1.5, help='latency')
+    (ctype, body) = get()
+    assert ctype.startswith('text/plain; version=0.0.4')
+    assert body.endswith('\n')
+    lines = body.split('\n')
+    assert '# HELP test_requests_total requests' in lines
+    assert '# TYPE test_requests_total counter' in lines
+    assert 'test_requests_total{method="GET"} 3' in lines
+    assert 'test_requests_total{method="POST"} 1' in lines
+    assert '# TYPE test_queue_depth gauge' in lines
+    assert 'test_queue_depth 7' in lines
+    assert '# TYPE test_latency_seconds summary' in lines
+    assert 'test_latency_seconds_count 2' in lines
+    assert 'test_latency_seconds_sum 2.0' in lines
+
+def test_label_escaping(scrape):
+    (registry, get) = scrape
+    registry.inc('test_escaped_total', path='a"b\\c\nd')
+    (_, body) = get('/')
+    assert 'test_escaped_total{path="a\\"b\\\\c\\nd"} 1' in body.split('\n')
+
+def test_callbacks(scrape):
+    (registry, get) = scrape
+    registry.register_callback('test_workers', lambda: 2, help='workers')
+    registry.register_callback('test_errors', lambda: {'foo': 1, 'bar': 0}, label='pkg')
+    registry.register_callback('test_broken', lambda: 1 / 0)
+    (_, body) = get()
+    lines = body.split('\n')
+    assert 'test_workers 2' in lines
+    assert 'test_errors{pkg="foo"} 1' in lines
+    assert 'test_errors{pkg="bar"} 0' in lines
+    # a failing callback is left out, the rest is still served
+    assert 'test_broken' not in body
+
+def test_unknown_path(scrape):
+    (_, get) = scrape
+    with pytest.raises(urllib.error.HTTPError) as err:
+        get('/nope')
+    assert err.value.code == 404
@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# test_notify.py: Automatic management tool for an arch repo.
+# This file is part of Buildbot by JerryXiao
+
+# digests go to a fake tgapi.py in a temporary directory
+
+import pytest
+
+from notify import notifier
+
+@pytest.fixture
+def sent(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'tgapi.py').write_text("import sys\n"
+                                       "open('sent.txt', 'a').write(sys.argv[1] + '\\0')\n")
+    def sent():
+        sentfile = tmp_path / 'sent.txt'
+        return sentfile.read_text().split('\0')[:-1] if sentfile.exists() else []
+    return sent
+
+def test_flush_at_exit(sent):
+    n = notifier(interval=3600)
+    n.send('first')
+    n.send('second')
+    n.flush(wait=True)
+    assert sent() == ['first\nsecond']
+    # nothing pending, nothing sent
+    n.flush(wait=True)
+    assert len(sent()) == 1
+
+def test_dropped(sent):
+    n = notifier(interval=3600, max_lines=2)
+    for i in range(5):
+        n.send(i)
+    n.flush(wait=True)
+    assert sent() == ['[3 messages dropped]\n3\n4']
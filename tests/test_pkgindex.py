@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# test_pkgindex.py: Automatic management tool for an arch repo.
+# This file is part of Buildbot by JerryXiao
+
+# outdated against pkgver.json, versions compared in-process
+
+import json
+
+import pytest
+
+from pkgindex import pkgIndex, load_pkgvers
+from utils import alpm_vercmp
+
+# from pacman's test/util/vercmptest.sh
+VERCMP = [
+    ('1.5.0', '1.5.0', 0), ('1.5.1', '1.5.0', 1),
+    ('1.5.0-1', '1.5.0-2', -1), ('1.5.0-1', '1.5.1-1', -1), ('1.5-1', '1.5', 0),
+    ('1.5b-1', '1.5-1', -1), ('1.5.b', '1.5', -1), ('1.5a', '1.5', -1),
+    ('1.5', '1.5.1', -1), ('1.5.b-1', '1.5b-1', 1), ('1.5.0', '1.5_0', 0),
+    ('1.5.1', '1.5_0', 1), ('1.5.0', '1.5.0.', 0), ('1.5..a', '1.5.a', 1),
+    ('1.0alpha', '1.0.0', -1), ('1.0', '1.0rc1', 1), ('1.0.a', '1.0rc1', 1),
+    ('1.0rc2', '1.0rc10', -1), ('1.010', '1.9', 1), ('1:1.0', '2.0', 1),
+    ('0:1.0', '1.0', 0), ('1:1.0', '1:2.0', -1), ('2.0-1', '1:1.0-1', -1),
+    ('1.5.0-1', '1.5.0-1.1', -1), ('1.0', '1.0a', 1), ('r123.abc', 'r99.def', 1),
+]
+
+@pytest.mark.parametrize('ver1, ver2, expected', VERCMP)
+def test_alpm_vercmp(ver1, ver2, expected):
+    assert alpm_vercmp(ver1, ver2) == expected
+    assert alpm_vercmp(ver2, ver1) == -expected
+
+def pkgbuild(root, dirname, text):
+    (root / dirname).mkdir(parents=True)
+    (root / dirname / 'PKGBUILD').write_text(text)
+
+def test_outdated(tmp_path):
+    pkgbuilds = tmp_path / 'pkgbuilds'
+    pkgbuild(pkgbuilds, 'foo-split', "pkgbase=foo\npkgname=('foo' 'libfoo')\narch=('x86_64')\n")
+    pkgbuild(pkgbuilds, 'renamed', "pkgname=bar-git\narch=('x86_64')\n")
+    pkgbuild(pkgbuilds, 'baz', "pkgname=baz\n")
+    with open(tmp_path / 'pkgver.json', 'w') as f:
+        json.dump({'foo-split': ['1:1.0-1', 0], 'renamed': ['r10.abc-1', 0],
+                   'baz': ['2.0-1', 0], 'gone': ['1.0-1', 0]}, f)
+    pkgvers = load_pkgvers(tmp_path / 'pkgver.json', pkgbuilds)
+    assert pkgvers == {'foo': '1:1.0-1', 'bar-git': 'r10.abc-1', 'baz': '2.0-1', 'gone': '1.0-1'}
+    index = pkgIndex(str(tmp_path / 'pkgindex.sqlite'))
+    rows = [('foo', 'foo', '2.0-1'), ('libfoo', 'foo', '2.0-1'), ('bar-git', 'bar-git', 'r9.abc-1'),
+            ('baz', 'baz', '2.0-1'), ('gone', 'gone', '1.0-2')]
+    with index.db:
+        for (pkgname, pkgbase, version) in rows:
+            index.db.execute('INSERT INTO packages (fname, arch, pkgname, pkgbase, version) '
+                             'VALUES (?, ?, ?, ?, ?)',
+                             (f'{pkgname}-{version}-x86_64.pkg.tar.zst', 'x86_64', pkgname, pkgbase, version))
+    outdated = index.query('outdated', pkgvers=pkgvers)
+    assert sorted((row['pkgname'], row['latest']) for row in outdated) == \
+           [('bar-git', 'r10.abc-1'), ('foo', '1:1.0-1'), ('libfoo', '1:1.0-1')]
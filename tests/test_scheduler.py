@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# test_scheduler.py: Automatic management tool for an arch repo.
+# This file is part of Buildbot by JerryXiao
+
+# workerScheduler with fake jobs, nothing is built
+
+from itertools import count
+from types import SimpleNamespace
+
+import pytest
+
+from scheduler import workerScheduler
+
+ids = count()
+
+class fakeJob:
+    def __init__(self, dirname, arch='x86_64', version='1.0-1'):
+        self.arch = arch
+        self.pkgconfig = SimpleNamespace(dirname=dirname, priority=0)
+        self.version = version
+        self.job_id = f'job{next(ids)}'
+        self.attempts = 0
+    def __repr__(self):
+        return f'fakeJob({self.pkgconfig.dirname}, {self.arch}, {self.job_id})'
+
+@pytest.fixture
+def sched():
+    return workerScheduler(timeout=60, max_attempts=3, heartbeat=10)
+
+def queued(sched, worker_id):
+    return sched.status()[worker_id]['queued']
+
+def test_register(sched):
+    assert sched.register('w1', ['x86_64'], capacity=2) == 10
+    assert sched.can_build('x86_64')
+    assert not sched.can_build('aarch64')
+    assert sched.pull('nobody') is None
+    assert sched.unregister('w1')
+    assert not sched.unregister('w1')
+    assert not sched.heartbeat('w1')
+
+def test_least_loaded_and_arch(sched):
+    sched.register('w1', ['x86_64'])
+    sched.register('w2', ['x86_64', 'aarch64'], capacity=2)
+    jobs = [fakeJob(f'pkg{i}') for i in range(3)]
+    for job in jobs:
+        assert sched.submit(job)
+    # w2 has twice the capacity
+    assert len(queued(sched, 'w1')) == 1
+    assert len(queued(sched, 'w2')) == 2
+    arm = fakeJob('armpkg', arch='aarch64')
+    assert sched.submit(arm)
+    assert arm.job_id in queued(sched, 'w2')
+    assert not sched.submit(fakeJob('other', arch='riscv64'))
+
+def test_submit_replaces_queued(sched):
+    sched.register('w1', ['x86_64'])
+    old = fakeJob('pkg', version='1.0-1')
+    new = fakeJob('pkg', version='1.0-2')
+    sched.submit(old)
+    sched.submit(new)
+    assert queued(sched, 'w1') == [new.job_id]
+
+def test_pull_and_done(sched):
+    sched.register('w1', ['x86_64'], capacity=2)
+    jobs = [fakeJob(f'pkg{i}') for i in range(3)]
+    for job in jobs:
+        sched.submit(job)
+    pulled = sched.pull('w1', slots=2)
+    assert pulled == jobs[:2]
+    assert sched.status()['w1']['running'] == [j.job_id for j in jobs[:2]]
+    assert sched.done('w1', jobs[0].job_id, True)
+    assert sched.done('w1', jobs[1].job_id, False, 'boom')
+    assert not sched.done('w1', jobs[1].job_id, True)
+    assert list(sched.results) == [(jobs[0].job_id, 'w1', True, None),
+                                   (jobs[1].job_id, 'w1', False, 'boom')]
+    status = sched.status()['w1']
+    assert (status['done'], status['failed']) == (1, 1)
+
+def test_steal(sched):
+    sched.register('w1', ['x86_64', 'aarch64'], capacity=4)
+    jobs = [fakeJob(f'pkg{i}') for i in range(3)]
+    arm = fakeJob('armpkg', arch='aarch64')
+    for job in jobs + [arm]:
+        sched.submit(job)
+    sched.register('w2', ['x86_64'])
+    # from the tail of w1, skipping what w2 cannot build
+    assert sched.pull('w2') == [jobs[2]]
+    assert queued(sched, 'w1') == [jobs[0].job_id, jobs[1].job_id, arm.job_id]
+    sched.register('w3', ['riscv64'])
+    assert sched.pull('w3') == []
+
+def test_reap_requeues(sched):
+    sched.register('w1', ['x86_64'])
+    sched.register('w2', ['x86_64'])
+    jobs = [fakeJob(f'pkg{i}') for i in range(4)]
+    for job in jobs:
+        sched.submit(job)
+    (running,) = sched.pull('w1')
+    for worker in sched.workers:
+        if worker.worker_id == 'w1':
+            worker.last_seen -= 61
+    assert sched.reap() == ['w1']
+    status = sched.status()
+    assert list(status) == ['w2']
+    assert sorted(status['w2']['queued']) == sorted(j.job_id for j in jobs)
+    # only the running job counts as lost
+    assert running.attempts == 1
+    assert [j.attempts for j in jobs if j is not running] == [0, 0, 0]
+
+def test_reregister_requeues(sched):
+    sched.register('w1', ['x86_64'])
+    job = fakeJob('pkg')
+    sched.submit(job)
+    sched.pull('w1')
+    sched.register('w1', ['x86_64'])
+    assert job.attempts == 1
+    assert queued(sched, 'w1') == [job.job_id]
+
+def test_heartbeat_lost_job(sched):
+    sched.register('w1', ['x86_64'])
+    job = fakeJob('pkg')
+    sched.submit(job)
+    sched.pull('w1')
+    # reported, kept
+    assert sched.heartbeat('w1', running=[job.job_id])
+    assert sched.status()['w1']['running'] == [job.job_id]
+    # handed out long ago and not reported
+    for worker in sched.workers:
+        worker.running[job.job_id] = (job, worker.running[job.job_id][1] - 21)
+    assert sched.heartbeat('w1', running=[])
+    status = sched.status()['w1']
+    assert (status['running'], status['queued']) == ([], [job.job_id])
+    assert job.attempts == 1
+
+def test_orphans(sched):
+    sched.register('w1', ['x86_64'])
+    sched.register('w2', ['aarch64'])
+    job = fakeJob('pkg')
+    sched.submit(job)
+    sched.pull('w1')
+    assert sched.unregister('w1')
+    # w2 cannot build it
+    assert sched.take_orphans() == [job]
+    assert sched.take_orphans() == []
+
+def test_max_attempts(sched):
+    sched.register('w1', ['x86_64'])
+    sched.register('w2', ['x86_64'])
+    job = fakeJob('pkg')
+    sched.submit(job)
+    for attempt in range(1, 4):
+        (holder,) = [w for (w, status) in sched.status().items() if status['queued']]
+        assert sched.pull(holder) == [job]
+        # the worker comes back without the job
+        sched.register(holder, ['x86_64'])
+        assert job.attempts == attempt
+        if attempt < 3:
+            other = 'w1' if holder == 'w2' else 'w2'
+            assert queued(sched, other) == [job.job_id]
+    # lost 3 times: given up, neither queued nor an orphan
+    assert [s['queued'] for s in sched.status().values()] == [[], []]
+    assert sched.take_orphans() == []
+    assert list(sched.results)[-1] == (job.job_id, None, False, 'lost too many times')
+
+def test_late_result(sched):
+    sched.register('w1', ['x86_64'])
+    sched.register('w2', ['x86_64'])
+    job = fakeJob('pkg')
+    sched.submit(job)
+    (holder,) = [w for (w, status) in sched.status().items() if status['queued']]
+    other = 'w1' if holder == 'w2' else 'w2'
+    sched.pull(holder)
+    for worker in sched.workers:
+        if worker.worker_id == holder:
+            worker.last_seen -= 61
+    assert sched.reap() == [holder]
+    assert queued(sched, other) == [job.job_id]
+    # the dropped worker finished it after all
+    assert sched.done(holder, job.job_id, True)
+    assert queued(sched, other) == []
+    assert list(sched.results) == [(job.job_id, holder, True, None)]
+    assert not sched.done(holder, job.job_id, True)
+
+def test_late_result_built_twice(sched):
+    sched.register('w1', ['x86_64'])
+    job = fakeJob('pkg')
+    sched.submit(job)
+    sched.pull('w1')
+    sched.register('w2', ['x86_64'])
+    sched.unregister('w1')
+    assert sched.pull('w2') == [job]
+    assert sched.done('w1', job.job_id, False, 'boom')
+    # the copy on w2 is no longer expected
+    assert sched.status()['w2']['running'] == []
+    assert not sched.done('w2', job.job_id, True)
+    assert sched.take_orphans() == []
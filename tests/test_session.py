@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# test_session.py: Automatic management tool for an arch repo.
+# This file is part of Buildbot by JerryXiao
+
+# shellSession and sessionManager against a plain local bash
+
+import sys
+import pytest
+from time import time
+
+import session as session_module
+from session import shellSession, sessionManager, SessionError
+
+BASH = ['/bin/bash']
+# bash on a pty (pty.spawn: openpty and fork), like machinectl shell
+PTY_BASH = [sys.executable, '-c', 'import pty; pty.spawn(["/bin/bash", "--norc", "-i"])']
+
+@pytest.fixture
+def session():
+    session = shellSession(BASH, start_timeout=10)
+    yield session
+    session.close()
+
+def test_output_and_exit_code(session):
+    assert session.run('echo hello; echo world') == (0, '+ echo hello\nhello\n+ echo world\nworld\n')
+    (code, output) = session.run('echo failing; exit 3')
+    assert code == 3
+    assert 'failing\n' in output
+    # set -e
+    (code, output) = session.run('false; echo unreachable')
+    assert code == 1
+    assert 'unreachable\n' not in output.replace('+ echo unreachable\n', '')
+
+def test_one_shell_for_every_command(session):
+    for i in range(5):
+        assert session.run(f'echo {i}')[0] == 0
+    assert session.commands == 5
+    assert session.alive()
+
+def test_cwd(session, tmp_path):
+    mydir = tmp_path / "it's a dir"
+    mydir.mkdir()
+    (code, output) = session.run('pwd', cwd=mydir)
+    assert code == 0
+    assert output.split('\n')[-2] == str(mydir)
+
+def test_marker_lookalike(session):
+    # only the marker of this command ends it
+    (code, output) = session.run('echo "__BB_END_0123_1 0"; echo after')
+    assert code == 0
+    assert output.endswith('after\n')
+
+def test_on_line_and_keepalive(session):
+    lines = list()
+    # keepalive answers with empty lines
+    (code, output) = session.run('read answer; echo "got:$answer."', on_line=lines.append,
+                                 keepalive=True)
+    assert code == 0
+    assert 'got:.\n' in lines
+    assert ''.join(lines) == output
+    # no input without keepalive
+    (code, _) = session.run('read answer')
+    assert code == 1
+
+def test_timeout(session):
+    (code, _) = session.run('sleep 30', timeout=1)
+    assert code == 124
+    # the shell itself survives
+    assert session.alive()
+    assert session.run('echo still here')[0] == 0
+
+def test_session_deadline(session, monkeypatch):
+    # a clock running 40s per reading is past timeout + 30 right away
+    clock = [time()]
+    def fast_time():
+        clock[0] += 40
+        return clock[0]
+    session.start()
+    monkeypatch.setattr(session_module, 'time', fast_time)
+    (code, output) = session.run('sleep 5', timeout=1)
+    assert code == 124
+    assert output.endswith('session timeout expired, session closed.\n')
+    assert not session.alive()
+
+def test_shell_exits(session):
+    session.start()
+    shell = session._shellSession__proc.pid
+    (code, output) = session.run(f'kill -9 {shell}')
+    assert code == -1
+    assert output.endswith('session exited unexpectedly.\n')
+    assert not session.alive()
+    assert session.run('echo restarted')[0] == 0
+
+@pytest.fixture
+def pty_session():
+    session = shellSession(PTY_BASH, start_timeout=10)
+    yield session
+    session.close()
+
+def test_pty_multiline(pty_session):
+    # a hook script, nothing of it is echoed back
+    script = 'for i in 1 2; do\n  echo "line $i"\ndone\nexit 5'
+    (code, output) = pty_session.run(script, timeout=10)
+    assert code == 5
+    assert [line for line in output.splitlines() if not line.startswith('+')] == \
+           ['line 1', 'line 2']
+    assert '\x1b' not in output
+    assert pty_session.run('echo again') == (0, '+ echo again\nagain\n')
+
+def test_pty_long_command(pty_session, tmp_path):
+    # longer than the 4096 bytes of a tty line
+    long = 'y' * 10000
+    mydir = tmp_path / "it's"
+    mydir.mkdir()
+    (code, output) = pty_session.run(f'echo {long} | wc -c; pwd', cwd=mydir, timeout=10)
+    assert code == 0
+    assert '\n10001\n' in output
+    assert output.endswith(f'+ pwd\n{mydir}\n')
+
+def test_start_failure():
+    with pytest.raises(SessionError):
+        shellSession(['/bin/false']).start()
+
+def test_manager():
+    manager = sessionManager({'x86_64': BASH}, retry_after=60)
+    try:
+        assert manager.run('x86_64', 'echo managed')[0] == 0
+        with pytest.raises(SessionError):
+            manager.run('aarch64', 'true')
+        # a busy session is not waited for
+        busy = manager._sessionManager__sessions['x86_64']
+        with busy.lock:
+            with pytest.raises(SessionError):
+                manager.run('x86_64', 'true')
+    finally:
+        manager.close()
+
+def test_manager_failed_start():
+    manager = sessionManager({'x86_64': ['/bin/false']}, retry_after=60)
+    with pytest.raises(SessionError):
+        manager.run('x86_64', 'true')
+    # not started again before retry_after
+    with pytest.raises(SessionError, match='failed recently'):
+        manager.run('x86_64', 'true')
@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# test_store.py: Automatic management tool for an arch repo.
+# This file is part of Buildbot by JerryXiao
+
+# gc of the object store, candidates listed once and checked again
+
+import os
+
+from store import objectStore
+
+def put(store, fpath, content):
+    fpath.write_bytes(content)
+    return store.put(fpath)
+
+def test_gc_candidates(tmp_path):
+    store = objectStore(tmp_path / 'objects')
+    (tmp_path / 'www').mkdir()
+    kept = put(store, tmp_path / 'www' / 'a', b'a')
+    for name in ('b', 'c', 'd'):
+        put(store, tmp_path / 'www' / name, name.encode())
+        os.unlink(tmp_path / 'www' / name)
+    candidates = store.unreferenced()
+    assert len(candidates) == 3
+    assert store.path(kept) not in candidates
+    # linked again after the scan, gc leaves it alone
+    relinked = candidates[0]
+    store.link(relinked.name, tmp_path / 'www' / 'again')
+    (blobs, size) = store.gc(blobs=candidates)
+    assert (blobs, size) == (2, 2)
+    assert relinked.exists() and store.path(kept).exists()
+    assert store.unreferenced() == list()
+    # gone meanwhile
+    assert store.gc(blobs=candidates) == (0, 0)
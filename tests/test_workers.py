@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# test_workers.py: Automatic management tool for an arch repo.
+# This file is part of Buildbot by JerryXiao
+
+# buildWorkers talking to a master on localhost over the rpc,
+# their builds run on fakeExecutors
+
+from multiprocessing.connection import Listener
+from threading import Thread, Event
+from time import time, sleep
+from types import SimpleNamespace
+
+import pytest
+
+from config import RPC_BACKLOG
+from builder import Job
+from executor import fakeExecutor
+from scheduler import workerScheduler
+from worker import buildWorker
+import wire
+
+AUTHKEY = b'test'
+
+class fakeMaster:
+    '''
+        the worker rpc of buildbot.py in front of a workerScheduler
+        the first fail_done worker_done calls get no answer
+    '''
+    def __init__(self):
+        self.scheduler = workerScheduler(timeout=1, max_attempts=3, heartbeat=0.2)
+        self.fail_done = 0
+        self.listener = Listener(('localhost', 0), authkey=AUTHKEY, backlog=RPC_BACKLOG)
+        tr = Thread(target=wire.serve, args=(self.listener, self.run))
+        tr.daemon = True
+        tr.start()
+    @property
+    def address(self):
+        return (self.listener.address, AUTHKEY)
+    def run(self, funcname, args=list(), kwargs=dict()):
+        sched = self.scheduler
+        if funcname == 'worker_register':
+            return sched.register(*args, **kwargs)
+        if funcname == 'worker_heartbeat':
+            kwargs.pop('lines', None)
+            ret = sched.heartbeat(*args, **kwargs)
+            sched.reap()
+            return ret
+        if funcname == 'worker_pull':
+            jobs = sched.pull(*args, **kwargs)
+            return None if jobs is None else [job.to_dict() for job in jobs]
+        if funcname == 'worker_done':
+            if self.fail_done > 0:
+                self.fail_done -= 1
+                raise RuntimeError('worker_done lost')
+            return sched.done(*args, **kwargs)
+        if funcname == 'worker_unregister':
+            return sched.unregister(*args, **kwargs)
+        return False
+    def submit(self, dirname):
+        job = Job('x86_64', SimpleNamespace(dirname=dirname, priority=0), '1.0-1')
+        assert self.scheduler.submit(job)
+        return job
+
+def wait_for(cond, timeout=10):
+    deadline = time() + timeout
+    while not cond():
+        assert time() < deadline, 'timed out'
+        sleep(0.02)
+
+@pytest.fixture
+def master():
+    return fakeMaster()
+
+@pytest.fixture
+def start_worker(master):
+    workers = list()
+    def start_worker(worker_id, build=None, delay=0.1, capacity=1):
+        fake = fakeExecutor(name=worker_id, delay=delay)
+        def default_build(jobdict):
+            fake.run(f'makepkg {jobdict["dirname"]}', cwd=jobdict['dirname'])
+        bw = buildWorker(worker_id, arches=['x86_64'], capacity=capacity, master=master.address,
+                         build=build if build else default_build, pull_interval=0.05)
+        tr = Thread(target=bw.run_forever)
+        tr.daemon = True
+        tr.start()
+        workers.append(bw)
+        wait_for(lambda: worker_id in master.scheduler.status())
+        return (bw, fake)
+    yield start_worker
+    for bw in workers:
+        bw.stop()
+
+def finished(master):
+    return [r[0] for r in master.scheduler.results]
+
+def test_steal(master, start_worker):
+    (_, fake1) = start_worker('w1')
+    jobs = [master.submit(f'pkg{i}') for i in range(6)]
+    # everything is queued on w1, w2 has to steal
+    (_, fake2) = start_worker('w2')
+    wait_for(lambda: len(finished(master)) == len(jobs))
+    assert sorted(finished(master)) == sorted(job.job_id for job in jobs)
+    assert fake1.calls and fake2.calls
+    assert sorted(cwd for (_, cwd) in fake1.calls + fake2.calls) == sorted(f'pkg{i}' for i in range(6))
+
+def test_timeout_requeues(master, start_worker):
+    release = Event()
+    def stuck(jobdict):
+        release.wait(10)
+    (bw1, _) = start_worker('w1', build=stuck)
+    job = master.submit('pkg')
+    wait_for(lambda: job.job_id in bw1.running)
+    # no more heartbeats from w1, the build goes on
+    bw1.stop(unregister=False)
+    (_, fake2) = start_worker('w2')
+    wait_for(lambda: finished(master) == [job.job_id])
+    assert 'w1' not in master.scheduler.status()
+    assert fake2.calls == [('makepkg pkg', 'pkg')]
+    assert list(master.scheduler.results) == [(job.job_id, 'w2', True, None)]
+    # the result of w1 comes too late, nothing changes
+    release.set()
+    wait_for(lambda: not bw1.running)
+    sleep(0.2)
+    assert list(master.scheduler.results) == [(job.job_id, 'w2', True, None)]
+
+def test_undelivered_result(master, start_worker):
+    master.fail_done = 2
+    (_, fake1) = start_worker('w1')
+    (_, fake2) = start_worker('w2')
+    job = master.submit('pkg')
+    wait_for(lambda: finished(master) == [job.job_id])
+    # longer than the master waits for a job missing from heartbeats
+    sleep(1)
+    assert master.fail_done == 0
+    assert len(fake1.calls + fake2.calls) == 1
+    assert finished(master) == [job.job_id]
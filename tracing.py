@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# tracing.py: Automatic management tool for an arch repo.
+# This file is part of Buildbot by JerryXiao
+
+# span based tracing
+# spans are only recorded inside a trace (see trace()),
+# they are written to a json lines file, one span per line
+# python tracing.py file.jsonl > out.json converts them to chrome trace format
+
+import os
+import json
+import logging
+from threading import Lock, local, get_ident
+from time import time, perf_counter
+from contextlib import contextmanager
+from uuid import uuid4
+
+logger = logging.getLogger(f'buildbot.{__name__}')
+
+__ctx = local()
+__export_lock = Lock()
+__exportfile = None
+
+def configure(fpath):
+    '''
+        write spans to fpath, None disables tracing
+    '''
+    global __exportfile
+    with __export_lock:
+        if __exportfile:
+            __exportfile.close()
+        __exportfile = open(fpath, 'a') if fpath else None
+
+def new_id():
+    return uuid4().hex[:16]
+
+def __stack():
+    stack = getattr(__ctx, 'stack', None)
+    if stack is None:
+        stack = __ctx.stack = list()
+    return stack
+
+def current():
+    '''
+        returns {'trace_id', 'parent_id'} for propagation, or None
+    '''
+    stack = __stack()
+    if not stack:
+        return None
+    (trace_id, span_id) = stack[-1]
+    return {'trace_id': trace_id, 'parent_id': span_id}
+
+@contextmanager
+def trace(trace_id=None, parent_id=None):
+    '''
+        make spans in this thread belong to trace_id
+    '''
+    if not (trace_id and __exportfile):
+        yield
+        return
+    stack = __stack()
+    stack.append((trace_id, parent_id))
+    try:
+        yield
+    finally:
+        stack.pop()
+
+@contextmanager
+def span(name, **attrs):
+    stack = __stack()
+    if not (stack and __exportfile):
+        yield
+        return
+    (trace_id, parent_id) = stack[-1]
+    span_id = new_id()
+    stack.append((trace_id, span_id))
+    start = time()
+    pstart = perf_counter()
+    error = None
+    try:
+        yield
+    except BaseException as err:
+        error = type(err).__name__
+        raise
+    finally:
+        stack.pop()
+        __export({'trace_id': trace_id, 'span_id': span_id, 'parent_id': parent_id,
+                  'name': name, 'start': start, 'duration': perf_counter() - pstart,
+                  'pid': os.getpid(), 'tid': get_ident(), 'error': error,
+                  'attrs': {k: str(v) for (k, v) in attrs.items()}})
+
+def wrap(func):
+    '''
+        carry the current trace into another thread
+    '''
+    ctx = current()
+    if ctx is None:
+        return func
+    def wrapped(*args, **kwargs):
+        with trace(**ctx):
+            return func(*args, **kwargs)
+    return wrapped
+
+def __export(record):
+    line = json.dumps(record) + '\n'
+    with __export_lock:
+        if __exportfile:
+            try:
+                __exportfile.write(line)
+                __exportfile.flush()
+            except Exception:
+                logger.exception('unable to write trace')
+
+def to_chrome(lines):
+    '''
+        convert span json lines to chrome trace format (about:tracing, perfetto)
+    '''
+    events = list()
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        record = json.loads(line)
+        args = dict(record['attrs'])
+        args.update({k: record[k] for k in ('trace_id', 'span_id', 'parent_id', 'error')})
+        events.append({'name': record['name'], 'ph': 'X', 'cat': record['trace_id'],
+                       'ts': record['start'] * 1e6, 'dur': record['duration'] * 1e6,
+                       'pid': record['pid'], 'tid': record['tid'], 'args': args})
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+if __name__ == '__main__':
+    import sys
+    import argparse
+    parser = argparse.ArgumentParser(description='Convert buildbot traces to chrome trace format.')
+    parser.add_argument('tracefile', nargs='+', help='json lines trace files')
+    parser.add_argument('-t', '--trace-id', help='only export this trace')
+    args = parser.parse_args()
+    lines = list()
+    for fpath in args.tracefile:
+        with open(fpath, 'r') as f:
+            lines += [l for l in f if (not args.trace_id) or args.trace_id in l]
+    json.dump(to_chrome(lines), sys.stdout)
@@ -2,17 +2,32 @@
 # -*- coding: utf-8 -*-
 import subprocess
 import logging, logging.handlers
-from time import time, sleep
+from time import time, sleep, perf_counter
 import re
 from threading import Thread, Lock
 from pathlib import Path
 import os
 import sys
 import traceback
+import shlex
+import reprlib
+import hashlib
+import queue
+import atexit
+from collections import deque
+from itertools import count
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import multiprocessing
 
-from config import PKG_COMPRESSION, SHELL_ARCH_ARM64, SHELL_ARCH_X64, \
-                   SHELL_ARM64_ADDITIONAL, SHELL_TRAP, \
-                   CONTAINER_BUILDBOT_ROOT, ARCHS
+from config import PKG_COMPRESSION, ARCHS, \
+                   GPG_SIGN_CMD, GPG_SIGN_WORKERS, \
+                   GPG_VERIFY_CMD, GPG_VERIFY_WORKERS, \
+                   LOG_STREAM_BUFFER, LOG_STREAM_EXPIRE, LOG_QUEUE_SIZE, \
+                   EXC_MAX_FRAMES, EXC_MAX_LOCALS, EXC_REPR_MAXSTRING, \
+                   EXC_DEDUP_WINDOW, HOOK_MARKER
+
+import metrics
+import tracing
 
 logger = logging.getLogger(f'buildbot.{__name__}')
 
@@ -27,7 +42,8 @@ def background(func):
 def bash(cmdline, **kwargs):
     assert type(cmdline) is str
     logger.debug(f'bash: {cmdline}, kwargs: {kwargs}')
-    return(run_cmd(['/bin/bash', '-x', '-e', '-c', cmdline], **kwargs))
+    with tracing.span('bash', cmdline=cmdline[:200]):
+        return(run_cmd(['/bin/bash', '-x', '-e', '-c', cmdline], **kwargs))
 
 def mon_bash(cmdline, seconds=60*30, **kwargs):
     assert type(seconds) is int and seconds >= 1
@@ -35,39 +51,162 @@ def mon_bash(cmdline, seconds=60*30, **kwargs):
                 RUN_CMD_TIMEOUT=seconds, **kwargs)
 
 def nspawn_shell(arch, cmdline, cwd=None, **kwargs):
-    root = Path(CONTAINER_BUILDBOT_ROOT)
-    if cwd:
-        cwd = root / cwd
-    else:
-        cwd = root
-    logger.debug(f'bash_{arch}: {cmdline}, cwd: {cwd}, kwargs: {kwargs}')
+    '''
+        run cmdline in a build environment for arch, see executor.py
+        session: run in a long-lived shell of the container if possible
+    '''
+    from executor import run as executor_run
     if arch in ('aarch64', 'arm64'):
-        command=f'{SHELL_ARM64_ADDITIONAL}; {SHELL_TRAP}; cd \'{cwd}\'; {cmdline}'
-        ret = run_cmd(SHELL_ARCH_ARM64 + [command,], **kwargs)
+        arch = 'aarch64'
     elif arch in ('x64', 'x86', 'x86_64'):
-        command=f'{SHELL_TRAP}; cd \'{cwd}\'; {cmdline}'
-        ret = run_cmd(SHELL_ARCH_X64 + [command,], **kwargs)
+        arch = 'x86_64'
     else:
         raise TypeError('nspawn_shell: wrong arch')
-    if not ret.endswith('++ exit 0\n'):
-        raise subprocess.CalledProcessError(1, cmdline, ret)
-    return ret
+    logger.debug(f'bash_{arch}: {cmdline}, cwd: {cwd}, kwargs: {kwargs}')
+    return executor_run(arch, cmdline, cwd=cwd, **kwargs)
 
 def mon_nspawn_shell(arch, cmdline, cwd, seconds=60*30, **kwargs):
     assert type(seconds) is int and seconds >= 1
     return nspawn_shell(arch, cmdline, cwd=cwd, keepalive=True, KEEPALIVE_TIMEOUT=60,
                         RUN_CMD_TIMEOUT=seconds, **kwargs)
 
+class logStream:
+    '''
+        fan out log lines to subscribers
+        every subscriber has a bounded buffer, when a subscriber
+        falls behind its oldest lines are dropped and counted,
+        writers never block
+    '''
+    def __init__(self, maxlen=LOG_STREAM_BUFFER, expire=LOG_STREAM_EXPIRE):
+        self.__maxlen = maxlen
+        self.__expire = expire
+        self.__lock = Lock()
+        self.__ids = count(1)
+        # id => [channel, deque, dropped, last_fetch]
+        self.__subscribers = dict()
+    def publish(self, channel, line):
+        if not self.__subscribers:
+            return
+        with self.__lock:
+            for sub in self.__subscribers.values():
+                if sub[0] == channel:
+                    if len(sub[1]) >= self.__maxlen:
+                        sub[2] += 1
+                    sub[1].append(line)
+    def subscribe(self, channel):
+        with self.__lock:
+            self.__expire_subscribers()
+            sub_id = next(self.__ids)
+            self.__subscribers[sub_id] = [channel, deque(maxlen=self.__maxlen), 0, time()]
+            return sub_id
+    def unsubscribe(self, sub_id):
+        with self.__lock:
+            return self.__subscribers.pop(sub_id, None) is not None
+    def fetch(self, sub_id, maxlines=None):
+        '''
+            returns (lines, number of dropped lines)
+            or None if there is no such subscriber
+        '''
+        with self.__lock:
+            self.__expire_subscribers()
+            sub = self.__subscribers.get(sub_id, None)
+            if sub is None:
+                return None
+            sub[3] = time()
+            buf = sub[1]
+            n = len(buf) if maxlines is None else min(len(buf), maxlines)
+            lines = [buf.popleft() for _ in range(n)]
+            dropped = sub[2]
+            sub[2] = 0
+            return (lines, dropped)
+    def __expire_subscribers(self):
+        now = time()
+        for sub_id in [k for k in self.__subscribers \
+                       if now - self.__subscribers[k][3] > self.__expire]:
+            del self.__subscribers[sub_id]
+
+logstream = logStream()
+
+def __hook_script(hooks, parallel=False, strict=False):
+    lines = list()
+    for (i, (cmdline, seconds)) in enumerate(hooks):
+        hook = (f'__bb_s=$(date +%s.%N); __bb_rc=0; '
+                f'timeout -k 10 {int(seconds)} /bin/bash -x -e -c {shlex.quote(cmdline)} || __bb_rc=$?; '
+                f'echo "{HOOK_MARKER} {i} $__bb_rc $__bb_s $(date +%s.%N)"')
+        if strict:
+            hook += '; [ $__bb_rc -eq 0 ]'
+        lines.append(f'( {hook} ) & __bb_pids="$__bb_pids $!"' if parallel else hook)
+    if parallel:
+        # a bare wait always returns 0, wait for every hook on its own
+        lines.append('__bb_failed=0; for __bb_pid in $__bb_pids; do wait $__bb_pid || __bb_failed=1; done')
+        if strict:
+            lines.append('[ $__bb_failed -eq 0 ]')
+    return '\n'.join(lines)
+
+def run_hooks(arch, cwd, hooks, mode='batch', strict=False, stage='hook', session=False):
+    '''
+        run hooks, a list of (cmdline, timeout in secs), in the container
+        mode: serial   -- one container session per hook
+              batch    -- one session, hooks run one after another
+              parallel -- one session, hooks run concurrently
+        returns a list of (cmdline, returncode, seconds)
+        failures are logged, with strict=True the first one is raised
+    '''
+    assert mode in ('serial', 'batch', 'parallel')
+    if not hooks:
+        return list()
+    results = list()
+    if mode == 'serial' or len(hooks) == 1:
+        for (cmdline, seconds) in hooks:
+            start = perf_counter()
+            rc = 0
+            try:
+                mon_nspawn_shell(arch, cmdline, cwd=cwd, seconds=int(seconds), session=session)
+            except Exception as err:
+                if strict:
+                    raise
+                rc = getattr(err, 'returncode', -1)
+                print_exc_plus()
+            results.append((cmdline, rc, perf_counter() - start))
+    else:
+        parallel = mode == 'parallel'
+        seconds = [int(s) for (_, s) in hooks]
+        total = (max(seconds) if parallel else sum(seconds)) + 60
+        try:
+            output = mon_nspawn_shell(arch, __hook_script(hooks, parallel=parallel, strict=strict),
+                                      cwd=cwd, seconds=total, session=session)
+        except subprocess.CalledProcessError as err:
+            if strict:
+                raise
+            print_exc_plus()
+            output = err.output or ''
+        # returncode None means the hook did not report back
+        done = {i: (None, 0.0) for i in range(len(hooks))}
+        for line in output.split('\n'):
+            m = re.match(rf'^{HOOK_MARKER} (\d+) (\d+) ([\d.]+) ([\d.]+)$', line)
+            if m and int(m.group(1)) in done:
+                done[int(m.group(1))] = (int(m.group(2)), float(m.group(4)) - float(m.group(3)))
+        results = [(hooks[i][0], *done[i]) for i in range(len(hooks))]
+    for (cmdline, rc, elapsed) in results:
+        metrics.observe('buildbot_hook_seconds', elapsed, help='hook wall time', stage=stage)
+        if rc == 0:
+            logger.info(f'{stage} hook finished in {elapsed:.1f}s: {cmdline}')
+        else:
+            logger.error(f'{stage} hook failed with {rc} after {elapsed:.1f}s: {cmdline}')
+    return results
+
 def run_cmd(cmd, cwd=None, keepalive=False, KEEPALIVE_TIMEOUT=30, RUN_CMD_TIMEOUT=60,
-            logfile=None, short_return=False):
+            logfile=None, short_return=False, stream=None):
     logger.debug('run_cmd: %s', cmd)
+    started = perf_counter()
     RUN_CMD_LOOP_TIME = KEEPALIVE_TIMEOUT - 1 if KEEPALIVE_TIMEOUT >= 10 else 5
     stopped = False
     last_read = [int(time()), ""]
     class Output(list):
-        def __init__(self, logfile=None, short_return=False):
+        def __init__(self, logfile=None, short_return=False, stream=None):
             super().__init__()
             self.__short_return = short_return
+            self.__stream = stream
             if logfile:
                 assert issubclass(type(logfile), os.PathLike)
                 self.__file = open(logfile, 'w')
@@ -80,13 +219,15 @@ def run_cmd(cmd, cwd=None, keepalive=False, KEEPALIVE_TIMEOUT=30, RUN_CMD_TIMEOU
             if self.__file and type(mystring) is str:
                 self.__file.write(mystring)
                 self.__file.flush()
+            if self.__stream:
+                logstream.publish(self.__stream, mystring)
         def __enter__(self):
             return self
         def __exit__(self, type, value, traceback):
             if self.__file:
                 self.__file.close()
     stdout_lock = Lock()
-    with Output(logfile=logfile, short_return=short_return) as output:
+    with Output(logfile=logfile, short_return=short_return, stream=stream) as output:
         @background
         def check_stdout(stdout):
             nonlocal stopped, last_read, output
@@ -145,7 +286,11 @@ def run_cmd(cmd, cwd=None, keepalive=False, KEEPALIVE_TIMEOUT=30, RUN_CMD_TIMEOU
         stdout_lock.acquire(10)
         outstr = ''.join(output)
 
+    mname = os.path.basename(str(cmd[0]))
+    metrics.observe('buildbot_run_cmd_seconds', perf_counter() - started,
+                    help='run_cmd wall time by executable', cmd=mname)
     if code != 0:
+        metrics.inc('buildbot_run_cmd_failures_total', help='run_cmd non-zero exits', cmd=mname)
         raise subprocess.CalledProcessError(code, cmd, outstr)
     if logfile:
         logger.debug('run_cmd: logfile written to %s', str(logfile))
@@ -154,6 +299,128 @@ def run_cmd(cmd, cwd=None, keepalive=False, KEEPALIVE_TIMEOUT=30, RUN_CMD_TIMEOU
     return outstr
 
 
+def gpg_sign(fpaths, cmd=GPG_SIGN_CMD, workers=GPG_SIGN_WORKERS):
+    '''
+        detach-sign files concurrently, each one next to its sig
+        raises CalledProcessError if any of them fails
+    '''
+    assert type(fpaths) is list
+    def sign(fpath):
+        assert issubclass(type(fpath), os.PathLike)
+        with metrics.timer('buildbot_gpg_seconds', help='gpg wall time per file', op='sign'):
+            return bash(f'{cmd} {fpath.name}', cwd=fpath.parent)
+    if not fpaths:
+        return
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(fpaths)))) as executor:
+        for _ in executor.map(tracing.wrap(sign), fpaths):
+            pass
+
+def gpg_verify(pairs, cmd=GPG_VERIFY_CMD, workers=GPG_VERIFY_WORKERS):
+    '''
+        verify a list of (sigpath, pkgpath) concurrently
+        returns a list of pkgpaths which failed verification
+    '''
+    assert type(pairs) is list
+    def verify(pair):
+        (sigpath, pkgpath) = pair
+        try:
+            with metrics.timer('buildbot_gpg_seconds', help='gpg wall time per file', op='verify'):
+                bash(f'{cmd} {sigpath} {pkgpath}')
+        except subprocess.CalledProcessError:
+            metrics.inc('buildbot_gpg_verify_failures_total', help='packages failing gpg --verify')
+            logger.error(f'{pkgpath} GPG verify error')
+            return pkgpath
+        return None
+    if not pairs:
+        return list()
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(pairs)))) as executor:
+        return [f for f in executor.map(tracing.wrap(verify), pairs) if f is not None]
+
+
+class __recordCollector(logging.Handler):
+    '''
+        keep log records of a pool process, ready to be pickled
+    '''
+    def __init__(self):
+        super().__init__(level=logging.DEBUG)
+        self.records = list()
+    def emit(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        self.records.append(record)
+
+__pool_collector = None
+__pool_cwd = None
+
+def __pool_init(level, cwd):
+    global __pool_collector, __pool_cwd
+    __pool_collector = __recordCollector()
+    __pool_cwd = cwd
+    mylogger = logging.getLogger('buildbot')
+    for handler in list(mylogger.handlers):
+        mylogger.removeHandler(handler)
+    mylogger.addHandler(__pool_collector)
+    mylogger.setLevel(level)
+
+def __pool_call(func, item):
+    '''
+        returns (result, error, records)
+    '''
+    # importing func may have changed it, see repo.py
+    os.chdir(__pool_cwd)
+    __pool_collector.records = list()
+    (result, error) = (None, None)
+    try:
+        result = func(item)
+    except Exception:
+        error = format_exc_plus()
+    return (result, error, __pool_collector.records)
+
+def pool_map(func, items, jobs=1, cwd=None):
+    '''
+        run func(item) in up to jobs processes, in cwd (defaults to the current one)
+        log records of the processes are handled here, one item after another
+        returns [(item, result, error)], error is a traceback or None
+        func must be importable, so must be the __main__ module (it is spawned),
+        which is imported again in every process: keep its side effects
+        (loggers, threads, servers) under if __name__ == '__main__'
+        jobs=1 runs everything here
+    '''
+    assert type(items) is list
+    jobs = max(1, min(jobs, len(items)))
+    if jobs == 1:
+        rets = list()
+        for item in items:
+            try:
+                rets.append((item, func(item), None))
+            except Exception:
+                rets.append((item, None, format_exc_plus()))
+        return rets
+    mylogger = logging.getLogger('buildbot')
+    level = mylogger.getEffectiveLevel()
+    cwd = str(cwd) if cwd else os.getcwd()
+    # fork is unsafe with the logging and listener threads around
+    context = multiprocessing.get_context('spawn')
+    rets = list()
+    with ProcessPoolExecutor(max_workers=jobs, mp_context=context,
+                             initializer=__pool_init, initargs=(level, cwd)) as executor:
+        futures = [executor.submit(__pool_call, func, item) for item in items]
+        for (item, future) in zip(items, futures):
+            try:
+                (result, error, records) = future.result()
+            except Exception:
+                (result, error, records) = (None, format_exc_plus(), list())
+            for record in records:
+                recordlogger = logging.getLogger(record.name)
+                if recordlogger.isEnabledFor(record.levelno):
+                    recordlogger.handle(record)
+            rets.append((item, result, error))
+    return rets
+
+
 # pyalpm is an alternative
 # due to lack of documentation i'll consider this later.
 
@@ -162,11 +429,86 @@ def vercmp(ver1, ver2):
     compare ver1 and ver2, return 1, -1, 0
     see https://www.archlinux.org/pacman/vercmp.8.html
     '''
-    res = run_cmd(['vercmp', str(ver1), str(ver2)])
+    with metrics.timer('buildbot_vercmp_seconds', help='vercmp wall time'), \
+         tracing.span('vercmp'):
+        res = run_cmd(['vercmp', str(ver1), str(ver2)])
     res = res.strip()
     if res in ('-1', '0', '1'):
         return int(res)
 
+__ALPHA = frozenset('abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ')
+__DIGIT = frozenset('0123456789')
+
+def __rpmvercmp(a, b):
+    '''
+        rpmvercmp of libalpm, segment by segment
+    '''
+    if a == b:
+        return 0
+    alnum = __ALPHA | __DIGIT
+    (one, two) = (0, 0)
+    (ptr1, ptr2) = (0, 0)
+    while one < len(a) or two < len(b):
+        while one < len(a) and a[one] not in alnum:
+            one += 1
+        while two < len(b) and b[two] not in alnum:
+            two += 1
+        if one >= len(a) or two >= len(b):
+            break
+        # separators of different length
+        if one - ptr1 != two - ptr2:
+            return -1 if one - ptr1 < two - ptr2 else 1
+        (ptr1, ptr2) = (one, two)
+        isnum = a[ptr1] in __DIGIT
+        chars = __DIGIT if isnum else __ALPHA
+        while ptr1 < len(a) and a[ptr1] in chars:
+            ptr1 += 1
+        while ptr2 < len(b) and b[ptr2] in chars:
+            ptr2 += 1
+        (seg1, seg2) = (a[one:ptr1], b[two:ptr2])
+        # segments of different types, numbers are newer
+        if not seg2:
+            return 1 if isnum else -1
+        if isnum:
+            (seg1, seg2) = (seg1.lstrip('0'), seg2.lstrip('0'))
+            if len(seg1) != len(seg2):
+                return 1 if len(seg1) > len(seg2) else -1
+        if seg1 != seg2:
+            return 1 if seg1 > seg2 else -1
+        (one, two) = (ptr1, ptr2)
+    (rest1, rest2) = (a[one:], b[two:])
+    if not rest1 and not rest2:
+        return 0
+    # a remaining alpha string never beats an empty one
+    if (not rest1 and rest2[0] not in __ALPHA) or (rest1 and rest1[0] in __ALPHA):
+        return -1
+    return 1
+
+def __parse_evr(evr):
+    '''
+        [epoch:]version[-release] => (epoch, version, release)
+    '''
+    m = re.match(r'(\d*):(.*)', evr)
+    (epoch, rest) = (m.group(1) or '0', m.group(2)) if m else ('0', evr)
+    (version, sep, release) = rest.rpartition('-')
+    return (epoch, version, release) if sep else (epoch, rest, None)
+
+def alpm_vercmp(ver1, ver2):
+    '''
+    vercmp without a subprocess, same results as the pacman one
+    '''
+    (ver1, ver2) = (str(ver1), str(ver2))
+    if ver1 == ver2:
+        return 0
+    (epoch1, version1, release1) = __parse_evr(ver1)
+    (epoch2, version2, release2) = __parse_evr(ver2)
+    ret = __rpmvercmp(epoch1, epoch2)
+    if ret == 0:
+        ret = __rpmvercmp(version1, version2)
+        if ret == 0 and release1 is not None and release2 is not None:
+            ret = __rpmvercmp(release1, release2)
+    return ret
+
 class Pkg:
     def __init__(self, pkgname, pkgver, pkgrel, arch, fname):
         self.pkgname = pkgname
@@ -218,14 +560,60 @@ def get_arch_from_pkgbuild(fpath):
                 return matches
     raise TypeError('Unexpected PKGBUILD')
 
+def get_pkgbase_from_pkgbuild(fpath):
+    '''
+        pkgbase, or the first pkgname, None when it is not a plain string
+    '''
+    assert issubclass(type(fpath), os.PathLike)
+    names = dict()
+    with open(fpath, 'r') as f:
+        for line in f.read().split('\n'):
+            m = re.match(r'(pkgbase|pkgname)=\(?\s*[\'"]?([\w@.+-]+)[\'"]?[\s)]', line + ' ')
+            if m:
+                names.setdefault(m.group(1), m.group(2))
+    return names.get('pkgbase', names.get('pkgname', None))
+
+__exc_repr = reprlib.Repr()
+__exc_repr.maxstring = EXC_REPR_MAXSTRING
+__exc_repr.maxother = EXC_REPR_MAXSTRING
+__exc_lock = Lock()
+# exception signature => [first seen, count]
+__exc_seen = dict()
+
+def __exc_signature(exc_info):
+    (etype, _, tb) = exc_info
+    frames = [(f.filename, f.lineno) for f in traceback.extract_tb(tb)]
+    sig = repr((getattr(etype, '__qualname__', str(etype)), frames))
+    return hashlib.sha1(sig.encode('utf-8')).hexdigest()[:12]
+
 def print_exc_plus():
-    logger.critical("Exception caught.\nPrinting stack traceback\n" + format_exc_plus())
+    '''
+        log the current exception with locals,
+        the same exception raised again within EXC_DEDUP_WINDOW
+        is only counted and logged in one line
+    '''
+    exc_info = sys.exc_info()
+    sig = __exc_signature(exc_info)
+    now = time()
+    with __exc_lock:
+        for old in [k for (k, v) in __exc_seen.items() if now - v[0] > EXC_DEDUP_WINDOW]:
+            del __exc_seen[old]
+        seen = __exc_seen.setdefault(sig, [now, 0])
+        seen[1] += 1
+        count = seen[1]
+    if count > 1:
+        last = traceback.format_exception_only(*exc_info[:2])[-1].strip()
+        logger.critical(f"Exception caught [{sig}] x{count} within {EXC_DEDUP_WINDOW}s: {last}")
+    else:
+        logger.critical(f"Exception caught [{sig}].\nPrinting stack traceback\n" + format_exc_plus())
 
-def format_exc_plus():
+def format_exc_plus(max_frames=EXC_MAX_FRAMES, max_locals=EXC_MAX_LOCALS):
     """
     Print the usual traceback information, followed by a listing of all the
     local variables in each frame.
     from Python Cookbook by David Ascher, Alex Martelli
+    only the innermost max_frames frames are listed and values are shortened
+    with reprlib
     """
     ret = str()
     tb = sys.exc_info()[2]
@@ -235,17 +623,18 @@ def format_exc_plus():
         tb = tb.tb_next
     stack = []
     f = tb.tb_frame
-    while f:
+    while f and len(stack) < max_frames:
         stack.append(f)
         f = f.f_back
     stack.reverse()
     ret += traceback.format_exc()
-    ret += "\nLocals by frame, innermost last\n"
+    ret += f"\nLocals by frame, innermost last{' (truncated)' if f else ''}\n"
     for frame in stack:
         ret += "Frame %s in %s at line %s\n" % (frame.f_code.co_name,
                                                 frame.f_code.co_filename,
                                                 frame.f_lineno)
-        for key, value in frame.f_locals.items(  ):
+        f_locals = list(frame.f_locals.items())
+        for key, value in f_locals[:max_locals]:
             ret += "\t%20s = " % key
             # We have to be VERY careful not to cause a new error in our error
             # printer! Calling str(  ) on an unknown object could cause an
@@ -253,22 +642,49 @@ def format_exc_plus():
             # we can't stop it from happening, but we can and should
             # stop it from propagating if it does happen!
             try:
-                ret += str(value)
+                ret += __exc_repr.repr(value)
             except:
                 ret += "<ERROR WHILE PRINTING VALUE>"
             ret += '\n'
+        if len(f_locals) > max_locals:
+            ret += f"\t... {len(f_locals) - max_locals} more locals\n"
     return ret
 
 def configure_logger(logger, format='%(asctime)s - %(name)-18s - %(levelname)s - %(message)s',
                      level=logging.INFO, logfile=None, flevel=logging.DEBUG, rotate_size=None,
-                     enable_notify=False, consolelog=None):
+                     enable_notify=False, consolelog=None, streamlog=False, background=False):
+    '''
+        background: handlers run in one writer thread fed by a bounded queue,
+        records are dropped (and counted) instead of blocking when it is full
+    '''
 
     class NotifyHandler(logging.NullHandler):
         def handle(self, record):
-            send(self.formatter.format(record))
+            if self.filter(record):
+                send(self.formatter.format(record))
+
+    class LogStreamHandler(logging.Handler):
+        def __init__(self, channel):
+            super().__init__()
+            self.channel = channel
+        def emit(self, record):
+            try:
+                logstream.publish(self.channel, self.format(record) + '\n')
+            except Exception:
+                self.handleError(record)
+
+    class DroppingQueueHandler(logging.handlers.QueueHandler):
+        dropped = 0
+        def enqueue(self, record):
+            try:
+                self.queue.put_nowait(record)
+            except queue.Full:
+                self.dropped += 1
+                metrics.inc('buildbot_log_records_dropped_total', help='log records dropped, queue full')
 
     logger.setLevel(logging.DEBUG)
     formatter = logging.Formatter(fmt=format)
+    handlers = list()
     # create file handler
     if logfile:
         assert type(logfile) is str
@@ -278,28 +694,45 @@ def configure_logger(logger, format='%(asctime)s - %(name)-18s - %(levelname)s -
         else:
             fh = logging.FileHandler(logfile)
         fh.setLevel(flevel)
-        fh.setFormatter(formatter)
-        logger.addHandler(fh)
+        handlers.append(fh)
     # create console handler
     ch = logging.StreamHandler()
     ch.setLevel(level)
-    ch.setFormatter(formatter)
-    logger.addHandler(ch)
+    handlers.append(ch)
     # for client.printlog
     if consolelog:
         assert type(consolelog) is str
         cfh = logging.FileHandler(consolelog)
         cfh.setLevel(level)
-        cfh.setFormatter(formatter)
-        logger.addHandler(cfh)
+        handlers.append(cfh)
+    # for client.printlog, live
+    if streamlog:
+        for (channel, clevel) in (('console', level), ('debug', flevel)):
+            sh = LogStreamHandler(channel)
+            sh.setLevel(clevel)
+            handlers.append(sh)
     # notify
     if enable_notify:
         try:
-            from notify import send
+            from notify import send, flush
         except ModuleNotFoundError:
             print('Failed to import notify.send')
         else:
             nh = NotifyHandler()
             nh.setLevel(level)
-            nh.setFormatter(formatter)
-            logger.addHandler(nh)
+            handlers.append(nh)
+            # atexit runs this after listener.stop below, which hands over the last records
+            atexit.register(flush, wait=True)
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    if background:
+        qh = DroppingQueueHandler(queue.Queue(maxsize=LOG_QUEUE_SIZE))
+        qh.setLevel(min([h.level for h in handlers]))
+        listener = logging.handlers.QueueListener(qh.queue, *handlers,
+                                                  respect_handler_level=True)
+        listener.start()
+        atexit.register(listener.stop)
+        logger.addHandler(qh)
+    else:
+        for handler in handlers:
+            logger.addHandler(handler)
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# wire.py: Automatic management tool for an arch repo.
+# This file is part of Buildbot by JerryXiao
+
+# the rpc wire format of buildbot.py, repod.py and worker.py
+# multiprocessing.connection still frames every message (a length prefix)
+# and checks the authkey, only the payload is no longer a pickle:
+#   b'J' + json
+#   b'Z' + zlib(json), for payloads of RPC_COMPRESS_MIN bytes or more
+# nothing received is ever unpickled. tuples arrive as lists, paths as
+# str and objects with a to_dict() as that dict.
+# select() and page() are the field selection and pagination of the list
+# endpoints.
+# serve() answers the calls on a listener, one thread per connection.
+
+import json
+import zlib
+import socket
+import logging
+from pathlib import PurePath
+from threading import Thread
+
+from config import RPC_COMPRESS_MIN, RPC_COMPRESS_LEVEL, RPC_MAX_MESSAGE
+
+from utils import print_exc_plus
+
+import metrics
+import tracing
+
+logger = logging.getLogger(f'buildbot.{__name__}')
+
+PLAIN = b'J'
+COMPRESSED = b'Z'
+
+class wireError(Exception):
+    pass
+
+def __default(obj):
+    if isinstance(obj, PurePath):
+        return str(obj)
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    if hasattr(obj, 'to_dict'):
+        return obj.to_dict()
+    raise TypeError(f'{type(obj).__name__} cannot be sent: {obj!r:.100}')
+
+def encode(obj, compress_min=RPC_COMPRESS_MIN):
+    data = json.dumps(obj, separators=(',', ':'), ensure_ascii=False,
+                      default=__default).encode('utf-8')
+    if compress_min is not None and len(data) >= compress_min:
+        return COMPRESSED + zlib.compress(data, RPC_COMPRESS_LEVEL)
+    return PLAIN + data
+
+def decode(data):
+    tag = data[:1]
+    try:
+        if tag == COMPRESSED:
+            # bounded, a small message must not inflate without limit
+            inflater = zlib.decompressobj()
+            payload = inflater.decompress(data[1:], RPC_MAX_MESSAGE)
+            if inflater.unconsumed_tail:
+                raise wireError(f'message larger than {RPC_MAX_MESSAGE} bytes')
+            return json.loads(payload)
+        if tag == PLAIN:
+            return json.loads(data[1:])
+    except (ValueError, zlib.error) as err:
+        raise wireError(f'bad message: {err}')
+    raise wireError(f'unknown message type {tag!r}')
+
+def nodelay(conn):
+    '''
+        a client sends its request right after the last handshake message,
+        with nagle on it then waits for the delayed ack (40ms on linux)
+    '''
+    try:
+        sock = socket.fromfd(conn.fileno(), socket.AF_INET, socket.SOCK_STREAM)
+    except OSError:
+        return conn
+    try:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    except OSError:
+        # not tcp
+        pass
+    finally:
+        # a dup of the fd
+        sock.close()
+    return conn
+
+def send(conn, obj):
+    data = encode(obj)
+    conn.send_bytes(data)
+    metrics.inc('rpc_wire_bytes_total', len(data), help='rpc bytes on the wire',
+                direction='sent', compressed=data[:1] == COMPRESSED)
+
+def recv(conn):
+    '''
+        raises wireError for anything but a message of this module
+    '''
+    try:
+        data = conn.recv_bytes(RPC_MAX_MESSAGE)
+    except OSError as err:
+        # also what recv_bytes raises for a message over maxlength
+        raise wireError(f'unable to receive: {err}')
+    metrics.inc('rpc_wire_bytes_total', len(data), help='rpc bytes on the wire',
+                direction='received', compressed=data[:1] == COMPRESSED)
+    return decode(data)
+
+def handle(conn, run):
+    '''
+        answer the call on conn: run(funcname, args=args, kwargs=kwargs)
+        a call is [funcname, args, kwargs] or [funcname, args, kwargs, trace context]
+    '''
+    with conn:
+        try:
+            myrecv = recv(conn)
+            if type(myrecv) is list and len(myrecv) in (3, 4):
+                (funcname, args, kwargs) = myrecv[:3]
+                funcname = str(funcname)
+                ctx = myrecv[3] if len(myrecv) == 4 and type(myrecv[3]) is dict else dict()
+                with tracing.trace(ctx.get('trace_id', None), ctx.get('parent_id', None)), \
+                     tracing.span(f'rpc.{funcname}'):
+                    ret = run(funcname, args=args, kwargs=kwargs)
+                send(conn, ret)
+        except Exception:
+            print_exc_plus()
+
+def serve(listener, run):
+    '''
+        one thread per connection, a slow call does not hold up the others
+        never returns
+    '''
+    while True:
+        try:
+            conn = listener.accept()
+        except Exception:
+            print_exc_plus()
+            continue
+        logger.debug('connection accepted from %s', listener.last_accepted)
+        tr = Thread(target=handle, args=(conn, run))
+        tr.daemon = True
+        tr.start()
+
+def select(obj, fields):
+    '''
+        keep only fields of a dict, None keeps everything
+    '''
+    if fields is None or type(obj) is not dict:
+        return obj
+    return {k: obj[k] for k in fields if k in obj}
+
+def page(items, offset=0, limit=None):
+    '''
+        items: a list or a dict (in its order)
+        returns {'items': ..., 'total': n, 'next': offset of the next page or None}
+    '''
+    offset = max(0, int(offset or 0))
+    end = len(items) if limit is None else min(len(items), offset + max(0, int(limit)))
+    if type(items) is dict:
+        keys = list(items)[offset:end]
+        selected = {k: items[k] for k in keys}
+    else:
+        selected = list(items[offset:end])
+    return {'items': selected, 'total': len(items), 'next': end if end < len(items) else None}
@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# worker.py: Automatic management tool for an arch repo.
+# This file is part of Buildbot by JerryXiao
+
+# a build worker on another host
+# it registers with the master, pulls jobs, builds them with its own
+# BUILD_EXECUTORS and uploads to repod itself. makepkg output goes to
+# the master with every heartbeat.
+# it can also run the commands of a remote executor (see executor.py)
+
+import logging
+from multiprocessing.connection import Listener
+from threading import Thread, Lock, Event
+from time import time
+import socket
+import os
+
+abspath=os.path.abspath(__file__)
+abspath=os.path.dirname(abspath)
+os.chdir(abspath)
+
+from config import WORKER_BIND_ADDRESS, WORKER_BIND_PASSWD, WORKER_NAME, \
+                   WORKER_ARCHS, WORKER_CAPACITY, WORKER_PULL_INTERVAL, \
+                   WORKER_HEARTBEAT, MASTER_BIND_ADDRESS, MASTER_BIND_PASSWD, \
+                   GIT_PULL, RPC_BACKLOG
+
+from utils import configure_logger, print_exc_plus, bash, logstream
+
+from client import run as rrun
+
+from yamlparse import load_one as load_one_yaml
+
+import builder
+import executor
+import metrics
+import tracing
+import wire
+
+logger = logging.getLogger(f'buildbot.{__name__}')
+
+# what __rpc returns when the master could not be reached
+RPC_FAILED = object()
+
+def execute(arch, cmdline, cwd=None, **kwargs):
+    '''
+        returns (returncode, output)
+    '''
+    try:
+        return (0, executor.run(arch, cmdline, cwd=cwd, **kwargs))
+    except executor.CalledProcessError as err:
+        return (err.returncode if err.returncode else 1, err.output if err.output else '')
+
+def run(funcname, args=list(), kwargs=dict()):
+    if funcname in ('execute',):
+        logger.info('running: %s %s %s', funcname, args, kwargs)
+        ret = eval(funcname)(*args, **kwargs)
+        logger.info('done: %s %s', funcname, ret[0] if type(ret) is tuple else ret)
+        return ret
+    else:
+        logger.error('unexpected: %s %s %s', funcname, args, kwargs)
+        return False
+
+def serve(address=WORKER_BIND_ADDRESS, authkey=WORKER_BIND_PASSWD):
+    '''
+        one thread per connection, builds may take hours
+    '''
+    with Listener(address, authkey=authkey, backlog=RPC_BACKLOG) as listener:
+        wire.serve(listener, run)
+
+class buildWorker:
+    '''
+        build: function(jobdict), the default one builds and uploads,
+        a failing build raises
+    '''
+    def __init__(self, worker_id=None, arches=WORKER_ARCHS, capacity=WORKER_CAPACITY,
+                 master=(MASTER_BIND_ADDRESS, MASTER_BIND_PASSWD), build=None,
+                 pull_interval=WORKER_PULL_INTERVAL):
+        self.worker_id = worker_id if worker_id else (WORKER_NAME or socket.gethostname())
+        self.arches = list(arches)
+        self.capacity = capacity
+        self.master = master
+        self.build = build if build else self.__build
+        self.pull_interval = pull_interval
+        self.heartbeat = WORKER_HEARTBEAT
+        # job_id => jobdict
+        self.running = dict()
+        # job_id => (success, message), results the master has not got yet
+        self.__results = dict()
+        self.__lock = Lock()
+        self.__results_lock = Lock()
+        self.__dirlocks = dict()
+        self.__registered = False
+        self.__stop = Event()
+        self.__sub_id = None
+    def __repr__(self):
+        return f'buildWorker({self.worker_id}, arches={self.arches}, running={list(self.running)})'
+    def __rpc(self, funcname, *args, **kwargs):
+        return rrun(funcname, args=args, kwargs=kwargs, server=self.master, max_retries=0,
+                    failed=RPC_FAILED)
+    def register(self):
+        ret = self.__rpc('worker_register', self.worker_id, self.arches, capacity=self.capacity)
+        if type(ret) in (int, float) and not type(ret) is bool:
+            self.heartbeat = ret
+            self.__registered = True
+            logger.info(f'registered as {self.worker_id}, heartbeat every {ret}s')
+            self.__send_results()
+        else:
+            self.__registered = False
+            logger.warning(f'unable to register with the master: {ret}')
+        return self.__registered
+    def __send_heartbeat(self):
+        lines = list()
+        if self.__sub_id:
+            ret = logstream.fetch(self.__sub_id)
+            if ret:
+                (lines, dropped) = ret
+                if dropped:
+                    lines.insert(0, f'[{dropped} lines dropped]\n')
+            else:
+                self.__sub_id = logstream.subscribe('makepkg')
+        self.__send_results()
+        with self.__lock:
+            # a finished job is still ours until the master has its result
+            running = list(self.running) + list(self.__results)
+        ret = self.__rpc('worker_heartbeat', self.worker_id, running=running, lines=lines)
+        if ret is RPC_FAILED:
+            # a busy or restarting master, it drops us only after WORKER_TIMEOUT
+            logger.warning('heartbeat not delivered')
+        elif ret is False:
+            logger.warning('the master does not know us, registering again')
+            self.register()
+    def __send_results(self):
+        '''
+            results not delivered are kept and sent again with the next heartbeat
+        '''
+        with self.__results_lock:
+            with self.__lock:
+                results = list(self.__results.items())
+            for (job_id, (success, message)) in results:
+                ret = self.__rpc('worker_done', self.worker_id, job_id, success, message=message)
+                if ret is RPC_FAILED:
+                    logger.warning(f'result of job {job_id} not delivered, keeping it')
+                    return False
+                if ret is False:
+                    logger.warning(f'the master did not expect the result of job {job_id}')
+                with self.__lock:
+                    self.__results.pop(job_id, None)
+        return True
+    def __heartbeat_loop(self):
+        while not self.__stop.wait(self.heartbeat):
+            try:
+                self.__send_heartbeat()
+            except Exception:
+                print_exc_plus()
+    def __dirlock(self, dirname):
+        with self.__lock:
+            return self.__dirlocks.setdefault(dirname, Lock())
+    def __build(self, jobdict):
+        pkgconfig = load_one_yaml(jobdict['dirname'])
+        if pkgconfig is None:
+            raise RuntimeError(f'no pkgconfig for {jobdict["dirname"]}')
+        job = builder.Job.from_dict(jobdict, pkgconfig)
+        builder.run_job(job)
+    def __run_one(self, jobdict):
+        (success, message) = (False, None)
+        try:
+            # multiarch jobs of a package share its directory
+            with self.__dirlock(jobdict['dirname']), \
+                 tracing.trace(jobdict.get('trace_id', None)), \
+                 tracing.span('job', pkg=jobdict['dirname'], arch=jobdict['arch'],
+                              version=jobdict['version'], worker=self.worker_id), \
+                 metrics.timer('buildbot_worker_job_seconds', help='build time on this worker',
+                               arch=jobdict['arch']):
+                self.build(jobdict)
+            success = True
+        except Exception as err:
+            message = f'{type(err).__name__}: {err}'
+            logger.error(f'job {jobdict} failed')
+            print_exc_plus()
+        finally:
+            with self.__lock:
+                self.running.pop(jobdict['job_id'], None)
+                self.__results[jobdict['job_id']] = (success, message)
+        self.__send_results()
+    def poll(self):
+        '''
+            ask for jobs if there are free slots
+            returns the number of jobs started
+        '''
+        with self.__lock:
+            slots = self.capacity - len(self.running)
+            idle = not self.running
+        if slots <= 0:
+            return 0
+        jobs = self.__rpc('worker_pull', self.worker_id, slots=slots)
+        if jobs is None:
+            # the master does not know us
+            self.register()
+            return 0
+        if type(jobs) is not list or not jobs:
+            return 0
+        if idle and self.build == self.__build:
+            # nothing is building, safe to update the tree
+            try:
+                bash(GIT_PULL, cwd=builder.REPO_ROOT)
+            except Exception:
+                print_exc_plus()
+        for jobdict in jobs:
+            logger.info(f'got job {jobdict}')
+            with self.__lock:
+                self.running[jobdict['job_id']] = jobdict
+            tr = Thread(target=self.__run_one, args=(jobdict,))
+            tr.daemon = True
+            tr.start()
+        return len(jobs)
+    def start(self):
+        '''
+            register and send heartbeats in the background,
+            then call poll() or run_forever()
+        '''
+        self.__sub_id = logstream.subscribe('makepkg')
+        self.register()
+        tr = Thread(target=self.__heartbeat_loop)
+        tr.daemon = True
+        tr.start()
+    def run_forever(self):
+        self.start()
+        while not self.__stop.is_set():
+            try:
+                if not self.__registered:
+                    self.register()
+                if not (self.__registered and self.poll()):
+                    self.__stop.wait(self.pull_interval)
+            except Exception:
+                print_exc_plus()
+                self.__stop.wait(self.pull_interval)
+    def stop(self, unregister=True):
+        '''
+            running builds are left alone
+        '''
+        self.__stop.set()
+        if unregister and self.__registered:
+            self.__rpc('worker_unregister', self.worker_id)
+        if self.__sub_id:
+            logstream.unsubscribe(self.__sub_id)
+
+if __name__ == '__main__':
+    configure_logger(logging.getLogger('buildbot'), logfile='worker.log',
+                     rotate_size=1024*1024*10, background=True)
+    logger.info('Buildbot.worker started.')
+    if WORKER_BIND_ADDRESS:
+        tr = Thread(target=serve)
+        tr.daemon = True
+        tr.start()
+    bw = buildWorker()
+    try:
+        bw.run_forever()
+    except KeyboardInterrupt:
+        logger.info('KeyboardInterrupt')
+        bw.stop()
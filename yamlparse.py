@@ -2,12 +2,16 @@
 # -*- coding: utf-8 -*-
 import os
 import logging
-from yaml import load, Loader
+from yaml import load
+try:
+    from yaml import CSafeLoader as Loader
+except ImportError:
+    from yaml import SafeLoader as Loader
 from pathlib import Path
 
 from utils import print_exc_plus
 
-from config import PKGBUILD_DIR, AUTOBUILD_FNAME
+from config import PKGBUILD_DIR, AUTOBUILD_FNAME, HOOK_MODE, HOOK_TIMEOUT
 
 logger = logging.getLogger(f'buildbot.{__name__}')
 
@@ -20,7 +24,7 @@ os.chdir(abspath)
 REPO_ROOT = Path(PKGBUILD_DIR)
 
 class pkgConfig:
-    def __init__(self, dirname, pkgtype, cleanbuild, timeout, priority, extra):
+    def __init__(self, dirname, pkgtype, cleanbuild, timeout, priority, extra, hooks=None):
         self.dirname = dirname
 
         self.type = pkgtype
@@ -35,6 +39,13 @@ class pkgConfig:
         # timeout in minutes
         self.priority = 0 if priority is None else int(priority)
 
+        hooks = dict() if hooks is None else hooks
+        assert type(hooks) is dict
+        self.hook_mode = hooks.get('mode', HOOK_MODE)
+        assert self.hook_mode in ('batch', 'serial', 'parallel')
+        self.hook_timeout = int(hooks.get('timeout', HOOK_TIMEOUT))
+        # timeout in minutes
+
         self.__extra = extra
         self.__process_extra()
 
@@ -47,8 +58,10 @@ class pkgConfig:
 
     def __process_extra(self):
         stages = ('prebuild', 'postbuild', 'update', 'failure')
+        self.__hook_timeouts = dict()
         for stage in stages:
             setattr(self, stage, list())
+            self.__hook_timeouts[stage] = list()
         if not self.__extra:
             return
         for entry in self.__extra:
@@ -57,40 +70,96 @@ class pkgConfig:
                 if k in stages:
                     cmd = entry.get(k, list())
                     assert type(cmd) is list
-                    setattr(self, k, cmd)
+                    cmds = list()
+                    timeouts = list()
+                    for c in cmd:
+                        # either a string or {cmd: str, timeout: mins}
+                        if type(c) is dict:
+                            cmds.append(c['cmd'])
+                            timeouts.append(int(c.get('timeout', self.hook_timeout)))
+                        else:
+                            cmds.append(c)
+                            timeouts.append(self.hook_timeout)
+                    setattr(self, k, cmds)
+                    self.__hook_timeouts[k] = timeouts
+
+    def hooks(self, stage):
+        '''
+            returns [(cmdline, timeout in secs)] for a stage
+        '''
+        return [(cmd, timeout*60) for (cmd, timeout) in
+                zip(getattr(self, stage), self.__hook_timeouts[stage]) if type(cmd) is str]
 
     def __repr__(self):
         ret = "pkgConfig("
         for myproperty in \
             (
                 'dirname', 'type', 'cleanbuild', 'timeout', 'priority',
+                'hook_mode', 'hook_timeout',
                 'prebuild', 'postbuild', 'update', 'failure'
             ):
             ret += f'{myproperty}={getattr(self, myproperty, None)},'
         ret += ')'
         return ret
 
+# dirname => ((st_mtime_ns, st_size), pkgConfig)
+# cold and warm load_all: python bench/run.py -b load_all
+__cache = dict()
+
+def __stat_key(fpath):
+    st = fpath.stat()
+    return (st.st_mtime_ns, st.st_size)
+
+def __parse(mydir, fpath):
+    with open(fpath, 'r') as f:
+        content = load(f, Loader=Loader)
+    assert type(content) is dict
+    args = [content.get(part, None) for part in \
+            ('type', 'cleanbuild', 'timeout', 'priority', 'extra', 'hooks')]
+    args = [mydir.name] + args
+    return pkgConfig(*args)
+
+def load_one(dirname):
+    '''
+        parse autobuild.yaml in REPO_ROOT / dirname
+        returns a cached pkgConfig if the file is unchanged,
+        None if there is no such file
+    '''
+    mydir = REPO_ROOT / dirname
+    fpath = mydir / AUTOBUILD_FNAME
+    try:
+        key = __stat_key(fpath)
+    except FileNotFoundError:
+        __cache.pop(mydir.name, None)
+        return None
+    cached = __cache.get(mydir.name, None)
+    if cached and cached[0] == key:
+        return cached[1]
+    logger.info('Bulidbot: found %s in %s', AUTOBUILD_FNAME, mydir)
+    pkgconfig = __parse(mydir, fpath)
+    __cache[mydir.name] = (key, pkgconfig)
+    return pkgconfig
+
+def clear_cache():
+    __cache.clear()
+
 def load_all():
     pkgconfigs = list()
+    seen = set()
     for mydir in REPO_ROOT.iterdir():
         try:
             if mydir.is_dir() and (not mydir.name.startswith('.')):
-                if (mydir / AUTOBUILD_FNAME).exists():
-                    # parsing yaml
-                    logger.info('Bulidbot: found %s in %s', AUTOBUILD_FNAME, mydir)
-                    with open(mydir / AUTOBUILD_FNAME, 'r') as f:
-                        content = f.read()
-                        content = load(content, Loader=Loader)
-                        assert type(content) is dict
-                        args = [content.get(part, None) for part in \
-                                ('type', 'cleanbuild', 'timeout', 'priority', 'extra')]
-                        args = [mydir.name] + args
-                        pkgconfigs.append(pkgConfig(*args))
+                seen.add(mydir.name)
+                pkgconfig = load_one(mydir.name)
+                if pkgconfig:
+                    pkgconfigs.append(pkgconfig)
                 else:
                     logger.warning('Bulidbot: NO %s in %s', AUTOBUILD_FNAME, mydir)
         except Exception:
             logger.error(f'Error while parsing {AUTOBUILD_FNAME} for {mydir.name}')
             print_exc_plus()
+    for dirname in [d for d in __cache if d not in seen]:
+        del __cache[dirname]
     return pkgconfigs
 
 if __name__ == '__main__':